@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Bump when the way we build cache keys changes so old entries are ignored
+CACHE_KEY_VERSION = 1
+# DiskCache keeps running size totals; they are reconciled with the directory
+# (which other workers write to as well) at most this often
+DISK_RESCAN_SECONDS = 60
+# Eviction frees space down to this share of max_bytes so the next puts do not evict again
+DISK_EVICT_TARGET = 0.9
+
+def canonical_hash(obj, **settings):
+    """Return a stable SHA-256 hex digest of a JSON-like object plus settings"""
+    payload = {"v": CACHE_KEY_VERSION, "data": obj, "settings": settings}
+    # sort_keys + fixed separators make the encoding independent of dict order
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache bounded by item count and total bytes"""
+
+    def __init__(self, max_items=64, max_bytes=256 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return  # Never let a single entry flush the whole cache
+        with self._lock:
+            if key in self._data:
+                self._bytes -= len(self._data.pop(key))
+            self._data[key] = value
+            self._bytes += size
+            while len(self._data) > self.max_items or self._bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._bytes -= len(self._data.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"items": len(self._data), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+class DiskCache:
+    """Directory-backed byte cache shared by every process pointing at the same path.
+
+    Entries are written atomically (temp file + rename) so concurrent Streamlit
+    workers never see partial files. Eviction removes the least recently used
+    files (by mtime, refreshed on every hit) once the directory exceeds max_bytes.
+    The directory size is tracked as a running total; it is only walked for
+    eviction and for an occasional rescan that picks up other workers' writes.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, suffix=".bin", rescan_seconds=DISK_RESCAN_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.rescan_seconds = rescan_seconds
+        self.hits = 0
+        self.misses = 0
+        self._items = 0
+        self._bytes = 0
+        self._scanned_at = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        # Two-level fan-out keeps directory listings short
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(path, None)  # Mark as recently used for eviction
+        except OSError:
+            pass
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._rescan_if_stale()
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = None
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._items += replaced is None
+            self._bytes += len(value) - (replaced or 0)
+            over = self._bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def delete(self, key):
+        path = self._path(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self._items = max(0, self._items - 1)
+            self._bytes = max(0, self._bytes - size)
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(self.suffix):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue  # Removed by another worker meanwhile
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _set_totals(self, items, total):
+        with self._lock:
+            self._items = items
+            self._bytes = total
+            self._scanned_at = time.monotonic()
+
+    def _rescan_if_stale(self):
+        scanned_at = self._scanned_at
+        if scanned_at is not None and time.monotonic() - scanned_at < self.rescan_seconds:
+            return
+        entries = self._entries()
+        self._set_totals(len(entries), sum(size for _, size, _ in entries))
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        entries = self._entries()
+        items, total = len(entries), sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            target = self.max_bytes * DISK_EVICT_TARGET
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                items -= 1
+                total -= size
+                if total <= target:
+                    break
+        self._set_totals(items, total)
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._set_totals(0, 0)
+
+    def stats(self):
+        # Running totals: no directory walk per sidebar render
+        self._rescan_if_stale()
+        with self._lock:
+            return {"items": self._items, "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
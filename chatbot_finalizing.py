@@ -1,17 +1,48 @@
 import streamlit as st
-from llm_processor_for_app import parse_process_description, extract_json_from_response, get_llm
-from high_quality_generator import generate_high_quality_pfd_image  # Updated import
-from pfd_analyzer import analyze_uploaded_pfd, analyze_pfd_image
+import streamlit.components.v1 as components
+from llm_processor_for_app import (stream_process_description, repair_process_description, extract_json_from_response,
+                                   get_llm, STRUCTURED_OUTPUT)
+from flowsheet_stream import FlowsheetStreamParser
+from flowsheet_json import FlowsheetError
+from high_quality_generator import start_high_quality_pfd_render, export_high_quality_pfd  # Updated import
+from pfd_layout import EXPORT_FORMATS
+from process_graph import get_flow_analysis, process_hash
+from pfd_labels import equipment_record, stream_record, equipment_params, stream_params, generate_text_description
+from large_layout import is_large_flowsheet
+from hierarchical_view import group_units, render_block_diagram, render_section
+from deep_zoom import needs_deep_zoom, write_pyramid, pyramid_image_path, pyramid_download_url, viewer_html
+from render_cache import render_cache
+from llm_cache import llm_cache
+from render_pool import render_pool, RenderCancelled
+from pfd_analyzer import analyze_uploaded_pfd, stream_pfd_image, answer_chunks
+from semantic_cache import semantic_cache, pfd_key_for_text, pfd_key_for_bytes
+from prompt_builder import PROMPT_VARIANT, prompt_tokens
+from token_usage import usage_tracker, usage_callback
+from conversation_memory import conversation_memory
+from flowsheet_index import flowsheet_context
+from image_payloads import image_payloads
+from pfd_fingerprint import fingerprint_store
+from vision_extraction import extract_process_data
 from PIL import Image
 import base64
 from io import BytesIO
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+import re
 import time
+import uuid
 
 # Increase image pixel limit to avoid decompression bomb warnings
 Image.MAX_IMAGE_PIXELS = 200000000
 
+# Seconds between reruns while a background render is in progress
+RENDER_POLL_INTERVAL = 1.0
+# Seconds before a PFD whose structure could not be read is tried again (not on every rerun)
+STRUCTURE_RETRY_SECONDS = 30
+PREVIEW_CAPTION = "AI-Generated PFD (preview, full quality rendering...)"
+FULL_QUALITY_CAPTION = "AI-Generated PFD (Ultra High Quality)"
+DEEP_ZOOM_VIEWER_HEIGHT = 600
+
 def main():
     st.title("🏭 AI-Powered PFD Generator & Analyzer")
     
@@ -27,6 +58,72 @@ def main():
         pfd_analyzer_page()
     else:  # PFD Verifier
         pfd_verifier_page()
+
+    show_cache_stats()
+
+def get_render_owner():
+    """Stable per-session id used to cancel this session's render jobs"""
+    if 'render_owner' not in st.session_state:
+        st.session_state.render_owner = uuid.uuid4().hex
+    return st.session_state.render_owner
+
+def show_flowsheet_progress(chunks):
+    """List equipment and streams as soon as each arrives in a streamed flowsheet.
+
+    Returns the parser, which holds the full answer text for extract_json_from_response.
+    """
+    parser = FlowsheetStreamParser()
+    placeholder = st.empty()
+    for chunk in chunks:
+        if not parser.feed(chunk):
+            continue
+        equipment = parser.items['equipment']
+        progress = f"**Equipment so far ({len(equipment)}):**\n" + "\n".join(
+            f"- **{equip.get('id', '?')}**: {equip.get('type', '')}" for equip in equipment)
+        if parser.items['streams']:
+            progress += f"\n\n**Streams so far:** {len(parser.items['streams'])}"
+        placeholder.markdown(progress)
+    placeholder.empty()
+    return parser
+
+def stream_answer(chunks):
+    """Show answer chunks in an assistant chat bubble as they arrive; return the full answer"""
+    with st.chat_message("assistant"):
+        return st.write_stream(chunks)
+
+def show_cache_stats():
+    """Show cache hit/miss counters in the sidebar"""
+    with st.sidebar.expander("⚙️ Cache statistics"):
+        stats = render_cache.stats()
+        st.write(f"**Render cache:** {stats['hits']} hits / {stats['misses']} misses "
+                 f"({stats['hit_rate']:.0%} hit rate)")
+        st.caption(f"Memory: {stats['memory']['items']} renders, {stats['memory']['bytes'] / 1e6:.1f} MB | "
+                   f"Disk: {stats['disk']['items']} renders, {stats['disk']['bytes'] / 1e6:.1f} MB")
+        stats = llm_cache.stats()
+        st.write(f"**LLM response cache:** {stats['hits']} hits / {stats['misses']} misses "
+                 f"({stats['hit_rate']:.0%} hit rate)")
+        st.caption(f"Expired: {stats['expired']} | Bypassed: {stats['bypassed']} | "
+                   f"Disk: {stats['disk']['items']} answers, {stats['disk']['bytes'] / 1e6:.1f} MB")
+        stats = semantic_cache.stats()
+        st.write(f"**Chat answer cache:** {stats['hits']} hits / {stats['misses']} misses "
+                 f"({stats['hit_rate']:.0%} hit rate)")
+        st.caption(f"{stats['questions']} questions across {stats['pfds']} PFDs | Bypassed: {stats['bypassed']}")
+        stats = image_payloads.stats()
+        st.write(f"**Image payload cache:** {stats['hits']} hits / {stats['encodes']} encodes")
+        st.caption(f"{stats['items']} payloads, {stats['bytes'] / 1e6:.1f} MB")
+        stats = fingerprint_store.stats()
+        st.caption(f"Uploaded drawings: {stats['drawings']} known | {stats['exact']} exact and "
+                   f"{stats['near']} confirmed-copy re-uploads | {stats['changed']} edited | {stats['new']} new")
+        stats = usage_tracker.stats()
+        st.write(f"**LLM tokens:** {stats['input_tokens']:,} in / {stats['output_tokens']:,} out "
+                 f"over {stats['calls']} calls ({stats['cached_tokens']:,} input tokens reported as provider cache reads)")
+        if stats['last']:
+            last = stats['last']
+            st.caption(f"Last call ({last['name']}): {last['input_tokens']:,} in / {last['output_tokens']:,} out"
+                       + (" (estimated)" if last['estimated'] else ""))
+        st.caption(f"Flowsheet system prompt: {PROMPT_VARIANT} variant, ~{prompt_tokens():,} tokens")
+        stats = conversation_memory.stats()
+        st.caption(f"Chat history summaries: {stats['summary_calls']} made, {stats['summary_hits']} reused")
 def pfd_analyzer_page():
     st.header("🔍 PFD Analyzer")
     st.subheader("Upload a PFD image and ask questions about it!")
@@ -48,13 +145,20 @@ def pfd_analyzer_page():
         # Display the uploaded image
         image = Image.open(uploaded_file)
         st.session_state.uploaded_pfd_image = image
+        # Answers are cached per file content; a confirmed copy of an earlier upload
+        # (re-saved or rescaled) starts with that upload's answers
+        st.session_state.uploaded_pfd_key = fingerprint_store.resolve(pfd_key_for_bytes(uploaded_file.getvalue()), image)
         st.image(image, caption="Uploaded PFD", use_column_width=True)
+        structure = uploaded_pfd_structure(image, st.session_state.uploaded_pfd_key)
         
         # Display chat messages
         for message in st.session_state.uploaded_pfd_chat_history:
             with st.chat_message(message["role"]):
                 st.write(message["content"])
         
+        fresh_answer = st.checkbox("Fresh answer (skip answers to similar questions)", value=False,
+                                   key="analyzer_fresh_answer")
+        
         # Create columns for predefined questions
         col1, col2, col3 = st.columns(3)
         
@@ -70,7 +174,9 @@ def pfd_analyzer_page():
                 
                 with st.spinner("Analyzing PFD..."):
                     try:
-                        answer = analyze_pfd_image(image, question)
+                        answer = stream_answer(stream_uploaded_pfd(
+                            st.session_state.uploaded_pfd_image, question, st.session_state.uploaded_pfd_chat_history,
+                            st.session_state.uploaded_pfd_key, structure, use_cache=not fresh_answer))
                         
                         # Add AI response to chat
                         st.session_state.uploaded_pfd_chat_history.append({
@@ -95,7 +201,9 @@ def pfd_analyzer_page():
                 
                 with st.spinner("Analyzing PFD..."):
                     try:
-                        answer = analyze_pfd_image(image, question)
+                        answer = stream_answer(stream_uploaded_pfd(
+                            st.session_state.uploaded_pfd_image, question, st.session_state.uploaded_pfd_chat_history,
+                            st.session_state.uploaded_pfd_key, structure, use_cache=not fresh_answer))
                         
                         # Add AI response to chat
                         st.session_state.uploaded_pfd_chat_history.append({
@@ -120,7 +228,9 @@ def pfd_analyzer_page():
                 
                 with st.spinner("Analyzing PFD..."):
                     try:
-                        answer = analyze_pfd_image(image, question)
+                        answer = stream_answer(stream_uploaded_pfd(
+                            st.session_state.uploaded_pfd_image, question, st.session_state.uploaded_pfd_chat_history,
+                            st.session_state.uploaded_pfd_key, structure, use_cache=not fresh_answer))
                         
                         # Add AI response to chat
                         st.session_state.uploaded_pfd_chat_history.append({
@@ -151,7 +261,9 @@ def pfd_analyzer_page():
                 
                 with st.spinner("Analyzing PFD..."):
                     try:
-                        answer = analyze_pfd_image(st.session_state.uploaded_pfd_image, question_input)
+                        answer = stream_answer(stream_uploaded_pfd(
+                            st.session_state.uploaded_pfd_image, question_input, st.session_state.uploaded_pfd_chat_history,
+                            st.session_state.uploaded_pfd_key, structure, use_cache=not fresh_answer))
                         
                         # Add AI response to chat
                         st.session_state.uploaded_pfd_chat_history.append({
@@ -204,6 +316,8 @@ def pfd_generator_page():
         st.session_state.generated_pfd = None
     if 'process_data' not in st.session_state:
         st.session_state.process_data = None
+    if 'process_hash' not in st.session_state:
+        st.session_state.process_hash = None
     if 'generated_pfd_image' not in st.session_state:
         st.session_state.generated_pfd_image = None
     if 'pfd_text_description' not in st.session_state:
@@ -212,6 +326,11 @@ def pfd_generator_page():
         st.session_state.chat_history = []
     if 'show_generation_form' not in st.session_state:
         st.session_state.show_generation_form = True
+    if 'pending_render' not in st.session_state:
+        st.session_state.pending_render = None
+    
+    # Swap in the full-quality render if it finished since the last rerun
+    poll_pending_render()
     
     # Display chat history
     for message in st.session_state.chat_history:
@@ -219,59 +338,53 @@ def pfd_generator_page():
             if "download_button" in message and message["download_button"]:
                 # Display message content
                 st.write(message["content"])
-                # Add download button
-                st.download_button(
-                    label="📥 Download PFD",
-                    data=message["image_data"],
-                    file_name=message["filename"],
-                    mime="image/png",
-                    key=message.get("key", f"download_{id(message)}")
-                )
+                if "download_url" in message:
+                    # Huge PFDs are served from disk instead of being held in the session
+                    st.markdown(f"[📥 Download PFD]({message['download_url']})")
+                else:
+                    # Add download button
+                    st.download_button(
+                        label="📥 Download PFD",
+                        data=message["image_data"],
+                        file_name=message["filename"],
+                        mime="image/png",
+                        key=message.get("key", f"download_{id(message)}")
+                    )
+                # Vector formats come from the same cached layout, no second dot layout
+                if message.get("process_data") is not None:
+                    show_export_buttons(message)
+            elif message.get("deep_zoom"):
+                st.write(message["content"])
+                # Tiled viewer: the browser only loads the tiles visible at the current zoom
+                components.html(viewer_html(message["deep_zoom"], DEEP_ZOOM_VIEWER_HEIGHT), height=DEEP_ZOOM_VIEWER_HEIGHT + 20)
+                st.caption(message.get("caption", "Generated PFD"))
             elif "image" in message and message["image"]:
                 st.image(message["image"], caption=message.get("caption", "Generated PFD"), use_column_width=True)
+            elif "section_view" in message:
+                st.write(message["content"])
+                show_section_view(message)
             elif "process_summary" in message:
                 # Display process summary
                 st.write(message["content"])
                 
-                # Count equipment and streams for quality info
-                num_equipment = len(message["process_data"]['equipment'])
-                num_streams = len(message["process_data"]['streams'])
-                
-                # Analyze for recycling
-                process_streams = message["process_data"]['streams']
-                recycles = set()
-                for stream in process_streams:
-                    for other_stream in process_streams:
-                        if stream['to'] == other_stream['from'] and stream['from'] == other_stream['to']:
-                            pair = tuple(sorted([stream['from'], stream['to']]))
-                            recycles.add(pair)
+                # Counts and recycles come from the memoized flow analysis, not recomputed per rerun
+                flow_analysis = get_flow_analysis(message["process_data"], message.get("process_hash"))
                 
                 col1, col2, col3 = st.columns(3)
                 with col1:
-                    st.metric("Equipment Count", num_equipment)
+                    st.metric("Equipment Count", flow_analysis.equipment_count)
                 with col2:
-                    st.metric("Stream Count", num_streams)
+                    st.metric("Stream Count", flow_analysis.stream_count)
                 with col3:
-                    st.metric("Recycle Loops", len(recycles))
+                    st.metric("Recycle Loops", len(flow_analysis.recycle_loops))
                 
                 st.subheader("Equipment")
                 for equip in message["process_data"]['equipment']:
-                    st.write(f"**{equip['id']}**: {equip['type']} - {equip['spec']}")
+                    record = equipment_record(equip)
+                    st.write(f"**{record.id}**: {record.type} - {record.spec}")
                     
                     # Show parameters if available
-                    params = []
-                    if 'temperature' in equip and equip['temperature']:
-                        params.append(f"T: {equip['temperature']}°C")
-                    if 'pressure' in equip and equip['pressure']:
-                        params.append(f"P: {equip['pressure']} bar")
-                    if 'flow_rate' in equip and equip['flow_rate']:
-                        params.append(f"Flow: {equip['flow_rate']} kg/hr")
-                    if 'duty' in equip and equip['duty']:
-                        params.append(f"Duty: {equip['duty']} kW")
-                    if 'efficiency' in equip and equip['efficiency']:
-                        params.append(f"Eff: {equip['efficiency']}%")
-                    if 'stages' in equip and equip['stages']:
-                        params.append(f"Stages: {equip['stages']}")
+                    params = equipment_params(record)
                     
                     if params:
                         st.write(f"&nbsp;&nbsp;&nbsp;&nbsp;Parameters: {', '.join(params)}")
@@ -281,32 +394,17 @@ def pfd_generator_page():
                 
                 # Analyze for recycling
                 process_streams = message["process_data"]['streams']
-                recycles = set()
-                for stream in process_streams:
-                    for other_stream in process_streams:
-                        if stream['to'] == other_stream['from'] and stream['from'] == other_stream['to']:
-                            pair = tuple(sorted([stream['from'], stream['to']]))
-                            recycles.add(pair)
+                flow_analysis = get_flow_analysis(message["process_data"], message.get("process_hash"))
                 
-                for stream in process_streams:
-                    stream_pair = tuple(sorted([stream['from'], stream['to']]))
-                    is_recycle = stream_pair in recycles
+                for stream_index, stream in enumerate(process_streams):
+                    is_recycle = flow_analysis.is_recycle(stream_index)
                     if is_recycle:
                         st.write(f"**🔄 {stream['id']}**: {stream['from']} → {stream['to']} ({stream['flow']} units) [RECYCLE]")
                     else:
                         st.write(f"**{stream['id']}**: {stream['from']} → {stream['to']} ({stream['flow']} units)")
                     
-                    # Show stream parameters
-                    params = []
-                    if 'temperature' in stream and stream['temperature']:
-                        params.append(f"T: {stream['temperature']}°C")
-                    if 'pressure' in stream and stream['pressure']:
-                        params.append(f"P: {stream['pressure']} bar")
-                    if 'flow_rate' in stream and stream['flow_rate']:
-                        params.append(f"Flow: {stream['flow_rate']} kg/hr")
-                    if 'composition' in stream and stream['composition']:
-                        comp = stream['composition'][:20] + "..." if len(stream['composition']) > 20 else stream['composition']
-                        params.append(f"Comp: {comp}")
+                    # Show stream parameters (flow is already in the line above)
+                    params = stream_params(stream_record(stream), include_flow=False)
                     
                     if params:
                         st.write(f"&nbsp;&nbsp;&nbsp;&nbsp;Parameters: {', '.join(params)}")
@@ -314,22 +412,11 @@ def pfd_generator_page():
                 # Display equipment
                 st.write(message["content"])
                 for equip in message["process_data"]['equipment']:
-                    st.write(f"**{equip['id']}**: {equip['type']} - {equip['spec']}")
+                    record = equipment_record(equip)
+                    st.write(f"**{record.id}**: {record.type} - {record.spec}")
                     
                     # Show parameters if available
-                    params = []
-                    if 'temperature' in equip and equip['temperature']:
-                        params.append(f"T: {equip['temperature']}°C")
-                    if 'pressure' in equip and equip['pressure']:
-                        params.append(f"P: {equip['pressure']} bar")
-                    if 'flow_rate' in equip and equip['flow_rate']:
-                        params.append(f"Flow: {equip['flow_rate']} kg/hr")
-                    if 'duty' in equip and equip['duty']:
-                        params.append(f"Duty: {equip['duty']} kW")
-                    if 'efficiency' in equip and equip['efficiency']:
-                        params.append(f"Eff: {equip['efficiency']}%")
-                    if 'stages' in equip and equip['stages']:
-                        params.append(f"Stages: {equip['stages']}")
+                    params = equipment_params(record)
                     
                     if params:
                         st.write(f"&nbsp;&nbsp;&nbsp;&nbsp;Parameters: {', '.join(params)}")
@@ -353,47 +440,87 @@ def pfd_generator_page():
             
             st.write("**Example 3:** Gas stream is compressed, cooled, and sent to absorption column. The lean solvent from the bottom is heated and sent to stripping column. The rich solvent from the top of stripping column is recycled back to absorption column.")
         
+        # Cached answers are reused for repeated descriptions unless bypassed
+        bypass_llm_cache = st.checkbox("Ask the AI again (ignore cached answer)", value=False)
+        # Schema-constrained answers parse reliably but arrive in one piece, without the live unit list
+        structured_output = st.checkbox("Structured output mode", value=STRUCTURED_OUTPUT)
+        
         col1, col2 = st.columns(2)
         with col1:
             if st.button("Generate PFD with AI", type="primary") and process_description:
                 with st.spinner("AI is analyzing your process description and generating PFD..."):
                     try:
                         # Parse process description using LLM
-                        llm_response = parse_process_description(process_description)
+                        # Streamed, so units are listed while the rest of the answer is generated
+                        stream_parser = show_flowsheet_progress(
+                            stream_process_description(process_description, use_cache=not bypass_llm_cache,
+                                                       structured=structured_output))
+                        llm_response = stream_parser.text
                         if llm_response:
-                            process_data = extract_json_from_response(llm_response)
+                            try:
+                                process_data = extract_json_from_response(stream_parser)
+                            except FlowsheetError as e:
+                                # One targeted repair call listing the exact problems, not a full regeneration
+                                st.warning(f"Fixing {len(e.errors)} problem(s) in the AI output...")
+                                llm_response = repair_process_description(process_description, llm_response, e.errors,
+                                                                          structured=structured_output)
+                                process_data = extract_json_from_response(llm_response)
 
                             if process_data:
                                 st.session_state.process_data = process_data
-                                
-                                # Generate HIGH-QUALITY PFD image
-                                pfd_image_bytes = generate_high_quality_pfd_image(process_data)
-                                st.session_state.generated_pfd = pfd_image_bytes
-                                
-                                # Store the image for analysis
-                                st.session_state.generated_pfd_image = Image.open(BytesIO(pfd_image_bytes))
+                                st.session_state.process_hash = process_hash(process_data)
                                 
                                 # Generate text description of the PFD for efficient chat
-                                text_description = generate_text_description(process_data)
+                                text_description = generate_text_description(process_data, st.session_state.process_hash)
                                 st.session_state.pfd_text_description = text_description
                                 
-                                # Add generated PFD to chat
-                                st.session_state.chat_history.append({
-                                    "role": "assistant",
-                                    "content": "I've generated the PFD based on your description. Here it is:",
-                                    "image": pfd_image_bytes,
-                                    "caption": "AI-Generated PFD (Ultra High Quality)"
-                                })
+                                if is_large_flowsheet(process_data):
+                                    # A full-plant image is unreadable and costly; start from the block diagram
+                                    block_diagram = render_block_diagram(process_data, owner=get_render_owner())
+                                    st.session_state.pending_render = None
+                                    st.session_state.generated_pfd = block_diagram
+                                    st.session_state.generated_pfd_image = Image.open(BytesIO(block_diagram))
+                                    st.session_state.chat_history.append({
+                                        "role": "assistant",
+                                        "content": "This is a large flowsheet, so here is the section overview. Pick a section to expand it into the detailed PFD:",
+                                        "section_view": True,
+                                        "process_data": process_data,
+                                        "process_hash": st.session_state.process_hash,
+                                        "key": f"sections_{uuid.uuid4().hex}"
+                                    })
+                                else:
+                                    # Start the HIGH-QUALITY render: a quick preview now, full DPI in the background
+                                    render_job = start_high_quality_pfd_render(process_data, owner=get_render_owner())
+                                    pfd_image_bytes = render_job.preview
+                                    render_id = uuid.uuid4().hex
+                                    # Finished (cached) renders are swapped in on the next rerun as well
+                                    st.session_state.pending_render = render_job
+                                    st.session_state.pending_render_id = render_id
+                                    st.session_state.generated_pfd = pfd_image_bytes
                                 
-                                # Add download button to chat
-                                st.session_state.chat_history.append({
-                                    "role": "assistant",
-                                    "content": "📥 Download your PFD",
-                                    "download_button": True,
-                                    "image_data": pfd_image_bytes,
-                                    "filename": f"ai_generated_pfd_ultra_{int(time.time())}.png",
-                                    "key": f"download_{int(time.time() * 1000000)}"
-                                })
+                                    # Store the image for analysis
+                                    st.session_state.generated_pfd_image = Image.open(BytesIO(pfd_image_bytes))
+                                
+                                    # Add generated PFD to chat
+                                    st.session_state.chat_history.append({
+                                        "role": "assistant",
+                                        "content": "I've generated the PFD based on your description. Here it is:",
+                                        "image": pfd_image_bytes,
+                                        "caption": PREVIEW_CAPTION,
+                                        "render_id": render_id
+                                    })
+                                
+                                    # Add download button to chat
+                                    st.session_state.chat_history.append({
+                                        "role": "assistant",
+                                        "content": "📥 Download your PFD",
+                                        "download_button": True,
+                                        "image_data": pfd_image_bytes,
+                                        "filename": f"ai_generated_pfd_ultra_{int(time.time())}.png",
+                                        "key": f"download_{int(time.time() * 1000000)}",
+                                        "render_id": render_id,
+                                        "process_data": process_data
+                                    })
                                 
                                 # Add success message to chat
                                 st.session_state.chat_history.append({
@@ -411,13 +538,22 @@ def pfd_generator_page():
                                 st.error("❌ Could not extract process data from description")
                         else:
                             st.error("❌ LLM response was empty")
+                    except RenderCancelled:
+                        st.info("PFD generation was cancelled")
+                    except FlowsheetError as e:
+                        st.error("❌ The AI output is not a valid flowsheet:\n" + "\n".join(f"- {error}" for error in e.errors))
                     except Exception as e:
                         st.error(f"❌ Error: {str(e)}")
         
         with col2:
             if st.button("Reset"):
+                # Stop any background render still running for this session (a synchronous
+                # layout or preview render has already finished once this click is handled)
+                render_pool.cancel(get_render_owner())
+                st.session_state.pending_render = None
                 st.session_state.generated_pfd = None
                 st.session_state.process_data = None
+                st.session_state.process_hash = None
                 st.session_state.generated_pfd_image = None
                 st.session_state.pfd_text_description = ""
                 st.session_state.chat_history = []
@@ -434,6 +570,7 @@ def pfd_generator_page():
         
         with col1:
             question_input = st.text_input("", key="question_input", placeholder="Ask a question about your PFD:")
+            st.checkbox("Fresh answer (skip answers to similar questions)", value=False, key="chat_fresh_answer")
         
         with col2:
             if st.button("↑", key="send_question_btn", help="Send question"):
@@ -447,12 +584,16 @@ def pfd_generator_page():
                             })
                             
                             # Use text-based analysis for efficiency
-                            answer = analyze_pfd_text(
+                            # Streamed so the answer appears as it is generated
+                            answer = stream_answer(stream_pfd_text(
                                 st.session_state.pfd_text_description, 
                                 question_input, 
                                 st.session_state.chat_history,
-                                st.session_state.generated_pfd_image  # Pass image for visual questions
-                            )
+                                st.session_state.generated_pfd_image,  # Pass image for visual questions
+                                use_cache=not st.session_state.get("chat_fresh_answer", False),
+                                pfd_key=st.session_state.process_hash,
+                                process_data=st.session_state.process_data
+                            ))
                             
                             # Add AI response to chat history
                             st.session_state.chat_history.append({
@@ -474,8 +615,11 @@ def pfd_generator_page():
         with col1:
             if st.button("Generate New PFD", key="generate_new_pfd_btn"):
                 # Clear only PFD-specific data, keep chat history
+                render_pool.cancel(get_render_owner())
+                st.session_state.pending_render = None
                 st.session_state.generated_pfd = None
                 st.session_state.process_data = None
+                st.session_state.process_hash = None
                 st.session_state.generated_pfd_image = None
                 st.session_state.pfd_text_description = ""
                 st.session_state.show_generation_form = True
@@ -494,7 +638,8 @@ def pfd_generator_page():
                     "role": "assistant",
                     "content": "### Process Summary",
                     "process_summary": True,
-                    "process_data": st.session_state.process_data
+                    "process_data": st.session_state.process_data,
+                    "process_hash": st.session_state.process_hash
                 })
                 
                 # Rerun to update the chat
@@ -513,7 +658,8 @@ def pfd_generator_page():
                     "role": "assistant",
                     "content": "### Equipment Details",
                     "equipment": True,
-                    "process_data": st.session_state.process_data
+                    "process_data": st.session_state.process_data,
+                    "process_hash": st.session_state.process_hash
                 })
                 
                 # Rerun to update the chat
@@ -532,123 +678,220 @@ def pfd_generator_page():
                     "role": "assistant",
                     "content": "### Stream Details",
                     "streams": True,
-                    "process_data": st.session_state.process_data
+                    "process_data": st.session_state.process_data,
+                    "process_hash": st.session_state.process_hash
+                })
+                
+                # Rerun to update the chat
+                st.rerun()
+        
+        with col5:
+            if st.button("Sections", key="sections_btn"):
+                # Add user message to chat
+                st.session_state.chat_history.append({
+                    "role": "user",
+                    "content": "Sections"
+                })
+                
+                # Add section overview to chat
+                st.session_state.chat_history.append({
+                    "role": "assistant",
+                    "content": "### Process Sections",
+                    "section_view": True,
+                    "process_data": st.session_state.process_data,
+                    "process_hash": st.session_state.process_hash,
+                    "key": f"sections_{uuid.uuid4().hex}"
                 })
                 
                 # Rerun to update the chat
                 st.rerun()
-def generate_text_description(process_data):
-    """Generate a text description of the PFD for efficient chat"""
-    description = "Process Flow Diagram Description:\n\n"
-    
-    # Equipment
-    description += "Equipment:\n"
-    for equip in process_data['equipment']:
-        description += f"- {equip['id']}: {equip['type']} - {equip['spec']}\n"
-        # Add parameters
-        params = []
-        if 'temperature' in equip and equip['temperature']:
-            params.append(f"T: {equip['temperature']}°C")
-        if 'pressure' in equip and equip['pressure']:
-            params.append(f"P: {equip['pressure']} bar")
-        if 'flow_rate' in equip and equip['flow_rate']:
-            params.append(f"Flow: {equip['flow_rate']} kg/hr")
-        if 'duty' in equip and equip['duty']:
-            params.append(f"Duty: {equip['duty']} kW")
-        if 'efficiency' in equip and equip['efficiency']:
-            params.append(f"Eff: {equip['efficiency']}%")
-        if 'stages' in equip and equip['stages']:
-            params.append(f"Stages: {equip['stages']}")
-        if params:
-            description += f"  Parameters: {', '.join(params)}\n"
-    
-    description += "\nStreams:\n"
-    for stream in process_data['streams']:
-        description += f"- {stream['id']}: {stream['from']} → {stream['to']} ({stream['flow']} units)\n"
-        # Add stream parameters
-        params = []
-        if 'temperature' in stream and stream['temperature']:
-            params.append(f"T: {stream['temperature']}°C")
-        if 'pressure' in stream and stream['pressure']:
-            params.append(f"P: {stream['pressure']} bar")
-        if 'flow_rate' in stream and stream['flow_rate']:
-            params.append(f"Flow: {stream['flow_rate']} kg/hr")
-        if 'composition' in stream and stream['composition']:
-            comp = stream['composition'][:30] + "..." if len(stream['composition']) > 30 else stream['composition']
-            params.append(f"Comp: {comp}")
-        if params:
-            description += f"  Parameters: {', '.join(params)}\n"
     
-    return description
+    # Keep rerunning until the background render lands so the preview gets replaced
+    if st.session_state.pending_render is not None:
+        st.caption("⏳ Rendering the full-quality PFD in the background...")
+        time.sleep(RENDER_POLL_INTERVAL)
+        st.rerun()
 
-def analyze_pfd_text(pfd_text, question, chat_history, image=None):
-    """Analyze PFD using text description, with fallback to image when needed"""
-    # Keywords that suggest visual analysis is needed
-    visual_keywords = [
-        # Layout and position
-        'layout', 'position', 'location', 'top-left', 'top-right', 'bottom-left', 'bottom-right',
-        'left side', 'right side', 'top side', 'bottom side', 'middle', 'center', 'corner',
-        'arranged', 'placed', 'situated', 'oriented', 'direction', 'orientation',
-        
-        # Visual appearance
-        'visually', 'appearance', 'shape', 'color', 'colored', 'look', 'looks like',
-        'appears', 'seen', 'saw', 'see', 'view', 'perspective', 'diagram',
-        
-        # Spatial relationships
-        'where is', 'next to', 'adjacent', 'beside', 'near', 'close to', 'far from',
-        'above', 'below', 'under', 'over', 'across', 'between', 'surrounding',
-        
-        # Visual patterns
-        'pattern', 'design', 'configuration', 'structure', 'form', 'layout',
-        'alignment', 'symmetry', 'asymmetry', 'proportion', 'dimension',
-        
-        # Visual elements
-        'symbol', 'icon', 'marking', 'label', 'text', 'font', 'size', 'scale',
-        'line', 'arrow', 'connection', 'link', 'path', 'route',
-        
-        # Visual comparisons
-        'bigger', 'smaller', 'larger', 'taller', 'wider', 'narrower', 'thicker', 'thinner',
-        'compare', 'comparison', 'difference', 'similar', 'resemble', 'match',
-        
-        # Visual analysis
-        'analyze visually', 'visual analysis', 'visual inspection', 'visual check',
-        'examine visually', 'visual examination', 'visual review',
-        
-        # Specific visual queries
-        'what does it look like', 'how does it look', 'visualize', 'visualization',
-        'show me', 'point out', 'indicate', 'highlight', 'circle', 'mark',
-        
-        # Directional terms
-        'horizontal', 'vertical', 'diagonal', 'parallel', 'perpendicular', 'angled',
-        'upward', 'downward', 'forward', 'backward', 'sideways', 'circular',
-        
-        # Visual features
-        'border', 'outline', 'edge', 'corner', 'surface', 'face', 'side',
-        'front', 'back', 'top', 'bottom', 'interior', 'exterior'
-    ]
+def poll_pending_render():
+    """Replace the preview with the full-quality PFD once the background render is done"""
+    render_job = st.session_state.pending_render
+    if render_job is None or not render_job.done:
+        return
+    st.session_state.pending_render = None
+    try:
+        pfd_image_bytes = render_job.result()
+    except Exception as e:
+        st.warning(f"Full-quality render failed, showing the preview instead: {str(e)}")
+        return
+    if needs_deep_zoom(pfd_image_bytes):
+        # Too big to push through st.image: write tiles once and keep only their name in the session
+        with st.spinner("Preparing zoomable view of the PFD..."):
+            pyramid = write_pyramid(pfd_image_bytes)
+        st.session_state.generated_pfd = None
+        # Opened from disk; pixels are only decoded if a visual question needs them
+        st.session_state.generated_pfd_image = Image.open(pyramid_image_path(pyramid))
+    else:
+        pyramid = None
+        st.session_state.generated_pfd = pfd_image_bytes
+        st.session_state.generated_pfd_image = Image.open(BytesIO(pfd_image_bytes))
+    for message in st.session_state.chat_history:
+        if message.get("render_id") != st.session_state.pending_render_id:
+            continue
+        if "image" in message:
+            message["caption"] = FULL_QUALITY_CAPTION
+            if pyramid:
+                message["image"] = None
+                message["deep_zoom"] = pyramid
+            else:
+                message["image"] = pfd_image_bytes
+        if "image_data" in message:
+            if pyramid:
+                del message["image_data"]
+                message["download_url"] = pyramid_download_url(pyramid)
+            else:
+                message["image_data"] = pfd_image_bytes
+
+def show_section_view(message):
+    """Block diagram of a large flowsheet with on-demand drill-down into one section"""
+    process_data = message["process_data"]
+    try:
+        st.image(render_block_diagram(process_data, owner=get_render_owner()),
+                 caption="Process Sections", use_column_width=True)
+    except Exception as e:
+        st.error(f"Error rendering section overview: {str(e)}")
+        return
+    section_names = list(group_units(process_data))
+    selected = st.selectbox("Expand section:", ["(none)"] + section_names,
+                            key=f"{message.get('key', id(message))}_select")
+    if selected != "(none)":
+        # Each section is rendered and cached on its own
+        with st.spinner(f"Rendering {selected}..."):
+            try:
+                st.image(render_section(process_data, selected, owner=get_render_owner()),
+                         caption=selected, use_column_width=True)
+            except Exception as e:
+                st.error(f"Error rendering section: {str(e)}")
+
+def show_export_buttons(message):
+    """Offer SVG/PDF downloads of a generated PFD, rendered from its cached layout once requested"""
+    if st.session_state.pending_render is not None and message.get("render_id") == st.session_state.pending_render_id:
+        return  # Keep the render pool free for the full-quality PNG first
+    base_name = message["filename"].rsplit(".", 1)[0]
+    prepared = message.setdefault("prepared_exports", [])
+    columns = st.columns(2)
+    for column, output in zip(columns, ("svg", "pdf")):
+        _, _, mime, extension = EXPORT_FORMATS[output]
+        key = f"{message.get('key', id(message))}_{output}"
+        with column:
+            # Rendered only on request; afterwards each rerun is a render cache hit
+            if output not in prepared:
+                if not st.button(f"⚙️ Prepare {output.upper()}", key=f"{key}_prepare"):
+                    continue
+                prepared.append(output)
+            try:
+                with st.spinner(f"Preparing {output.upper()}..."):
+                    data = export_high_quality_pfd(message["process_data"], output, owner=get_render_owner())
+            except Exception as e:
+                prepared.remove(output)  # Offer the button again
+                st.caption(f"{output.upper()} export unavailable: {str(e)}")
+                continue
+            st.download_button(
+                label=f"📥 Download {output.upper()}",
+                data=data,
+                file_name=f"{base_name}.{extension}",
+                mime=mime,
+                key=key
+            )
+
+# Words and phrases that ask how the drawing looks rather than about the process,
+# matched as whole words; generic process words ("match", "connection", "top
+# product", "line") are left out so ordinary questions stay on the text path
+VISUAL_KEYWORDS = [
+    # Layout and position on the drawing
+    'layout', 'arrangement', 'arranged', 'placed', 'positioned', 'orientation', 'where is', 'where are',
+    'top-left', 'top-right', 'bottom-left', 'bottom-right', 'top left', 'top right', 'bottom left',
+    'bottom right', 'left side', 'right side', 'left of', 'right of', 'next to', 'adjacent', 'beside',
+    'corner', 'horizontal', 'vertical', 'diagonal', 'horizontally', 'vertically',
+
+    # Appearance
+    'visual', 'visually', 'appearance', 'look like', 'looks like', 'shape', 'shapes', 'color', 'colour',
+    'colored', 'coloured', 'drawn', 'symbol', 'symbols', 'icon', 'icons', 'arrow', 'arrows',
+    'dashed', 'dotted', 'font', 'legend', 'highlighted', 'circled', 'visualize', 'visualization',
+]
+VISUAL_RE = re.compile(r'\b(?:' + '|'.join(re.escape(keyword).replace(r'\ ', r'\s+') for keyword in VISUAL_KEYWORDS)
+                       + r')\b', re.IGNORECASE)
+
+def needs_visual_analysis(question):
+    """True when the question is about how the diagram looks rather than the process"""
+    return VISUAL_RE.search(question) is not None
+
+def stream_pfd_text(pfd_text, question, chat_history, image=None, use_cache=True, pfd_key=None,
+                    process_data=None, similar=True, visual=None):
+    """Answer chunks for a question about a PFD from its text description, or from the
+    image (when given) for visual questions.
+
+    Answers are reused for the same or (with similar) a reworded question about the
+    same PFD (pfd_key, by default a hash of pfd_text); use_cache=False always asks the model.
+    With process_data (pfd_key then being its process_hash), large flowsheets send
+    only the part relevant to the question instead of the whole pfd_text.
+    visual forces (True) or rules out (False) the image path; by default the
+    question's wording decides.
+    """
+    pfd_key = pfd_key or pfd_key_for_text(pfd_text)
+    visual = needs_visual_analysis(question) if visual is None else visual
+    if visual and image is not None:
+        # The known structure saves reading the image in tiles
+        return stream_pfd_image(image, question, use_cache=use_cache, pfd_key=pfd_key, similar=similar,
+                                structure_text=_question_context(pfd_text, question, process_data, pfd_key))
+    return answer_chunks(semantic_cache.stream_or_ask(
+        pfd_key, question,
+        lambda: _pfd_text_chain(_question_context(pfd_text, question, process_data, pfd_key), question,
+                                chat_history).stream({}),
+        bypass=not use_cache, similar=similar))
+
+def uploaded_pfd_structure(image, pfd_key):
+    """Structure of an uploaded PFD as {"process_data", "text"}, extracted once per drawing; None if unreadable.
+
+    A failed extraction is not remembered; it is tried again once STRUCTURE_RETRY_SECONDS have passed.
+    """
+    structures = st.session_state.setdefault('uploaded_pfd_structures', {})
+    failures = st.session_state.setdefault('uploaded_pfd_structure_failures', {})
+    if pfd_key in structures:
+        return structures[pfd_key]
+    if time.time() - failures.get(pfd_key, 0) < STRUCTURE_RETRY_SECONDS:
+        return None
+    with st.spinner("Reading the PFD structure..."):
+        process_data = extract_process_data(image, pfd_key)
+    if not process_data:
+        failures[pfd_key] = time.time()
+        return None
+    failures.pop(pfd_key, None)
+    structures[pfd_key] = {"process_data": process_data, "text": generate_text_description(process_data)}
+    return structures[pfd_key]
+
+def stream_uploaded_pfd(image, question, chat_history, pfd_key, structure, use_cache=True, similar=True,
+                        visual=None):
+    """Answer chunks for a question about an uploaded PFD: a text request over its extracted
+    structure, or the image for visual questions and drawings that could not be read"""
+    if structure is None:
+        return stream_pfd_image(image, question, use_cache=use_cache, pfd_key=pfd_key, similar=similar)
+    return stream_pfd_text(structure["text"], question, chat_history, image, use_cache=use_cache, pfd_key=pfd_key,
+                           process_data=structure["process_data"], similar=similar, visual=visual)
+
+def _question_context(pfd_text, question, process_data, process_key):
+    # Cheap after the first question: the index is built once per flowsheet
+    if process_data is None:
+        return pfd_text
+    return flowsheet_context(process_data, question, process_key)
+
+def _pfd_text_chain(pfd_text, question, chat_history):
+    llm = get_llm()
     
-    # Check if question requires visual analysis
-    question_lower = question.lower()
-    needs_visual = any(keyword in question_lower for keyword in visual_keywords)
+    # Recent and relevant turns plus a rolling summary, within a fixed token budget
+    history_context = conversation_memory.context(chat_history or [], question)
     
-    if needs_visual and image is not None:
-        # Use image analysis for visual questions
-        return analyze_pfd_image(image, question)
-    else:
-        # Use text analysis for efficiency with existing LLM processor
-        try:
-            llm = get_llm()
-            
-            # Format chat history for context (use last 12 queries)
-            history_context = ""
-            if chat_history:
-                history_context = "Previous conversation:\n"
-                for msg in chat_history[-12:]:  # Use last 12 messages for context
-                    role = "User" if msg["role"] == "user" else "Assistant"
-                    history_context += f"{role}: {msg['content']}\n"
-            
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", """You are an expert chemical process engineer. You have detailed knowledge of Process Flow Diagrams (PFDs) and can answer questions about them. Use the provided PFD description to answer questions accurately. When relevant, consider:
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """You are an expert chemical process engineer. You have detailed knowledge of Process Flow Diagrams (PFDs) and can answer questions about them. Use the provided PFD description to answer questions accurately. When relevant, consider:
             1. Equipment identification and function
             2. Process flow direction
             3. Stream connections and relationships
@@ -656,7 +899,7 @@ def analyze_pfd_text(pfd_text, question, chat_history, image=None):
             5. Process safety considerations
             6. Energy efficiency and optimization
             7. Common industrial practices"""),
-                ("human", f"""PFD Description:
+        ("human", f"""PFD Description:
 {pfd_text}
 
 {history_context}
@@ -664,14 +907,10 @@ def analyze_pfd_text(pfd_text, question, chat_history, image=None):
 Question: {question}
 
 Please provide a detailed, accurate, and helpful answer.""")
-            ])
-            
-            chain = prompt | llm | StrOutputParser()
-            result = chain.invoke({})
-            return result
-            
-        except Exception as e:
-            return f"Error analyzing PFD: {str(e)}"
+    ])
+    
+    return (prompt | llm | StrOutputParser()).with_config(callbacks=[usage_callback("chat")])
+
 def pfd_verifier_page():
     st.header("✅ PFD Verifier")
     st.subheader("Upload your PFD and process description to verify correctness!")
@@ -679,6 +918,8 @@ def pfd_verifier_page():
     # Initialize session state for verifier
     if 'uploaded_pfd_for_verification' not in st.session_state:
         st.session_state.uploaded_pfd_for_verification = None
+    if 'verification_pfd_key' not in st.session_state:
+        st.session_state.verification_pfd_key = None
     if 'process_description_for_verification' not in st.session_state:
         st.session_state.process_description_for_verification = ""
     if 'verification_result' not in st.session_state:
@@ -701,6 +942,9 @@ def pfd_verifier_page():
             image = Image.open(uploaded_pfd)
             st.image(image, caption="Uploaded PFD", use_column_width=True)
             st.session_state.uploaded_pfd_for_verification = image
+            st.session_state.verification_pfd_key = fingerprint_store.resolve(pfd_key_for_bytes(uploaded_pfd.getvalue()),
+                                                                             image)
+            uploaded_pfd_structure(image, st.session_state.verification_pfd_key)
 
     with col2:
         # Process description input
@@ -713,6 +957,9 @@ def pfd_verifier_page():
         )
         st.session_state.process_description_for_verification = process_description
     
+    fresh_answer = st.checkbox("Fresh answer (skip answers to similar questions)", value=False,
+                               key="verifier_fresh_answer")
+    
     # Verify button
     if st.button("Verify PFD Against Process Description"):
         if st.session_state.uploaded_pfd_for_verification and st.session_state.process_description_for_verification:
@@ -727,11 +974,18 @@ def pfd_verifier_page():
                         "content": verification_question
                     })
                     
-                    # Analyze the PFD with the verification question
-                    verification_result = analyze_pfd_image(
+                    # Analyze the PFD with the verification question. Verdicts are reused only
+                    # for the exact same description, never for a similar-sounding one; the
+                    # comparison is made on the extracted structure, whatever the description says
+                    verification_result = stream_answer(stream_uploaded_pfd(
                         st.session_state.uploaded_pfd_for_verification, 
-                        verification_question
-                    )
+                        verification_question,
+                        st.session_state.verification_chat_history,
+                        st.session_state.verification_pfd_key,
+                        uploaded_pfd_structure(st.session_state.uploaded_pfd_for_verification,
+                                               st.session_state.verification_pfd_key),
+                        use_cache=not fresh_answer, similar=False, visual=False
+                    ))
                     
                     # Add verification result to chat
                     st.session_state.verification_chat_history.append({
@@ -772,11 +1026,16 @@ def pfd_verifier_page():
                             "content": verification_question_input
                         })
                         
-                        # For uploaded PFDs, we still need to use image analysis
-                        answer = analyze_pfd_image(
+                        # Text path over the extracted structure; the image only for visual questions
+                        answer = stream_answer(stream_uploaded_pfd(
                             st.session_state.uploaded_pfd_for_verification, 
-                            verification_question_input
-                        )
+                            verification_question_input,
+                            st.session_state.verification_chat_history,
+                            st.session_state.verification_pfd_key,
+                            uploaded_pfd_structure(st.session_state.uploaded_pfd_for_verification,
+                                                   st.session_state.verification_pfd_key),
+                            use_cache=not fresh_answer
+                        ))
                         
                         # Add AI response to chat history
                         st.session_state.verification_chat_history.append({
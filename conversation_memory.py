@@ -0,0 +1,172 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+from cache_utils import canonical_hash
+from llm_clients import get_llm_client
+from semantic_cache import TAG_RE
+from token_usage import count_tokens, usage_callback, CHARS_PER_TOKEN
+
+# Tokens of conversation history sent with each chat question (summary plus turns)
+HISTORY_TOKEN_BUDGET = int(os.getenv("PFD_HISTORY_TOKENS", "800"))
+# Latest turns always included, and the size each included answer is clipped to
+RECENT_TURNS = 2
+MAX_ANSWER_TOKENS = 200
+# Older turns are folded into the rolling summary in blocks of this many turns
+SUMMARY_EVERY = 6
+SUMMARY_TOKENS = 150
+# Share of the question's words an older turn must mention to be included verbatim
+# (a turn naming the same equipment/stream tag always qualifies)
+MIN_RELEVANCE = 0.34
+MAX_SUMMARIES = 256
+# Chat entries that render a widget (image, download, tables) rather than text
+NON_TEXT_KEYS = ("image", "deep_zoom", "download_button", "process_summary", "equipment", "streams", "section_view")
+WORD_RE = re.compile(r'[a-z0-9][a-z0-9-]*')
+
+def _is_text(message):
+    return isinstance(message.get("content"), str) and not any(message.get(key) for key in NON_TEXT_KEYS)
+
+def conversation_turns(chat_history):
+    """(question, answer) text pairs of a chat history, oldest first.
+
+    Widget entries (generated images, downloads, tables) are skipped together
+    with the button press that produced them; a trailing unanswered question
+    (the one being asked now) is left out.
+    """
+    turns = []
+    user_text, answers = None, []
+    for message in chat_history:
+        if message.get("role") == "user":
+            if user_text is not None and answers:
+                turns.append((user_text, "\n".join(answers)))
+            user_text, answers = message.get("content", ""), []
+        elif _is_text(message) and user_text is not None:
+            answers.append(message["content"])
+    if user_text is not None and answers:
+        turns.append((user_text, "\n".join(answers)))
+    return turns
+
+def _words(text):
+    return {word for word in WORD_RE.findall(text.lower()) if word not in ENGLISH_STOP_WORDS}
+
+def _relevance(question_words, question_tags, turn):
+    text = " ".join(turn).lower()
+    score = len(question_words & _words(text)) / len(question_words) if question_words else 0.0
+    # A turn about the same unit (P-101) is relevant whatever else the question says
+    return score + 1.0 if question_tags & set(TAG_RE.findall(text)) else score
+
+def _clip(text, tokens):
+    limit = tokens * CHARS_PER_TOKEN
+    return text if len(text) <= limit else text[:limit].rstrip() + " …"
+
+def _format_turn(turn):
+    question, answer = turn
+    return f"User: {question}\nAssistant: {_clip(answer, MAX_ANSWER_TOKENS)}\n"
+
+class ConversationMemory:
+    """Bounded conversation context for chat questions about a PFD.
+
+    Keeps the prompt within a token budget however long the chat gets: the
+    latest turns, older turns that share words with the question, and a rolling
+    summary of everything older, extended once per SUMMARY_EVERY turns. Summaries
+    are cached by the turns they cover, so each block is summarized once.
+    """
+
+    def __init__(self, budget=HISTORY_TOKEN_BUDGET, recent_turns=RECENT_TURNS, summary_every=SUMMARY_EVERY,
+                 max_summaries=MAX_SUMMARIES, summarize_fn=None):
+        self.budget = budget
+        self.recent_turns = recent_turns
+        self.summary_every = summary_every
+        self.max_summaries = max_summaries
+        self.summarize_fn = summarize_fn or _summarize
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+        self.summary_calls = 0
+        self.summary_hits = 0
+
+    def summary(self, turns):
+        """Rolling summary of the complete SUMMARY_EVERY-turn blocks of turns, or "" """
+        summary, key = "", None
+        blocks = len(turns) // self.summary_every
+        for block in range(blocks):
+            chunk = turns[block * self.summary_every:(block + 1) * self.summary_every]
+            key = canonical_hash({"previous": key, "turns": chunk})
+            with self._lock:
+                cached = self._summaries.get(key)
+                if cached is not None:
+                    self._summaries.move_to_end(key)
+                    self.summary_hits += 1
+            if cached is None:
+                try:
+                    cached = self.summarize_fn(summary, chunk)
+                except Exception:
+                    return summary  # Keep what we have; the next question retries
+                with self._lock:
+                    self.summary_calls += 1
+                    self._summaries[key] = cached
+                    while len(self._summaries) > self.max_summaries:
+                        self._summaries.popitem(last=False)
+            summary = cached
+        return summary
+
+    def context(self, chat_history, question):
+        """History text for the prompt: summary plus recent and relevant turns, within the budget"""
+        turns = conversation_turns(chat_history)
+        if not turns:
+            return ""
+        recent_start = max(len(turns) - self.recent_turns, 0)
+        older = turns[:recent_start]
+        summary = self.summary(older)
+        remaining = self.budget - count_tokens(summary)
+
+        # Latest turns first, then the older turns closest to the question
+        selected = []
+        for index in range(len(turns) - 1, recent_start - 1, -1):
+            cost = count_tokens(_format_turn(turns[index]))
+            if cost <= remaining:
+                selected.append(index)
+                remaining -= cost
+        question_words = _words(question)
+        question_tags = set(TAG_RE.findall(question.lower()))
+        scored = []
+        for index, turn in enumerate(older):
+            score = _relevance(question_words, question_tags, turn)
+            if score >= MIN_RELEVANCE:
+                scored.append((score, index))
+        for score, index in sorted(scored, reverse=True):
+            cost = count_tokens(_format_turn(turns[index]))
+            if cost <= remaining:
+                selected.append(index)
+                remaining -= cost
+
+        parts = []
+        if summary:
+            parts.append(f"Summary of the earlier conversation:\n{summary}\n")
+        if selected:
+            parts.append("Previous conversation:\n" + "".join(_format_turn(turns[index]) for index in sorted(selected)))
+        return "\n".join(parts)
+
+    def clear(self):
+        with self._lock:
+            self._summaries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"summaries": len(self._summaries), "summary_calls": self.summary_calls,
+                    "summary_hits": self.summary_hits}
+
+def _summarize(previous_summary, turns):
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", f"""You keep a running summary of a conversation about a Process Flow Diagram. Extend the summary with the new turns in at most {SUMMARY_TOKENS * 3 // 4} words. Keep equipment and stream tags, numbers and conclusions; drop pleasantries and formatting. Return only the summary."""),
+        ("human", "Summary so far:\n{summary}\n\nNew turns:\n{turns}")
+    ])
+    chain = (prompt | get_llm_client() | StrOutputParser()).with_config(callbacks=[usage_callback("chat summary")])
+    summary = chain.invoke({"summary": previous_summary or "(none)",
+                            "turns": "".join(_format_turn(turn) for turn in turns)})
+    return _clip(summary.strip(), SUMMARY_TOKENS)
+
+# Process-wide memory shared by the chat pages
+conversation_memory = ConversationMemory()
@@ -0,0 +1,284 @@
+import hashlib
+import math
+import os
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+from io import BytesIO
+from PIL import Image
+
+# Tiles live under Streamlit's static folder (server.enableStaticServing) so the
+# browser fetches them straight from disk, one visible tile at a time
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+DEEP_ZOOM_DIR = os.path.join(STATIC_DIR, "pfd_tiles")
+DEEP_ZOOM_URL = "/app/static/pfd_tiles"
+TILE_SIZE = 256
+TILE_OVERLAP = 1
+TILE_FORMAT = "png"
+# Rows decoded at a time when building a pyramid
+STRIP_ROWS = TILE_SIZE
+# Bytes of pyramids kept on disk; least recently used pyramids are evicted first
+DEEP_ZOOM_MAX_BYTES = int(os.getenv("PFD_DEEP_ZOOM_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+# Scratch folders older than this many seconds were left behind by a crashed build
+SCRATCH_MAX_AGE = 3600
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Bytes per pixel of 8-bit PNG color types (gray, RGB, palette, gray+alpha, RGBA)
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# Images above this many pixels are shown through the tiled viewer instead of st.image
+DEEP_ZOOM_MIN_PIXELS = 16 * 1024 * 1024
+OPENSEADRAGON_URL = "https://cdn.jsdelivr.net/npm/openseadragon@4.1/build/openseadragon"  # script + images folder
+
+def image_size(png_bytes):
+    """Width and height from the image header, without decoding pixels"""
+    with Image.open(BytesIO(png_bytes)) as image:
+        return image.size
+
+def needs_deep_zoom(png_bytes):
+    width, height = image_size(png_bytes)
+    return width * height > DEEP_ZOOM_MIN_PIXELS
+
+def pyramid_name(png_bytes):
+    """Content-addressed name, so every worker reuses the same tiles for the same image"""
+    return hashlib.sha256(png_bytes).hexdigest()[:32]
+
+def _dzi_xml(width, height):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{TILE_SIZE}" '
+        f'Overlap="{TILE_OVERLAP}" Format="{TILE_FORMAT}">\n'
+        f'  <Size Width="{width}" Height="{height}"/>\n'
+        '</Image>\n'
+    )
+
+class _LevelWriter:
+    """Writes the tiles of one pyramid level from rows fed top to bottom.
+
+    Only the rows of the tile row being filled are held, and every fed strip is
+    halved (2x2 box filter) into the writer of the level below, so no level is
+    ever held whole in memory.
+    """
+
+    def __init__(self, level, width, height, files_dir):
+        self.width = width
+        self.height = height
+        self.level_dir = os.path.join(files_dir, str(level))
+        os.makedirs(self.level_dir)
+        self.buffer = None  # Level rows [self.top, self.top + buffer.height)
+        self.top = 0
+        self.row = 0  # Next tile row to write
+        self.odd_row = None  # Row waiting for its pair before being halved
+        self.bytes = 0
+        self.lower = None
+        if level:
+            self.lower = _LevelWriter(level - 1, math.ceil(width / 2), math.ceil(height / 2), files_dir)
+
+    def feed(self, strip):
+        if self.lower is not None:
+            self._halve(strip)
+        self.buffer = strip if self.buffer is None else _stack(self.buffer, strip)
+        self._write_ready_rows()
+
+    def finish(self):
+        if self.lower is not None:
+            if self.odd_row is not None:
+                self.lower.feed(self.odd_row.reduce(2))
+                self.odd_row = None
+            self.lower.finish()
+        return self.bytes + (self.lower.bytes if self.lower is not None else 0)
+
+    def _halve(self, strip):
+        if self.odd_row is not None:
+            strip = _stack(self.odd_row, strip)
+            self.odd_row = None
+        even = strip.height - strip.height % 2
+        if strip.height % 2:
+            self.odd_row = strip.crop((0, even, strip.width, strip.height))
+        if even:
+            self.lower.feed(strip.crop((0, 0, strip.width, even)).reduce(2))
+
+    def _write_ready_rows(self):
+        bottom = self.top + self.buffer.height
+        while self.row * TILE_SIZE < self.height:
+            # Neighbouring tiles share TILE_OVERLAP pixels so seams do not show
+            top = max(self.row * TILE_SIZE - TILE_OVERLAP, 0)
+            band_bottom = min((self.row + 1) * TILE_SIZE + TILE_OVERLAP, self.height)
+            if band_bottom > bottom:
+                break
+            for col in range(math.ceil(self.width / TILE_SIZE)):
+                left = max(col * TILE_SIZE - TILE_OVERLAP, 0)
+                right = min((col + 1) * TILE_SIZE + TILE_OVERLAP, self.width)
+                path = os.path.join(self.level_dir, f"{col}_{self.row}.{TILE_FORMAT}")
+                self.buffer.crop((left, top - self.top, right, band_bottom - self.top)).save(path)
+                self.bytes += os.path.getsize(path)
+            self.row += 1
+        keep = min(max(self.row * TILE_SIZE - TILE_OVERLAP, 0), bottom)
+        if keep > self.top:
+            self.buffer = self.buffer.crop((0, keep - self.top, self.width, self.buffer.height))
+            self.top = keep
+
+def _stack(upper, lower):
+    stacked = Image.new(upper.mode, (upper.width, upper.height + lower.height))
+    stacked.paste(upper, (0, 0))
+    stacked.paste(lower, (0, upper.height))
+    return stacked
+
+def _png_chunks(png_bytes):
+    position = len(PNG_SIGNATURE)
+    while position + 8 <= len(png_bytes):
+        length, kind = struct.unpack(">I4s", png_bytes[position:position + 8])
+        yield kind, png_bytes[position + 8:position + 8 + length]
+        position += 12 + length
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+def _png_strips(png_bytes, rows=STRIP_ROWS):
+    """Decoded RGB strips of at most rows rows, top to bottom.
+
+    Non-interlaced 8-bit PNGs (what Graphviz writes) are inflated incrementally;
+    each strip is rewrapped as a small PNG, starting with the previous strip's
+    last row unfiltered so Up/Average/Paeth filters still decode. Other PNGs are
+    decoded whole.
+    """
+    chunks = list(_png_chunks(png_bytes)) if png_bytes.startswith(PNG_SIGNATURE) else []
+    header = chunks[0][1] if chunks and chunks[0][0] == b"IHDR" else None
+    if header is None or header[8] != 8 or header[9] not in PNG_CHANNELS or header[12] != 0:
+        with Image.open(BytesIO(png_bytes)) as image:
+            yield image.convert("RGB")
+        return
+    width, height = struct.unpack(">II", header[:8])
+    stride = 1 + width * PNG_CHANNELS[header[9]]
+    extra = b"".join(_png_chunk(kind, data) for kind, data in chunks if kind in (b"PLTE", b"tRNS"))
+    inflater = zlib.decompressobj()
+    raw = bytearray()
+    previous = None
+    decoded = 0
+
+    def strip(count):
+        data = bytes(raw[:count * stride])
+        del raw[:count * stride]
+        if previous is not None:
+            data = b"\x00" + previous + data
+        strip_header = header[:4] + struct.pack(">I", count + (previous is not None)) + header[8:]
+        png = (PNG_SIGNATURE + _png_chunk(b"IHDR", strip_header) + extra +
+               _png_chunk(b"IDAT", zlib.compress(data, 0)) + _png_chunk(b"IEND", b""))
+        with Image.open(BytesIO(png)) as image:
+            image.load()
+            if previous is not None:
+                image = image.crop((0, 1, width, image.height))
+        return image
+
+    for kind, data in chunks:
+        if kind != b"IDAT":
+            continue
+        while data:
+            # Inflate at most one strip at a time: one IDAT chunk may hold the whole image
+            raw += inflater.decompress(data, rows * stride)
+            data = inflater.unconsumed_tail
+            while len(raw) >= rows * stride and decoded + rows < height:
+                image = strip(rows)
+                previous = image.crop((0, rows - 1, width, rows)).tobytes()
+                decoded += rows
+                yield image.convert("RGB")
+    raw += inflater.flush()
+    if decoded < height:
+        yield strip(height - decoded).convert("RGB")
+
+def _evict_pyramids(directory, max_bytes):
+    """Delete least recently used pyramids until the tiles fit in max_bytes, and stale scratch folders"""
+    pyramids = []
+    now = time.time()
+    for entry in os.scandir(directory):
+        try:
+            if entry.name.startswith(".tmp_"):
+                if now - entry.stat().st_mtime > SCRATCH_MAX_AGE:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            elif entry.name.endswith(".dzi"):
+                name = entry.name[:-len(".dzi")]
+                with open(os.path.join(directory, f"{name}.bytes")) as f:
+                    size = int(f.read())
+                pyramids.append((entry.stat().st_mtime, size, name))
+        except (OSError, ValueError):
+            continue
+    total = sum(size for _, size, _ in pyramids)
+    for _, size, name in sorted(pyramids):
+        if total <= max_bytes:
+            break
+        remove_pyramid(name, directory)
+        total -= size
+
+def remove_pyramid(name, directory=DEEP_ZOOM_DIR):
+    # The .dzi goes first so viewers stop finding the pyramid before its tiles disappear
+    for entry in (f"{name}.dzi", f"{name}.png", f"{name}.bytes"):
+        try:
+            os.remove(os.path.join(directory, entry))
+        except OSError:
+            pass
+    shutil.rmtree(os.path.join(directory, f"{name}_files"), ignore_errors=True)
+
+def write_pyramid(png_bytes, directory=DEEP_ZOOM_DIR, max_bytes=DEEP_ZOOM_MAX_BYTES):
+    """Write a Deep Zoom (DZI) tile pyramid for png_bytes and return its name.
+
+    Levels run from 1x1 up to full resolution, each half the size of the next.
+    The full PNG is stored alongside so it can be downloaded as a static file.
+    Existing pyramids are reused; least recently used ones are evicted once the
+    folder exceeds max_bytes.
+    """
+    name = pyramid_name(png_bytes)
+    dzi_path = os.path.join(directory, f"{name}.dzi")
+    if os.path.exists(dzi_path):
+        try:
+            os.utime(dzi_path, None)  # Mark as recently used for eviction
+        except OSError:
+            pass
+        return name
+    os.makedirs(directory, exist_ok=True)
+    # Build in a scratch folder and move into place so viewers never see half a pyramid
+    scratch = tempfile.mkdtemp(dir=directory, prefix=".tmp_")
+    try:
+        width, height = image_size(png_bytes)
+        max_level = math.ceil(math.log2(max(width, height)))
+        # The image is decoded in strips: memory stays near one strip per level, not the full bitmap
+        writer = _LevelWriter(max_level, width, height, os.path.join(scratch, f"{name}_files"))
+        for strip in _png_strips(png_bytes):
+            writer.feed(strip)
+        size = writer.finish() + len(png_bytes)
+        with open(os.path.join(scratch, f"{name}.png"), "wb") as f:
+            f.write(png_bytes)
+        with open(os.path.join(scratch, f"{name}.bytes"), "w") as f:
+            f.write(str(size))
+        with open(os.path.join(scratch, f"{name}.dzi"), "w") as f:
+            f.write(_dzi_xml(width, height))
+        for entry in (f"{name}_files", f"{name}.png", f"{name}.bytes", f"{name}.dzi"):
+            target = os.path.join(directory, entry)
+            if not os.path.exists(target):
+                os.replace(os.path.join(scratch, entry), target)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    _evict_pyramids(directory, max_bytes)
+    return name
+
+def pyramid_image_path(name, directory=DEEP_ZOOM_DIR):
+    """Full-resolution PNG stored with a pyramid"""
+    return os.path.join(directory, f"{name}.png")
+
+def pyramid_download_url(name):
+    return f"{DEEP_ZOOM_URL}/{name}.png"
+
+def viewer_html(name, height=600):
+    """OpenSeadragon viewer that loads only the tiles visible at the current zoom"""
+    return f"""
+<div id="pfd-viewer" style="width: 100%; height: {height}px; background: white;"></div>
+<script src="{OPENSEADRAGON_URL}/openseadragon.min.js"></script>
+<script>
+  OpenSeadragon({{
+    id: "pfd-viewer",
+    prefixUrl: "{OPENSEADRAGON_URL}/images/",
+    tileSources: "{DEEP_ZOOM_URL}/{name}.dzi",
+    showNavigator: true,
+    maxZoomPixelRatio: 2
+  }});
+</script>
+"""
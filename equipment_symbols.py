@@ -1,3 +1,7 @@
+import re
+import threading
+from cache_utils import canonical_hash
+
 EQUIPMENT_TEMPLATES = {
     "reactor": {"shape": "rectangle", "style": "filled", "fillcolor": "lightblue", "color": "black", "width": "1.5", "height": "1.0"},
     "distillation": {"shape": "cylinder", "style": "filled", "fillcolor": "lightgreen", "color": "black", "width": "1.2", "height": "2.0"},
@@ -16,19 +20,89 @@ EQUIPMENT_TEMPLATES = {
     "splitter": {"shape": "circle", "style": "filled", "fillcolor": "lightgray", "color": "black", "width": "1.0", "height": "1.0"},
     "default": {"shape": "box", "style": "filled", "fillcolor": "white", "color": "black", "width": "1.2", "height": "0.8"}
 }
+
+
+# Unmatched types keep the colour and shape the renderers have always used
+FALLBACK_STYLE = dict(EQUIPMENT_TEMPLATES["default"], fillcolor="#F5F5F5")
+# Distinct raw type strings remembered by the resolver; LLM output reuses a small vocabulary
+STYLE_MEMO_SIZE = 4096
+# Bump when the matching rules change so cached renders are not reused
+SYMBOL_RULES_VERSION = 2
+
+# Symbol libraries in priority order, built-ins first; later libraries win
+_libraries = [{key: style for key, style in EQUIPMENT_TEMPLATES.items() if key != "default"}]
+_matcher = None
+_memo = {}
+_lock = threading.Lock()
+_library_key = None
+
+def _build_matcher():
+    """One compiled regex over every keyword of every library.
+
+    A lookahead group reports a match at every position, so overlapping keywords
+    ("heat" inside "heater") are all seen in one pass over the type string.
+    Longer alternatives come first, giving the longest keyword at each position.
+    """
+    ranks = {}
+    styles = {}
+    for priority, library in enumerate(_libraries):
+        for order, (keyword, style) in enumerate(library.items()):
+            keyword = keyword.lower()
+            # Priority rules: newer library, then longer (more specific) keyword, then table order
+            ranks[keyword] = (priority, len(keyword), -order)
+            styles[keyword] = dict(EQUIPMENT_TEMPLATES["default"], **style)
+    keywords = sorted(ranks, key=len, reverse=True)
+    pattern = re.compile("(?=(%s))" % "|".join(re.escape(keyword) for keyword in keywords)) if keywords else None
+    return pattern, ranks, styles
+
+def _resolve(equip_type):
+    global _matcher
+    style = _memo.get(equip_type)
+    if style is not None:
+        return style
+    matcher = _matcher
+    if matcher is None:
+        with _lock:
+            if _matcher is None:
+                _matcher = _build_matcher()
+            matcher = _matcher
+    pattern, ranks, styles = matcher
+    style = FALLBACK_STYLE
+    if pattern is not None:
+        found = {match.group(1) for match in pattern.finditer(equip_type.lower())}
+        if found:
+            style = styles[max(found, key=ranks.__getitem__)]
+    if len(_memo) >= STYLE_MEMO_SIZE:
+        _memo.clear()
+    _memo[equip_type] = style
+    return style
+
+def get_equipment_style(equip_type):
+    """Full style record (shape, fillcolor, width, ...) for an equipment type; treat as read-only"""
+    return _resolve(equip_type)
+
+def register_symbol_library(templates):
+    """Add a user symbol library: {keyword: style dict}, matched like EQUIPMENT_TEMPLATES.
+
+    Registered libraries take priority over the built-in templates and over
+    libraries registered before them. Missing style fields fall back to the default.
+    """
+    global _matcher, _library_key
+    with _lock:
+        _libraries.append(dict(templates))
+        _matcher = None
+        _library_key = None
+        _memo.clear()
+
+def symbol_library_key():
+    """Hash of the active symbol libraries, for render cache keys"""
+    global _library_key
+    if _library_key is None:
+        _library_key = canonical_hash(_libraries, rules=SYMBOL_RULES_VERSION)
+    return _library_key
+
 def get_equipment_color(equip_type):
-    equip_type_lower = equip_type.lower()
-    for key, style in EQUIPMENT_TEMPLATES.items():
-        if key in equip_type_lower:
-            return style.get("fillcolor", "#F5F5F5")
-    # fallback color_map from your original second code here...
-    # (copy your original fallback color_map here)
-    return '#F5F5F5'  # default fallback color
+    return _resolve(equip_type).get("fillcolor", "#F5F5F5")
 
 def get_equipment_shape(equip_type):
-    equip_type_lower = equip_type.lower()
-    for key, style in EQUIPMENT_TEMPLATES.items():
-        if key in equip_type_lower:
-            return style.get("shape", "box")
-    # fallback shape_map from your original second code here...
-    return 'box'  # default fallback shape
+    return _resolve(equip_type).get("shape", "box")
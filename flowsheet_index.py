@@ -0,0 +1,198 @@
+# Retrieval over a flowsheet for chat questions. Large plants are not sent to the
+# LLM whole: each question gets the units it is about plus their graph neighbors.
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from process_graph import get_flow_analysis, process_hash
+from pfd_labels import equipment_record, stream_record, describe_equipment, describe_stream, generate_text_description
+from token_usage import count_tokens
+
+# Flowsheet text sent with a question; smaller flowsheets are sent whole
+MAX_CONTEXT_TOKENS = int(os.getenv("PFD_FLOWSHEET_CONTEXT_TOKENS", "3000"))
+# Graph hops around the units a question is about
+NEIGHBOR_HOPS = 1
+# Best-matching chunks used as seeds when the question names no unit,
+# and the share of the best score a chunk needs to be one of them
+TOP_MATCHES = 5
+MIN_SCORE_RATIO = 0.5
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Items listed per line in the plant overview
+OVERVIEW_LIST_ITEMS = 20
+FLOWSHEET_INDEX_CACHE_SIZE = 16
+TOKEN_RE = re.compile(r'[a-z0-9]+(?:-[a-z0-9]+)*')
+
+def _tokens(text):
+    tokens = TOKEN_RE.findall(text.lower().replace('_', ' '))
+    # Index P-101 both as a tag and as its parts, so "P101" and "pump 101" match too
+    return tokens + [part for token in tokens if '-' in token for part in token.split('-')] + \
+        [token.replace('-', '') for token in tokens if '-' in token]
+
+def _listing(items):
+    items = list(items)
+    if len(items) > OVERVIEW_LIST_ITEMS:
+        return f"{', '.join(items[:OVERVIEW_LIST_ITEMS])} … ({len(items)} total)"
+    return ', '.join(items) or 'none'
+
+class FlowsheetIndex:
+    """Per-unit and per-stream chunks of one process_data with BM25 weights and the unit graph.
+
+    Built once per process_data (see get_flowsheet_index); context() then costs
+    a pass over the question's terms and a small graph walk.
+    """
+
+    def __init__(self, process_data, key=None):
+        self.analysis = get_flow_analysis(process_data, key)
+        self.full_text = generate_text_description(process_data, key)
+        self.full_tokens = count_tokens(self.full_text)
+        self.unit_lines = {}
+        self.stream_lines = []
+        self.unit_streams = {}
+        self.stream_ids = {}  # lowercase stream id -> (source, target)
+        types = {}
+        for equip in process_data['equipment']:
+            record = equipment_record(equip)
+            self.unit_lines[record.id] = describe_equipment(record)
+            types[record.id] = record.type
+        for index, stream in enumerate(process_data['streams']):
+            record = stream_record(stream)
+            self.stream_lines.append(describe_stream(record, self.analysis.is_recycle(index)))
+            self.stream_ids[record.id.lower()] = (record.source, record.target)
+            for unit in (record.source, record.target):
+                self.unit_streams.setdefault(unit, []).append(index)
+        self.unit_ids = {unit.lower(): unit for unit in self.analysis.nodes}
+
+        # One chunk per unit and per stream; stream chunks mention their endpoints' types
+        # so "the reactor outlet" finds the stream leaving R-101
+        self.chunks = [(unit, "\n".join(self.unit_lines.get(unit, [unit]))) for unit in self.analysis.nodes]
+        for index, stream in enumerate(process_data['streams']):
+            text = "\n".join(self.stream_lines[index])
+            text += f" {types.get(stream['from'], '')} {types.get(stream['to'], '')}"
+            self.chunks.append(((stream['from'], stream['to']), text))
+        self._build_bm25()
+        self.type_counts = Counter(record_type.replace('_', ' ') for record_type in types.values())
+
+    def _build_bm25(self):
+        self.postings = {}
+        self.lengths = []
+        for chunk_index, (_, text) in enumerate(self.chunks):
+            counts = Counter(_tokens(text))
+            self.lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                self.postings.setdefault(term, []).append((chunk_index, count))
+        total = len(self.chunks)
+        self.average_length = sum(self.lengths) / total if total else 0.0
+        self.idf = {term: math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for term, postings in self.postings.items()}
+
+    def search(self, question, limit=TOP_MATCHES):
+        """[(score, chunk index)] of the chunks that best match question"""
+        scores = {}
+        for term in set(_tokens(question)):
+            for chunk_index, count in self.postings.get(term, ()):
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[chunk_index] / self.average_length)
+                scores[chunk_index] = scores.get(chunk_index, 0.0) + \
+                    self.idf[term] * count * (BM25_K1 + 1) / (count + norm)
+        ranked = sorted(((score, index) for index, score in scores.items()), reverse=True)[:limit]
+        if not ranked:
+            return []
+        return [(score, index) for score, index in ranked if score >= ranked[0][0] * MIN_SCORE_RATIO]
+
+    def mentioned_units(self, question):
+        """Units named in question, directly or through a stream tag"""
+        units = []
+        for token in TOKEN_RE.findall(question.lower()):
+            if token in self.unit_ids:
+                units.append(self.unit_ids[token])
+            elif token in self.stream_ids:
+                units.extend(self.stream_ids[token])
+        return list(dict.fromkeys(units))
+
+    def neighborhood(self, seeds, hops=NEIGHBOR_HOPS):
+        """seeds followed by the units within hops streams of them (either direction), nearest first"""
+        order = list(dict.fromkeys(seeds))
+        frontier = order
+        seen = set(order)
+        for _ in range(hops):
+            next_frontier = []
+            for unit in frontier:
+                for neighbor in self.analysis.successors.get(unit, []) + self.analysis.predecessors.get(unit, []):
+                    if neighbor not in seen:
+                        seen.add(neighbor)
+                        next_frontier.append(neighbor)
+            order.extend(next_frontier)
+            frontier = next_frontier
+        return order
+
+    def overview(self):
+        """Plant-level facts that answer general questions without listing every unit"""
+        analysis = self.analysis
+        lines = ["Process Flow Diagram Description:", "",
+                 f"Plant size: {analysis.equipment_count} equipment items, {analysis.stream_count} streams",
+                 f"Equipment types: {_listing(f'{name} ×{count}' for name, count in self.type_counts.most_common())}",
+                 "", "Process Structure:",
+                 f"- Feed units: {_listing(analysis.start_equips)}",
+                 f"- Product units: {_listing(analysis.end_equips)}"]
+        for loop in analysis.recycle_loops[:OVERVIEW_LIST_ITEMS]:
+            lines.append(f"- Recycle loop: {_listing(loop)}")
+        return "\n".join(lines) + "\n"
+
+    def context(self, question, max_tokens=MAX_CONTEXT_TOKENS):
+        """Flowsheet text for question: the whole description when it fits max_tokens,
+        else the plant overview plus the subgraph around the units the question is about"""
+        if self.full_tokens <= max_tokens:
+            return self.full_text
+        seeds = self.mentioned_units(question)
+        if not seeds:
+            for _, chunk_index in self.search(question):
+                unit = self.chunks[chunk_index][0]
+                seeds.extend(unit if isinstance(unit, tuple) else (unit,))
+        text = self.overview()
+        remaining = max_tokens - count_tokens(text)
+        units = []
+        selected = set()
+        for unit in self.neighborhood(seeds):
+            lines = self.unit_lines.get(unit, [f"- {unit}"])
+            cost = count_tokens("\n".join(lines))
+            if cost > remaining:
+                break
+            units.extend(lines)
+            selected.add(unit)
+            remaining -= cost
+        streams = []
+        for index in sorted({index for unit in selected for index in self.unit_streams.get(unit, [])}):
+            lines = self.stream_lines[index]
+            cost = count_tokens("\n".join(lines))
+            if cost > remaining:
+                break
+            streams.extend(lines)
+            remaining -= cost
+        if not units:
+            return text + "\n(The question names no specific equipment; ask about a unit or stream tag for details.)\n"
+        return (text + f"\nEquipment relevant to the question ({len(selected)} of {self.analysis.equipment_count}):\n"
+                + "\n".join(units) + "\n\nStreams connected to that equipment:\n" + "\n".join(streams) + "\n")
+
+_index_cache = OrderedDict()
+_index_lock = threading.Lock()
+
+def get_flowsheet_index(process_data, key=None):
+    """FlowsheetIndex for process_data, built once per process hash"""
+    key = key or process_hash(process_data)
+    with _index_lock:
+        index = _index_cache.get(key)
+        if index is not None:
+            _index_cache.move_to_end(key)
+            return index
+    index = FlowsheetIndex(process_data, key)
+    with _index_lock:
+        _index_cache[key] = index
+        while len(_index_cache) > FLOWSHEET_INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+def flowsheet_context(process_data, question, key=None):
+    """Flowsheet description to send with a chat question about process_data"""
+    return get_flowsheet_index(process_data, key).context(question)
@@ -0,0 +1,254 @@
+import json
+import re
+from typing import List, Optional
+from pydantic import BaseModel, Field
+from flowsheet_stream import FlowsheetStreamParser
+from pfd_labels import EQUIPMENT_PARAMS, STREAM_PARAMS
+
+# Parameters coerced to numbers when the model writes them as text ("150 °C", "1,200"),
+# with the units each accepts (keys lowercase, without spaces) converted to the one
+# the app shows (°C, bar, kg/hr). Values in any other unit are rejected, not relabeled.
+UNIT_CONVERSIONS = {
+    'temperature': {
+        **dict.fromkeys(('°c', 'c', 'degc', 'celsius'), lambda value: value),
+        **dict.fromkeys(('k', 'kelvin'), lambda value: value - 273.15),
+        **dict.fromkeys(('°f', 'f', 'degf', 'fahrenheit'), lambda value: (value - 32) * 5 / 9),
+    },
+    'pressure': {
+        **dict.fromkeys(('bar', 'bara', 'bar(a)'), lambda value: value),
+        'kpa': lambda value: value / 100,
+        'mpa': lambda value: value * 10,
+        'pa': lambda value: value / 1e5,
+        **dict.fromkeys(('psi', 'psia'), lambda value: value * 0.0689476),
+        'atm': lambda value: value * 1.01325,
+    },
+    'flow': {
+        **dict.fromkeys(('kg/hr', 'kg/h', 'kg/hour', 'kgph'), lambda value: value),
+        **dict.fromkeys(('t/h', 't/hr', 'tonne/h', 'tonnes/h', 'tph'), lambda value: value * 1000),
+        'kg/min': lambda value: value * 60,
+        'kg/s': lambda value: value * 3600,
+        **dict.fromkeys(('lb/h', 'lb/hr', 'lbs/hr'), lambda value: value * 0.453592),
+    },
+}
+NUMERIC_PARAMS = tuple(UNIT_CONVERSIONS)
+DEFAULT_UNITS = {'temperature': '°C', 'pressure': 'bar', 'flow': 'kg/hr'}
+# Decimal places kept after a unit conversion
+CONVERTED_DIGITS = 4
+# One number, optionally followed by a unit that contains no further digits
+NUMBER_RE = re.compile(r'^\s*(-?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?|-?\.\d+)\s*([^\d\s.,-][^\d]*)?$')
+# Trailing commas before a closing bracket are the most common model JSON slip
+TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+# Characters of context quoted around a JSON syntax error
+ERROR_CONTEXT_CHARS = 40
+
+class FlowsheetError(ValueError):
+    """LLM output that is not a valid flowsheet; errors lists every problem found"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(errors))
+
+def _numeric_fields(params):
+    # field alias -> parameter name
+    return {field: name for name, aliases, _, _ in params if name in NUMERIC_PARAMS for field in aliases}
+
+EQUIPMENT_NUMERIC_FIELDS = _numeric_fields(EQUIPMENT_PARAMS)
+STREAM_NUMERIC_FIELDS = _numeric_fields(STREAM_PARAMS)
+
+def coerce_number(value, param=None):
+    """Number for 150, "150" or "1,200"; None for anything else (ranges, words).
+
+    With param ("temperature", "pressure", "flow"), a unit is accepted too and the
+    value converted to the app's unit ("500 K" -> 226.85, "1.5 MPa" -> 15); units
+    the parameter does not know, and units without a param, give None.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if not isinstance(value, str):
+        return None
+    match = NUMBER_RE.match(value)
+    if not match:
+        return None
+    number = float(match.group(1).replace(',', ''))
+    if match.group(2):
+        convert = UNIT_CONVERSIONS.get(param, {}).get(match.group(2).lower().replace(' ', '').replace('º', '°'))
+        if convert is None:
+            return None
+        number = round(convert(number), CONVERTED_DIGITS)
+    return int(number) if number.is_integer() else number
+
+def _line_col(text, pos):
+    line = text.count('\n', 0, pos) + 1
+    return line, pos - (text.rfind('\n', 0, pos) + 1) + 1
+
+def _syntax_error(text, start, error):
+    pos = start + error.pos
+    line, col = _line_col(text, pos)
+    context = text[max(pos - ERROR_CONTEXT_CHARS, 0):pos + ERROR_CONTEXT_CHARS].replace('\n', ' ')
+    return f"JSON syntax error at line {line}, column {col}: {error.msg} (near: ...{context}...)"
+
+def _load_blob(text, start, end):
+    blob = text[start:end]
+    try:
+        return json.loads(blob), None
+    except json.JSONDecodeError as error:
+        try:
+            return json.loads(TRAILING_COMMA_RE.sub(r'\1', blob)), None
+        except json.JSONDecodeError:
+            return None, _syntax_error(text, start, error)
+
+def extract_flowsheet_json(source):
+    """Find the flowsheet object in an LLM answer.
+
+    source is the answer text or the FlowsheetStreamParser that consumed its
+    stream. Prose, code fences and extra JSON objects around the flowsheet are
+    skipped; the first object with an "equipment" or "streams" key wins.
+    Raises FlowsheetError with the syntax problems when none can be read.
+    """
+    parser = source if isinstance(source, FlowsheetStreamParser) else None
+    if parser is None:
+        parser = FlowsheetStreamParser()
+        parser.feed(source)
+    text = parser.text
+    errors = []
+    fallback = None
+    for start, end in parser.blobs:
+        data, error = _load_blob(text, start, end)
+        if error:
+            errors.append(error)
+        elif isinstance(data, dict) and ('equipment' in data or 'streams' in data):
+            return data
+        elif fallback is None:
+            fallback = data
+    if fallback is not None and not errors:
+        return fallback
+    if parser.unclosed_start is not None:
+        line, _ = _line_col(text, parser.unclosed_start)
+        errors.append(f"JSON object starting at line {line} is never closed (the answer looks truncated)")
+    if not parser.blobs and parser.unclosed_start is None:
+        errors.append("No JSON object found in the answer")
+    raise FlowsheetError(errors)
+
+def _label(kind, index, record):
+    record_id = record.get('id') if isinstance(record, dict) else None
+    return f"{kind}[{index}]" + (f" ({record_id})" if record_id else "")
+
+def _coerce_fields(record, fields, label, errors, required=()):
+    for field, param in fields.items():
+        if field not in record or record[field] in (None, ""):
+            if field in required:
+                errors.append(f"{label}: missing '{field}'")
+            continue
+        number = coerce_number(record[field], param)
+        if number is None:
+            errors.append(f"{label}: '{field}' must be a number in {DEFAULT_UNITS[param]}, got {record[field]!r}")
+        else:
+            record[field] = number
+
+def validate_flowsheet(data, require_flow=True):
+    """Check and normalize a flowsheet dict in place; returns the list of problems found.
+
+    Checks the equipment/streams lists, required fields, unique IDs and that
+    every stream connects existing equipment. Temperature, pressure and flow
+    values written as text are coerced to numbers in °C, bar and kg/hr (known
+    units are converted, others are reported). Stream flow is required unless
+    require_flow is False (transcribed drawings often show no flows).
+    """
+    if not isinstance(data, dict):
+        return [f"Top level must be a JSON object, got {type(data).__name__}"]
+    errors = []
+    for key in ('equipment', 'streams'):
+        if not isinstance(data.get(key), list):
+            errors.append(f"'{key}' must be a list" if key in data else f"missing '{key}' list")
+    if errors:
+        return errors
+
+    equipment_ids = set()
+    for index, equip in enumerate(data['equipment']):
+        label = _label("equipment", index, equip)
+        if not isinstance(equip, dict):
+            errors.append(f"{label}: must be an object")
+            continue
+        for field in ('id', 'type'):
+            if not isinstance(equip.get(field), str) or not equip[field].strip():
+                errors.append(f"{label}: missing '{field}'")
+        if isinstance(equip.get('id'), str):
+            if equip['id'] in equipment_ids:
+                errors.append(f"{label}: duplicate equipment id '{equip['id']}'")
+            equipment_ids.add(equip['id'])
+        equip.setdefault('spec', '')
+        _coerce_fields(equip, EQUIPMENT_NUMERIC_FIELDS, label, errors)
+
+    stream_ids = set()
+    for index, stream in enumerate(data['streams']):
+        label = _label("streams", index, stream)
+        if not isinstance(stream, dict):
+            errors.append(f"{label}: must be an object")
+            continue
+        if not isinstance(stream.get('id'), str) or not stream['id'].strip():
+            errors.append(f"{label}: missing 'id'")
+        elif stream['id'] in stream_ids:
+            errors.append(f"{label}: duplicate stream id '{stream['id']}'")
+        else:
+            stream_ids.add(stream['id'])
+        for end in ('from', 'to'):
+            if end not in stream:
+                errors.append(f"{label}: missing '{end}'")
+            elif stream[end] not in equipment_ids:
+                errors.append(f"{label}: '{end}' references unknown equipment '{stream[end]}'")
+        _coerce_fields(stream, STREAM_NUMERIC_FIELDS, label, errors, required=('flow',) if require_flow else ())
+    return errors
+
+def parse_flowsheet(source, require_flow=True):
+    """Extract and validate the flowsheet in an LLM answer (text or FlowsheetStreamParser).
+
+    Returns the normalized process_data dict, or raises FlowsheetError listing
+    every problem so a single targeted repair request can fix them all.
+    """
+    data = extract_flowsheet_json(source)
+    errors = validate_flowsheet(data, require_flow)
+    if errors:
+        raise FlowsheetError(errors)
+    return data
+
+# Typed schema for models that support structured (schema-constrained) output.
+# Stream endpoints are from_unit/to_unit because "from" is a Python keyword;
+# to_process_data() maps them back to the dict layout the rest of the app uses.
+
+class EquipmentModel(BaseModel):
+    """One piece of process equipment"""
+    id: str = Field(description="Equipment tag, e.g. P-101")
+    type: str = Field(description="Equipment type, e.g. pump, heat_exchanger, distillation_column")
+    spec: str = Field(default="", description="Short specification, e.g. Feed Pump")
+    temperature: Optional[float] = Field(default=None, description="Operating temperature in °C")
+    pressure: Optional[float] = Field(default=None, description="Operating pressure in bar")
+    flow_rate: Optional[float] = Field(default=None, description="Design flow in kg/hr")
+    duty: Optional[float] = Field(default=None, description="Heat duty or power in kW")
+    efficiency: Optional[float] = Field(default=None, description="Efficiency in %")
+    stages: Optional[int] = Field(default=None, description="Number of stages or trays")
+
+class StreamModel(BaseModel):
+    """One process stream between two equipment items"""
+    id: str = Field(description="Stream id, e.g. S1")
+    from_unit: str = Field(description="Id of the equipment the stream leaves")
+    to_unit: str = Field(description="Id of the equipment the stream enters")
+    flow: float = Field(description="Flow rate")
+    comp: Optional[str] = Field(default=None, description="Composition, e.g. Water")
+    temperature: Optional[float] = Field(default=None, description="Temperature in °C")
+    pressure: Optional[float] = Field(default=None, description="Pressure in bar")
+
+class FlowsheetModel(BaseModel):
+    """Process flowsheet: equipment and the streams connecting them"""
+    equipment: List[EquipmentModel]
+    streams: List[StreamModel]
+
+def to_process_data(flowsheet):
+    """process_data dict from a FlowsheetModel, leaving out empty optional fields"""
+    equipment = [equip.model_dump(exclude_none=True) for equip in flowsheet.equipment]
+    streams = []
+    for stream in flowsheet.streams:
+        record = stream.model_dump(exclude_none=True, exclude={'from_unit', 'to_unit'})
+        streams.append({'id': record.pop('id'), 'from': stream.from_unit, 'to': stream.to_unit, **record})
+    return {'equipment': equipment, 'streams': streams}
@@ -0,0 +1,114 @@
+import json
+
+# Top-level arrays of a flowsheet whose items are reported as soon as they are complete
+FLOWSHEET_ARRAYS = ("equipment", "streams")
+
+class FlowsheetStreamParser:
+    """Incremental scanner over a streamed flowsheet JSON answer.
+
+    feed() takes each text chunk and returns the equipment/stream objects
+    completed by it, so the UI can show units before the whole answer has
+    arrived. Each character is scanned once, however the answer is chunked;
+    text around the JSON (prose, code fences) is skipped.
+    """
+
+    def __init__(self, arrays=FLOWSHEET_ARRAYS):
+        self.arrays = arrays
+        self._chunks = []
+        # Text from the oldest string or item still open, for slicing it once complete
+        self._tail = ""
+        self._tail_start = 0
+        self.items = {name: [] for name in arrays}
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._array = None         # array name while inside one of self.arrays
+        self._array_depth = None
+        self._item_start = None
+        self._blob_start = None
+        # (start, end) offsets of every complete top-level JSON object seen so far
+        self.blobs = []
+
+    def feed(self, chunk):
+        """Scan chunk; return [(array name, item dict)] for every item it completes"""
+        self._chunks.append(chunk)
+        completed = []
+        tail = self._tail + chunk
+        base = self._tail_start
+        end = self._pos + len(chunk)
+        for pos in range(self._pos, end):
+            char = tail[pos - base]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = tail[self._string_start - base:pos - base]
+                continue
+            if self._depth == 0:
+                # Prose around the JSON is not scanned: an inch mark (12" line) is no string
+                if char == '{':
+                    self._depth = 1
+                    self._blob_start = pos
+                continue
+            if char == '"':
+                self._in_string = True
+                self._string_start = pos + 1
+            elif char in '{[':
+                self._depth += 1
+                # "equipment": [ directly inside the top-level object
+                if char == '[' and self._array is None and self._depth == 2 and self._last_string in self.arrays:
+                    self._array = self._last_string
+                    self._array_depth = self._depth
+                elif char == '{' and self._array is not None and self._depth == self._array_depth + 1:
+                    self._item_start = pos
+            elif char in '}]':
+                if self._array is not None:
+                    if char == '}' and self._depth == self._array_depth + 1 and self._item_start is not None:
+                        item = self._parse_item(tail[self._item_start - base:pos + 1 - base])
+                        if item is not None:
+                            self.items[self._array].append(item)
+                            completed.append((self._array, item))
+                        self._item_start = None
+                    elif char == ']' and self._depth == self._array_depth:
+                        self._array = None
+                if char == '}' and self._depth == 1 and self._blob_start is not None:
+                    self.blobs.append((self._blob_start, pos + 1))
+                    self._blob_start = None
+                self._depth = max(self._depth - 1, 0)
+            elif char in ',:':
+                continue
+            elif not char.isspace():
+                self._last_string = None
+        self._pos = end
+        keep = min([start for start in (self._string_start if self._in_string else None, self._item_start)
+                    if start is not None] or [end])
+        self._tail = tail[keep - base:]
+        self._tail_start = keep
+        return completed
+
+    @property
+    def text(self):
+        """The whole answer fed so far"""
+        # Joined on demand, so feeding stays linear in the answer length
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    @property
+    def unclosed_start(self):
+        """Offset of a top-level object still open (e.g. a truncated answer), or None"""
+        return self._blob_start if self._depth > 0 else None
+
+    @staticmethod
+    def _parse_item(item_text):
+        try:
+            item = json.loads(item_text)
+        except ValueError:
+            return None  # Malformed item; the full-answer parser deals with it
+        return item if isinstance(item, dict) else None
@@ -1,32 +1,23 @@
 from graphviz import Digraph
-from equipment_symbols import get_equipment_color, get_equipment_shape
+from equipment_symbols import get_equipment_style, symbol_library_key
+from render_cache import render_cache
+from process_graph import analyze_process_flow
+from large_layout import is_large_flowsheet, LARGE_LAYOUT_ATTRS, compose_large_layout
+from pfd_labels import equipment_record, stream_record, equipment_label, stream_label
+from pfd_layout import ProgressiveRender, start_progressive_render, get_layout, export_from_layout, export_cache_key
 
-def create_high_quality_pfd_graphviz(process_data):
+# Render settings; anything here changes the output and is part of the cache key
+HQ_DPI = '600'
+HQ_SIZE = '24,16'
+# Bump when node/edge styling changes so stale cached renders are not served
+HQ_STYLE_VERSION = 3
+
+def create_high_quality_pfd_graphviz(process_data, units=None, large=None):
     """Create PFD using graphviz with maximum quality settings"""
     # Analyze process flow
-    streams = process_data['streams']
-    
-    # Find equipment that are part of recycling loops
-    recycles = set()
-    for stream in streams:
-        for other_stream in streams:
-            if stream['to'] == other_stream['from'] and stream['from'] == other_stream['to']:
-                pair = tuple(sorted([stream['from'], stream['to']]))
-                recycles.add(pair)
-    
-    # Find equipment with multiple incoming streams (mixing points)
-    incoming_counts = {}
-    for stream in streams:
-        incoming_counts[stream['to']] = incoming_counts.get(stream['to'], 0) + 1
-    
-    mixing_points = [eq for eq, count in incoming_counts.items() if count > 1]
-    
-    # Find equipment with multiple outgoing streams (splitting points)
-    outgoing_counts = {}
-    for stream in streams:
-        outgoing_counts[stream['from']] = outgoing_counts.get(stream['from'], 0) + 1
-    
-    splitting_points = [eq for eq, count in outgoing_counts.items() if count > 1]
+    flow_analysis = analyze_process_flow(process_data)
+    mixing_points = flow_analysis.mixing_points
+    splitting_points = flow_analysis.splitting_points
     
     # Create a directed graph with maximum quality settings
     dot = Digraph(comment='Process Flow Diagram', format='png')
@@ -34,8 +25,8 @@ def create_high_quality_pfd_graphviz(process_data):
     # Maximum quality graph attributes
     dot.attr(
         rankdir='LR',           # Left to right layout
-        size='24,16',           # Larger size for maximum quality
-        dpi='600',              # Very high DPI for crisp quality
+        size=HQ_SIZE,           # Larger size for maximum quality
+        dpi=HQ_DPI,             # Very high DPI for crisp quality
         ratio='fill',           # Fill the specified size
         ranksep='1.8',          # Good space between ranks
         nodesep='1.5',          # Good space between nodes
@@ -65,109 +56,25 @@ def create_high_quality_pfd_graphviz(process_data):
              labelfloat='false',
              penwidth='2')
 
+    # Large flowsheets get cheap routing so dot stays close to linear
+    if large is None:
+        large = is_large_flowsheet(process_data)
+    if large:
+        dot.attr(**LARGE_LAYOUT_ATTRS)
+
     # Add equipment nodes with detailed labels
     for equip in process_data['equipment']:
         equip_id = equip['id']
+        if units is not None and equip_id not in units:
+            continue
         equip_type = equip['type']
-        equip_spec = equip.get('spec', '')
-        
-        # Create detailed label with equipment info and parameters
-        # Limit text length to prevent breaking
-        label_parts = [f"<B>{equip_id}</B>"]  # Bold ID
-        
-        # Add equipment type (limit length)
-        equip_type_short = equip_type.replace('_', ' ').title()
-        if len(equip_type_short) > 15:  # Limit type length
-            equip_type_short = equip_type_short[:15] + "..."
-        label_parts.append(f"<I>{equip_type_short}</I>")  # Italic type
-        
-        # Add specification if available (limit length)
-        if equip_spec:
-            spec_short = equip_spec[:20] + "..." if len(equip_spec) > 20 else equip_spec
-            label_parts.append(f"<FONT POINT-SIZE='10'>{spec_short}</FONT>")
-        
-        # Add parameters
-        params = []
-        
-        # Add temperature if mentioned
-        temp_fields = ['temperature', 'temp', 'operating_temp', 'design_temp']
-        for field in temp_fields:
-            if field in equip and equip[field]:
-                temp_str = f"T: {equip[field]}°C"
-                if len(temp_str) <= 12:
-                    params.append(temp_str)
-                break
-        
-        # Add pressure if mentioned
-        pressure_fields = ['pressure', 'pres', 'operating_pres', 'design_pres']
-        for field in pressure_fields:
-            if field in equip and equip[field]:
-                pres_str = f"P: {equip[field]} bar"
-                if len(pres_str) <= 12:
-                    params.append(pres_str)
-                break
-        
-        # Add flow rate if mentioned
-        flow_fields = ['flow', 'flow_rate', 'capacity', 'design_flow']
-        for field in flow_fields:
-            if field in equip and equip[field]:
-                flow_str = f"Flow: {equip[field]} kg/hr"
-                if len(flow_str) <= 15:
-                    params.append(flow_str)
-                break
-        
-        # Add duty if mentioned
-        duty_fields = ['duty', 'heat_duty', 'cooling_duty', 'power']
-        for field in duty_fields:
-            if field in equip and equip[field]:
-                duty_str = f"Duty: {equip[field]} kW"
-                if len(duty_str) <= 15:
-                    params.append(duty_str)
-                break
-        
-        # Add efficiency if mentioned
-        eff_fields = ['efficiency', 'eff', 'design_eff']
-        for field in eff_fields:
-            if field in equip and equip[field]:
-                eff_str = f"Eff: {equip[field]}%"
-                if len(eff_str) <= 12:
-                    params.append(eff_str)
-                break
-        
-        # Add stages if mentioned
-        stage_fields = ['stages', 'trays', 'number_of_trays']
-        for field in stage_fields:
-            if field in equip and equip[field]:
-                stage_str = f"Stages: {equip[field]}"
-                if len(stage_str) <= 12:
-                    params.append(stage_str)
-                break
-        
-        # Add parameters to label
-        if params:
-            selected_params = params[:3]  # Limit to 3 parameters
-            param_str = " | ".join(selected_params)
-            label_parts.append(f"<FONT POINT-SIZE='9'>{param_str}</FONT>")
-        # Add temperature and pressure to the equipment label if available
-        temp_fields = ['temperature', 'temp', 'operating_temp', 'design_temp']
-        for field in temp_fields:
-            if field in equip and equip[field]:
-                temp_str = f"T: {equip[field]}°C"
-                label_parts.append(temp_str)
-                break
-
-        pressure_fields = ['pressure', 'pres', 'operating_pres', 'design_pres']
-        for field in pressure_fields:
-            if field in equip and equip[field]:
-                pres_str = f"P: {equip[field]} bar"
-                label_parts.append(pres_str)
-                break
-        # Combine all parts with HTML formatting for better alignment
-        detailed_label = f"<{'<BR ALIGN=\"LEFT\"/>' .join(label_parts)}>"
+        # HTML label with bold ID, italic type, spec and up to 3 parameters
+        detailed_label = equipment_label(equipment_record(equip), html_label=True)
         
         # Set color and shape based on equipment type
-        fillcolor = get_equipment_color(equip_type)
-        shape = get_equipment_shape(equip_type)
+        symbol = get_equipment_style(equip_type)
+        fillcolor = symbol['fillcolor']
+        shape = symbol['shape']
         
         # Highlight mixing and splitting points
         if equip_id in mixing_points:
@@ -198,50 +105,14 @@ def create_high_quality_pfd_graphviz(process_data):
                     height='1.2')
 
     # Add stream edges with detailed labels
-    for stream in process_data['streams']:
-        # Create detailed stream label
-        stream_label_parts = [f"<B>{stream['id']}</B>"]  # Bold ID
-        
-        # Add parameters
-        temp_fields = ['temperature', 'temp', 'stream_temp']
-        for field in temp_fields:
-            if field in stream and stream[field]:
-                temp_str = f"T: {stream[field]}°C"
-                if len(temp_str) <= 12:
-                    stream_label_parts.append(temp_str)
-                break
-        
-        pressure_fields = ['pressure', 'pres', 'stream_pres']
-        for field in pressure_fields:
-            if field in stream and stream[field]:
-                pres_str = f"P: {stream[field]} bar"
-                if len(pres_str) <= 12:
-                    stream_label_parts.append(pres_str)
-                break
-        
-        flow_fields = ['flow', 'flow_rate', 'stream_flow']
-        for field in flow_fields:
-            if field in stream and stream[field]:
-                flow_str = f"Flow: {stream[field]} kg/hr"
-                if len(flow_str) <= 15:
-                    stream_label_parts.append(flow_str)
-                break
-        
-        comp_fields = ['comp', 'composition', 'stream_comp']
-        for field in comp_fields:
-            if field in stream and stream[field]:
-                comp = stream[field][:20] + "..." if len(str(stream[field])) > 20 else str(stream[field])
-                comp_str = f"Comp: {comp}"
-                if len(comp_str) <= 20:
-                    stream_label_parts.append(comp_str)
-                break
-        
-        # Limit to first 3 parameters
-        detailed_stream_label = f"<{'<BR ALIGN=\"LEFT\"/>' .join(stream_label_parts[:4])}>"
+    for stream_index, stream in enumerate(process_data['streams']):
+        if units is not None and (stream['from'] not in units or stream['to'] not in units):
+            continue
+        # Create detailed stream label (ID plus up to 3 parameters)
+        detailed_stream_label = stream_label(stream_record(stream), html_label=True)
         
         # Check if this is a recycling stream
-        stream_pair = tuple(sorted([stream['from'], stream['to']]))
-        is_recycle = stream_pair in recycles
+        is_recycle = flow_analysis.is_recycle(stream_index)
         
         if is_recycle:
             dot.edge(stream['from'], stream['to'], 
@@ -262,9 +133,49 @@ def create_high_quality_pfd_graphviz(process_data):
 
     return dot
 
-def generate_high_quality_pfd_image(process_data):
-    """Generate high-quality PFD image as bytes"""
-    pfd_graph = create_high_quality_pfd_graphviz(process_data)
-    # Render to PNG bytes with maximum quality
-    png_data = pfd_graph.pipe(format='png')
-    return png_data
\ No newline at end of file
+def _layout_settings(process_data):
+    # Everything besides process_data that changes the dot layout
+    return {'generator': 'high_quality', 'size': HQ_SIZE, 'style': HQ_STYLE_VERSION,
+            'symbols': symbol_library_key(), 'large': is_large_flowsheet(process_data)}
+
+def _layout_sources(process_data, owner=None):
+    """Graph factory, optional custom layout function and cache settings for process_data"""
+    settings = _layout_settings(process_data)
+
+    def graph_factory(**kwargs):
+        return create_high_quality_pfd_graphviz(process_data, **kwargs)
+
+    layout_fn = None
+    if settings['large']:
+        # Sections are laid out independently and in parallel, then composed
+        layout_fn = lambda: compose_large_layout(process_data, graph_factory, owner=owner)
+    return graph_factory, layout_fn, settings
+
+def _full_png_dpi(settings):
+    # Large flowsheets keep the lower DPI set in their layout
+    return None if settings['large'] else HQ_DPI
+
+def get_high_quality_layout(process_data, owner=None):
+    """Positioned DOT layout for process_data, computed once and cached with its process hash"""
+    graph_factory, layout_fn, settings = _layout_sources(process_data, owner)
+    return get_layout(process_data, graph_factory, owner=owner, layout_fn=layout_fn, **settings)
+
+def export_high_quality_pfd(process_data, output='png', dpi=None, owner=None):
+    """Render process_data as png/svg/pdf from the cached layout, without re-running layout"""
+    graph_factory, layout_fn, settings = _layout_sources(process_data, owner)
+    if output == 'png' and dpi is None:
+        dpi = _full_png_dpi(settings)
+    return export_from_layout(process_data, graph_factory, output=output, dpi=dpi, owner=owner,
+                              layout_fn=layout_fn, **settings)
+
+def start_high_quality_pfd_render(process_data, owner=None):
+    """Start a two-phase render: a quick preview now, the full-quality PNG in the background"""
+    settings = _layout_settings(process_data)
+    key = export_cache_key(process_data, 'png', _full_png_dpi(settings), **settings)
+    cached = render_cache.get(key)
+    if cached is not None:
+        return ProgressiveRender(cached)
+    layout = get_high_quality_layout(process_data, owner=owner)
+    # Store the full render once it lands so later requests are cache hits
+    return start_progressive_render(layout, owner=owner,
+                                    on_complete=lambda png_data: render_cache.put(key, png_data))
@@ -0,0 +1,75 @@
+import os
+import threading
+from cache_utils import canonical_hash, LRUCache
+from vision_preprocess import VisionPayload, preprocess_pfd_image, VISION_MAX_SIDE
+
+# Encoded payloads kept in memory, shared by every session of the worker
+PAYLOAD_CACHE_MAX_ITEMS = 64
+PAYLOAD_CACHE_MAX_BYTES = int(os.getenv("PFD_PAYLOAD_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+class ImagePayloadCache:
+    """Bounded cache of vision payloads, keyed by the content hash of the uploaded file.
+
+    Each image is preprocessed and base64-encoded once; later questions, the
+    predefined question buttons and other sessions uploading the same file reuse
+    the encoded payload. Concurrent requests for one image wait for a single encode.
+    """
+
+    def __init__(self, max_items=PAYLOAD_CACHE_MAX_ITEMS, max_bytes=PAYLOAD_CACHE_MAX_BYTES):
+        self.memory = LRUCache(max_items=max_items, max_bytes=max_bytes)
+        self.encodes = 0
+        self._key_locks = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(content_key):
+        # Preprocessing settings are part of the key so a new max side re-encodes
+        return canonical_hash({"image": content_key}, max_side=VISION_MAX_SIDE)
+
+    def get_or_encode(self, content_key, image):
+        """VisionPayload for image (PIL), identified by content_key (e.g. pfd_key_for_bytes of the upload)"""
+        if isinstance(image, VisionPayload):
+            return image
+        key = self.make_key(content_key)
+        payload = self.memory.get(key)
+        if payload is not None:
+            return payload
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            payload = self.memory.get(key)
+            if payload is None:
+                payload = preprocess_pfd_image(image)
+                payload.data_url  # Encode to base64 now, once, rather than on the first question
+                self.memory.put(key, payload)
+                with self._lock:
+                    self.encodes += 1
+                for listener in self._listeners:
+                    listener(content_key, payload)
+        with self._lock:
+            self._key_locks.pop(key, None)
+        return payload
+
+    def get(self, content_key):
+        return self.memory.get(self.make_key(content_key))
+
+    def put(self, content_key, payload):
+        """Store a payload encoded elsewhere (e.g. loaded from a persistent store)"""
+        self.memory.put(self.make_key(content_key), payload)
+
+    def add_listener(self, listener):
+        """Call listener(content_key, payload) for every payload encoded from now on"""
+        self._listeners.append(listener)
+
+    def clear(self):
+        self.memory.clear()
+
+    def stats(self):
+        stats = self.memory.stats()
+        with self._lock:
+            stats["encodes"] = self.encodes
+        return stats
+
+# Process-wide payload cache used by the image analysis pages
+image_payloads = ImagePayloadCache()
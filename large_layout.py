@@ -0,0 +1,190 @@
+import json
+import math
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import wait, FIRST_COMPLETED
+from process_graph import get_flow_analysis
+from render_pool import render_pool
+
+# Flowsheets above either threshold switch to the large-flowsheet layout
+LARGE_FLOWSHEET_NODES = int(os.getenv("PFD_LARGE_FLOWSHEET_NODES", "60"))
+LARGE_FLOWSHEET_EDGES = int(os.getenv("PFD_LARGE_FLOWSHEET_EDGES", "120"))
+# Sections bigger than this are split again by topological rank
+MAX_SECTION_UNITS = 40
+# Gap between independently laid out sections, in points
+SECTION_GAP = 72
+# Output resolution for large flowsheets; 600 DPI on a plant-sized canvas is gigapixels
+LARGE_DPI = '150'
+# Above this many units the composed drawing uses straight edges; neato's
+# obstacle-avoiding polyline routing gets slow on very large plants
+POLYLINE_ROUTING_MAX_UNITS = 300
+
+# Cheap dot settings: ortho splines, edge concentration and packing are the
+# super-linear parts; mclimit/nslimit cap crossing minimisation and ranking work
+LARGE_LAYOUT_ATTRS = {
+    'splines': 'polyline',
+    'concentrate': 'false',
+    'pack': 'false',
+    'size': '',
+    'dpi': LARGE_DPI,
+    'mclimit': '0.3',
+    'nslimit': '2',
+    'nslimit1': '2',
+    'searchsize': '20',
+}
+
+# Equipment fields that name the plant section a unit belongs to
+SECTION_FIELDS = ['section', 'area', 'process_section']
+# ISA-style tags: the hundreds digit of P-101 / E-2301 is the plant area
+AREA_TAG_RE = re.compile(r'[-_ ]?(\d)\d{2,3}[A-Z]?$', re.IGNORECASE)
+
+def is_large_flowsheet(process_data):
+    """True when the flowsheet is too big for the full-quality ortho layout"""
+    return (len(process_data['equipment']) > LARGE_FLOWSHEET_NODES
+            or len(process_data['streams']) > LARGE_FLOWSHEET_EDGES)
+
+def _section_of(equip):
+    for field in SECTION_FIELDS:
+        if equip.get(field):
+            return str(equip[field])
+    match = AREA_TAG_RE.search(equip['id'])
+    if match:
+        return f"Area {match.group(1)}00"
+    return None
+
+def _split_by_rank(members, topo_rank, max_units):
+    # Consecutive topological ranks stay together so each chunk is a process stretch
+    ordered = sorted(members, key=lambda unit: topo_rank.get(unit, 0))
+    return [ordered[i:i + max_units] for i in range(0, len(ordered), max_units)]
+
+def partition_sections(process_data, flow_analysis=None, max_units=MAX_SECTION_UNITS):
+    """Group units into process sections, ordered upstream to downstream.
+
+    Uses an explicit section/area field when present, then the area digit of
+    ISA-style tags, then bands of topological rank. Oversized sections are
+    split by rank so no section exceeds max_units.
+    """
+    flow_analysis = flow_analysis or get_flow_analysis(process_data)
+    topo_rank = flow_analysis.topo_rank
+    assigned = {}
+    for equip in process_data['equipment']:
+        section = _section_of(equip)
+        if section:
+            assigned[equip['id']] = section
+
+    # Units without a section follow an upstream neighbour, otherwise a downstream one
+    for unit in sorted(flow_analysis.nodes, key=lambda node: topo_rank.get(node, 0)):
+        if unit in assigned:
+            continue
+        for neighbour in flow_analysis.predecessors.get(unit, []) + flow_analysis.successors.get(unit, []):
+            if neighbour in assigned:
+                assigned[unit] = assigned[neighbour]
+                break
+
+    grouped = OrderedDict()
+    for unit in flow_analysis.nodes:
+        grouped.setdefault(assigned.get(unit), []).append(unit)
+    # A single section (or none found) gives no structure; fall back to rank bands
+    if len([name for name in grouped if name is not None]) <= 1:
+        grouped = OrderedDict([(None, list(flow_analysis.nodes))])
+
+    sections = []
+    for name, members in grouped.items():
+        chunks = _split_by_rank(members, topo_rank, max_units)
+        for number, chunk in enumerate(chunks, 1):
+            if name is None:
+                label = f"Section {len(sections) + 1}"
+            else:
+                label = name if len(chunks) == 1 else f"{name} ({number})"
+            sections.append((label, chunk))
+    # Upstream sections first so they are placed left to right in process order
+    sections.sort(key=lambda item: min(topo_rank.get(unit, 0) for unit in item[1]))
+    return OrderedDict(sections)
+
+def _parse_point(value):
+    x, y = value.split(',')[:2]
+    return float(x), float(y.rstrip('!'))
+
+def parse_json_layout(json_bytes):
+    """Node centres (points) and bounding box from dot -Tjson output"""
+    layout = json.loads(json_bytes)
+    bb = [float(v) for v in layout['bb'].split(',')]
+    positions = {}
+    for obj in layout.get('objects', []):
+        # Cluster subgraphs also appear in objects; only real nodes carry pos
+        if 'pos' in obj and 'nodes' not in obj:
+            positions[obj['name']] = _parse_point(obj['pos'])
+    return positions, bb
+
+def layout_sections(sections, graph_factory, owner=None):
+    """Lay out every section as its own dot graph, in parallel through the render pool.
+
+    If one section fails, the other running sections are cancelled before the error is raised.
+    """
+    results = {}
+    pending = list(sections.items())
+    running = {}
+    try:
+        while pending or running:
+            # Stay within the pool's worker count so a big plant cannot fill its queue
+            while pending and len(running) < render_pool.max_workers:
+                name, members = pending.pop(0)
+                graph = graph_factory(units=set(members), large=True)
+                running[render_pool.submit(graph.source, 'json', engine=graph.engine, owner=owner)] = name
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running[future]] = parse_json_layout(future.result())
+                del running[future]
+    except BaseException:
+        # Free the pool slots the remaining sections hold
+        render_pool.cancel_futures(running)
+        raise
+    return results
+
+def arrange_sections(sections, section_layouts, gap=SECTION_GAP):
+    """Offset each section's layout into rows, left to right in process order"""
+    sizes = {name: (bb[2] - bb[0], bb[3] - bb[1]) for name, (_, bb) in section_layouts.items()}
+    total_area = sum((w + gap) * (h + gap) for w, h in sizes.values())
+    # Wrap rows at a width that keeps the overall drawing roughly 3:2
+    row_width = max(max(w for w, _ in sizes.values()), math.sqrt(total_area * 1.5))
+    positions = {}
+    boxes = {}
+    x = y = row_height = 0.0
+    for name in sections:
+        positions_in, bb = section_layouts[name]
+        width, height = sizes[name]
+        if x > 0 and x + width > row_width:
+            x = 0.0
+            y -= row_height + gap
+            row_height = 0.0
+        dx = x - bb[0]
+        dy = y - bb[3]  # Rows grow downwards from y
+        for unit, (ux, uy) in positions_in.items():
+            positions[unit] = (ux + dx, uy + dy)
+        boxes[name] = (x, y - height, x + width, y)
+        x += width + gap
+        row_height = max(row_height, height)
+    return positions, boxes
+
+def compose_large_layout(process_data, graph_factory, owner=None):
+    """Positioned DOT source for a large flowsheet, built from per-section layouts"""
+    sections = partition_sections(process_data)
+    section_layouts = layout_sections(sections, graph_factory, owner=owner)
+    positions, boxes = arrange_sections(sections, section_layouts)
+
+    graph = graph_factory(large=True)
+    if len(positions) > POLYLINE_ROUTING_MAX_UNITS:
+        graph.attr(splines='line')
+    # Section frames; neato -n draws clusters from their bb
+    for number, (name, members) in enumerate(sections.items()):
+        with graph.subgraph(name=f'cluster_section_{number}') as cluster:
+            cluster.attr(label=name, style='dashed', color='grey40', fontsize='14',
+                         bb='%.2f,%.2f,%.2f,%.2f' % boxes[name])
+            for unit in members:
+                cluster.node(unit)
+    for unit, (x, y) in positions.items():
+        graph.node(unit, pos='%.2f,%.2f' % (x, y))
+    # Nodes are fixed; neato -n2 only routes the edges, then -Tdot emits the
+    # full positioned layout that every output format is rendered from
+    return render_pool.render(graph.source, 'dot', engine='neato', args=['-n2'], owner=owner).decode('utf-8')
@@ -0,0 +1,137 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from cache_utils import canonical_hash, LRUCache, DiskCache
+
+# Shared on-disk location so every Streamlit worker on the host reuses answers
+LLM_CACHE_DIR = os.getenv("PFD_LLM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pfd_llm_cache"))
+LLM_CACHE_MAX_BYTES = int(os.getenv("PFD_LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Answers older than this are asked again; 0 disables expiry
+LLM_CACHE_TTL = float(os.getenv("PFD_LLM_CACHE_TTL", str(7 * 24 * 3600)))
+MEMORY_CACHE_MAX_ITEMS = 256
+MEMORY_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+class LLMResponseCache:
+    """Two-tier (memory LRU + shared disk) cache for LLM text responses with a TTL.
+
+    Entries store their creation time next to the response; the disk tier's
+    mtime is refreshed on hits for LRU eviction, so it cannot double as the age.
+    """
+
+    def __init__(self, directory=LLM_CACHE_DIR, max_disk_bytes=LLM_CACHE_MAX_BYTES, ttl=LLM_CACHE_TTL,
+                 max_memory_items=MEMORY_CACHE_MAX_ITEMS, max_memory_bytes=MEMORY_CACHE_MAX_BYTES):
+        self.memory = LRUCache(max_items=max_memory_items, max_bytes=max_memory_bytes)
+        self.disk = DiskCache(directory, max_bytes=max_disk_bytes, suffix=".json")
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.bypassed = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model, temperature, prompt_version, text, **settings):
+        """Build the key from everything that changes the answer: model, sampling, prompt and input"""
+        return canonical_hash({"model": model, "temperature": temperature,
+                               "prompt_version": prompt_version, "text": text}, **settings)
+
+    def _load(self, key):
+        entry = self.memory.get(key)
+        from_disk = entry is None
+        if from_disk:
+            entry = self.disk.get(key)
+        if entry is None:
+            return None
+        try:
+            record = json.loads(entry)
+        except ValueError:
+            self.delete(key)
+            return None
+        if self.ttl and time.time() - record["created"] > self.ttl:
+            self.delete(key)
+            with self._lock:
+                self.expired += 1
+            return None
+        if from_disk:
+            # Promote disk hits so the next lookup stays in memory
+            self.memory.put(key, entry)
+        return record["response"]
+
+    def get(self, key):
+        response = self._load(key)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return response
+
+    def put(self, key, response):
+        entry = json.dumps({"created": time.time(), "response": response}, ensure_ascii=False).encode("utf-8")
+        self.memory.put(key, entry)
+        self.disk.put(key, entry)
+
+    def get_or_call(self, key, call_fn, bypass=False, store_if=None):
+        """Return the cached response for key, calling call_fn() and storing its result on a miss.
+
+        bypass=True always calls the model and refreshes the stored answer.
+        store_if(response), when given, decides whether a new response is stored
+        (e.g. only answers that validate), so a bad one is asked again next time.
+        """
+        if bypass:
+            with self._lock:
+                self.bypassed += 1
+            response = None
+        else:
+            response = self.get(key)
+        if response is None:
+            response = call_fn()
+            if response and (store_if is None or store_if(response)):
+                self.put(key, response)
+        return response
+
+    def stream_or_call(self, key, stream_fn, bypass=False, store_if=None):
+        """Like get_or_call, for streamed responses: yields the cached response in one
+        piece or the chunks of stream_fn(). The response is stored only if the stream completes.
+        """
+        if bypass:
+            with self._lock:
+                self.bypassed += 1
+        else:
+            response = self.get(key)
+            if response is not None:
+                yield response
+                return
+        chunks = []
+        for chunk in stream_fn():
+            chunks.append(chunk)
+            yield chunk
+        response = "".join(chunks)
+        if response and (store_if is None or store_if(response)):
+            self.put(key, response)
+
+    def delete(self, key):
+        self.memory.delete(key)
+        self.disk.delete(key)
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "bypassed": self.bypassed,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory": self.memory.stats(),
+                "disk": self.disk.stats(),
+            }
+
+# Process-wide cache used by the LLM calls
+llm_cache = LLMResponseCache()
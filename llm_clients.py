@@ -0,0 +1,75 @@
+import json
+import os
+import threading
+from cache_utils import canonical_hash
+
+LLM_MODEL = "gemini-2.0-flash"
+LLM_TEMPERATURE = 0.1
+# Which backend serves chat models: "gemini" (default) or "stub" for tests and benchmarks
+LLM_BACKEND = os.getenv("PFD_LLM_BACKEND", "gemini")
+
+# Canned answer of the stub backend: a small flowsheet every parser and renderer accepts
+STUB_RESPONSE = os.getenv("PFD_STUB_RESPONSE") or json.dumps({
+    "equipment": [
+        {"type": "tank", "id": "T-101", "spec": "Feed Tank"},
+        {"type": "pump", "id": "P-101", "spec": "Feed Pump"},
+        {"type": "heat_exchanger", "id": "E-101", "spec": "Feed Heater"},
+    ],
+    "streams": [
+        {"id": "S1", "from": "T-101", "to": "P-101", "flow": 100, "comp": "Water"},
+        {"id": "S2", "from": "P-101", "to": "E-101", "flow": 100, "comp": "Water"},
+    ],
+})
+
+def _gemini_backend(model, temperature, **options):
+    # Imported here so the stub backend works without the Google client installed
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("Please set GOOGLE_API_KEY in environment variables")
+    # One long-lived client keeps its transport (and its pooled, keep-alive
+    # connections) open, so later calls skip connection setup and the TLS handshake
+    return ChatGoogleGenerativeAI(model=model, temperature=temperature, api_key=api_key, **options)
+
+def _stub_backend(model, temperature, **options):
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    return FakeListChatModel(responses=options.get("responses", [STUB_RESPONSE]))
+
+# name -> factory(model, temperature, **options) returning a LangChain chat model
+BACKENDS = {
+    "gemini": _gemini_backend,
+    "stub": _stub_backend,
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def register_backend(name, factory):
+    """Make a chat model backend available under name (e.g. a local model server)"""
+    with _clients_lock:
+        BACKENDS[name] = factory
+
+def get_llm_client(model=LLM_MODEL, temperature=LLM_TEMPERATURE, backend=None, **options):
+    """Shared chat model client for this model/config, created once per worker process.
+
+    The process id is part of the key: forked workers must not share a parent's
+    open connections.
+    """
+    backend = backend or LLM_BACKEND
+    # Options may hold unhashable values (e.g. the stub backend's responses list)
+    key = (backend, model, temperature, canonical_hash(options), os.getpid())
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                if backend not in BACKENDS:
+                    raise ValueError(f"Unknown LLM backend '{backend}' (available: {', '.join(BACKENDS)})")
+                client = BACKENDS[backend](model, temperature, **options)
+                _clients[key] = client
+    return client
+
+def clear_clients():
+    """Drop every cached client, e.g. after the API key changes"""
+    with _clients_lock:
+        _clients.clear()
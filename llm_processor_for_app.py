@@ -1,102 +1,107 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+import json
 import os
 from dotenv import load_dotenv
+from llm_cache import llm_cache
+from flowsheet_json import parse_flowsheet, FlowsheetError, FlowsheetModel, to_process_data
+from prompt_builder import process_description_prompt, prompt_version
+from token_usage import usage_callback
 
 load_dotenv()
 
+# After load_dotenv so PFD_LLM_BACKEND can be set in .env
+from llm_clients import get_llm_client, LLM_MODEL, LLM_TEMPERATURE, LLM_BACKEND
+
+# Ask for schema-constrained output (typed equipment/streams, no surrounding prose)
+# instead of JSON in free text. Falls back to the text path when the model cannot.
+STRUCTURED_OUTPUT = os.getenv("PFD_STRUCTURED_OUTPUT", "0") == "1"
+
+def _description_key(normalized_description, structured):
+    # Keyed by the prompt variant's version (see prompt_builder), so editing a
+    # variant's text never reuses answers given to the old one
+    return llm_cache.make_key(LLM_MODEL, LLM_TEMPERATURE, prompt_version(), normalized_description,
+                              backend=LLM_BACKEND, structured=structured)
+
+def _is_valid_flowsheet(response):
+    # Only answers that validate are cached; an invalid one goes through repair,
+    # which caches the repaired answer if it validates
+    try:
+        parse_flowsheet(response)
+    except FlowsheetError:
+        return False
+    return True
+
 def get_llm():
-    """Initialize LLM"""
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        raise ValueError("Please set OPENAI_API_KEY in environment variables")
-    return ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.1, api_key=api_key)
-
-def parse_process_description(process_description):
-    """Use LLM to parse natural language process description with structured output"""
-    llm = get_llm()
-    
+    """Shared LLM client, created once per worker and reused by every call"""
+    return get_llm_client(LLM_MODEL, LLM_TEMPERATURE)
+
+def parse_process_description(process_description, use_cache=True, structured=None):
+    """Use LLM to parse natural language process description with structured output.
+
+    Answers that validate are cached per model, temperature, prompt version and
+    description; use_cache=False asks the model again and refreshes the cached answer.
+    structured (default STRUCTURED_OUTPUT) requests schema-constrained output.
+    """
+    structured = STRUCTURED_OUTPUT if structured is None else structured
+    # Whitespace differences do not change the answer
+    normalized = " ".join(process_description.split())
+    key = _description_key(normalized, structured)
+
+    def call():
+        return (structured and _structured_process_description(normalized)) or _call_process_description(normalized)
+    return llm_cache.get_or_call(key, call, bypass=not use_cache, store_if=_is_valid_flowsheet)
+
+def stream_process_description(process_description, use_cache=True, structured=None):
+    """Streaming parse_process_description: yields the answer text as it is generated.
+
+    A cached answer is yielded in one piece; a streamed answer is cached once complete and valid.
+    Structured answers arrive whole, so they are yielded in one piece as well.
+    """
+    structured = STRUCTURED_OUTPUT if structured is None else structured
+    normalized = " ".join(process_description.split())
+    key = _description_key(normalized, structured)
+
+    def chunks():
+        result = structured and _structured_process_description(normalized)
+        if result:
+            yield result
+        else:
+            yield from _process_description_chain().stream({"process_desc": normalized})
+    try:
+        yield from llm_cache.stream_or_call(key, chunks, bypass=not use_cache, store_if=_is_valid_flowsheet)
+    except Exception as e:
+        raise Exception(f"LLM processing error: {str(e)}")
+
+def repair_process_description(process_description, response_text, errors, structured=None):
+    """Ask the LLM to fix only the listed problems in a flowsheet answer (one call, no regeneration).
+
+    A repaired answer that validates replaces the cached answer for the description.
+    """
     prompt = ChatPromptTemplate.from_messages([
-        ("system", """# Add this to the system prompt after the JSON structure example
-Process Analysis Guidelines:
-- If the user provides a detailed process description, use the provided information directly to create the JSON structure
-- If the user provides minimal information or only requests to generate a specific process type (e.g., "generate a distillation process"), then internally develop a detailed process understanding including:
-  1. Complete process steps and sequence
-  2. All major equipment required
-  3. Process conditions (temperature, pressure, flow rates)
-  4. Utility requirements
-  5. Safety and control systems
-  6. Environmental considerations
-  7. Process optimization opportunities
-  8. Show the source also from where initally its coming (may be like source drum also or any unit product)
-
-In both cases, return only the JSON structure to the user. The internal process development should only inform the JSON creation and not be shown to the user.
-
-For industry-level PFDs, ensure to include realistic equipment specifications, operating conditions, and safety features based on the process type.
-For industry-level PFDs, ensure to include:
-1. Multiple process units with proper interconnections
-2. Utility streams (steam, cooling water, etc.)
-3. Control and safety systems (PSV, control valves)
-4. Proper equipment sizing indicators
-5. All major process streams with compositions
-6. Heat and material balances where relevant
-7. Proper recycling and purge streams
-8. Energy integration opportunities
-9. Safety and environmental considerations
-10. Standard industrial equipment configurations
-
-
-
-If the user only requests to generate a specific process without detailed information, infer a complete industrial process based on typical configurations for that process type. Include realistic equipment specifications, operating conditions, and safety features that would be found in actual industrial plants.
-        {{
-            "equipment": [
-                {{"type": "pump", "id": "P-101", "spec": "Feed Pump"}},
-                {{"type": "heat_exchanger", "id": "E-201", "spec": "Feed Heater"}},
-                {{"type": "distillation_column", "id": "C-301", "spec": "Main Column"}}
-            ],
-            "streams": [
-                {{"id": "S1", "from": "T-101", "to": "P-101", "flow": 100, "comp": "Water"}}, 
-                {{"id": "S2", "from": "P-101", "to": "E-201", "flow": 100, "comp": "Water"}},
-                {{"id": "S3", "from": "E-201", "to": "C-301", "flow": 100, "comp": "Water"}},
-                {{"id": "S4", "from": "C-301", "to": "P-101", "flow": 15, "comp": "Recycle Stream"}}
-            ]
-        }}
-        
-        Guidelines for structured output:
-        1. Organize equipment in logical process order (feed → pre-treatment → main process → separation → product)
-        2. Keep recycling streams to minimum necessary (5-25% of main flow typically)
-        3. Use clear, sequential naming (T-101, P-101, E-201, C-301, etc.)
-        4. Limit to maximum 8-10 main equipment pieces for clean visualization
-        5. Group related equipment together when possible
-        6. Clearly identify recycling/recirculation loops
-        7. Use standard chemical engineering equipment types:
-           - Pumps: P-xxx
-           - Heat Exchangers: E-xxx  
-           - Columns: C-xxx
-           - Tanks: T-xxx
-           - Reactors: R-xxx
-           - Compressors: K-xxx
-           - Separators: S-xxx
-        Include temperature and pressure values for each equipment and stream based on typical operating conditions for that equipment type:
-        - Tanks: Ambient temperature (20-30°C), atmospheric pressure (1 bar)
-        - Pumps: Slight temperature rise (25-35°C), increased pressure (1-10 bar)
-        - Heat Exchangers: Inlet temperature to outlet temperature range, pressure drop of 0.1-0.5 bar
-        - Distillation Columns: Reboiler temperature (100-300°C), operating pressure (0.5-5 bar)
-        - Reactors: Reaction temperature and pressure based on reaction type
-        - Compressors: Temperature rise due to compression, high pressure (3-30 bar)
-         If specific values are mentioned in the process description, use those values. Otherwise, infer reasonable values based on the process and equipment type.        Pay special attention to identifying:
-        - Main process flow (primary direction)
-        - Recycle streams (feedback to earlier equipment)
-        - Product streams (final outputs)
-        - Utility connections (if mentioned)
-        
-        Ensure the structure will create a clean, readable flow diagram without excessive crossing lines."""),
-
-        ("human", "Process Description: {process_desc}")
+        ("system", """You fix flowsheet JSON for a process flow diagram. Return only the corrected JSON object with the same structure ({{"equipment": [...], "streams": [...]}}).
+Change only what is needed to fix the listed problems and keep everything else as it is:
+- every equipment and stream id must be unique
+- every stream's "from" and "to" must be the id of an equipment item (add the missing equipment if needed)
+- stream "flow" must be a number
+- temperature, pressure and flow values must be plain numbers in °C, bar and kg/hr; convert values given in other units"""),
+        ("human", "Problems:\n{errors}\n\nJSON to fix:\n{response}")
     ])
-    
-    chain = prompt | llm | StrOutputParser()
+    chain = (prompt | get_llm() | StrOutputParser()).with_config(callbacks=[usage_callback("flowsheet repair")])
+    try:
+        result = chain.invoke({"errors": "\n".join(f"- {error}" for error in errors), "response": response_text})
+    except Exception as e:
+        raise Exception(f"LLM processing error: {str(e)}")
+    try:
+        parse_flowsheet(result)
+    except FlowsheetError:
+        return result  # The caller reports the remaining problems
+    structured = STRUCTURED_OUTPUT if structured is None else structured
+    llm_cache.put(_description_key(" ".join(process_description.split()), structured), result)
+    return result
+
+def _call_process_description(process_description):
+    chain = _process_description_chain()
     
     try:
         result = chain.invoke({"process_desc": process_description})
@@ -104,20 +109,30 @@ If the user only requests to generate a specific process without detailed inform
     except Exception as e:
         raise Exception(f"LLM processing error: {str(e)}")
 
-def extract_json_from_response(response_text):
-    """Extract JSON from LLM response"""
+def _process_description_chain():
+    chain = process_description_prompt() | get_llm() | StrOutputParser()
+    return chain.with_config(callbacks=[usage_callback("flowsheet")])
+
+def _structured_process_description(process_description):
+    """Flowsheet JSON from a schema-constrained call, or None when the model cannot provide one"""
+    try:
+        structured_llm = get_llm().with_structured_output(FlowsheetModel)
+    except NotImplementedError:
+        return None  # Backend without tool/JSON-schema support
     try:
-        import json
-        # Find JSON in response
-        start = response_text.find('{')
-        end = response_text.rfind('}') + 1
-        if start != -1 and end != 0:
-            json_str = response_text[start:end]
-            return json.loads(json_str)
-    except:
-        # If JSON parsing fails, create a simple structure
-        return {
-            "equipment": [{"type": "tank", "id": "T-101", "spec": "Generic Tank"}],
-            "streams": [{"id": "S1", "from": "T-101", "to": "T-101", "flow": 100, "comp": "Generic Stream"}]
-        }
-    return None
+        chain = (process_description_prompt() | structured_llm).with_config(callbacks=[usage_callback("flowsheet")])
+        flowsheet = chain.invoke({"process_desc": process_description})
+    except Exception:
+        return None
+    if flowsheet is None:
+        return None
+    if isinstance(flowsheet, dict):
+        flowsheet = FlowsheetModel.model_validate(flowsheet)
+    return json.dumps(to_process_data(flowsheet), ensure_ascii=False)
+
+def extract_json_from_response(response_text):
+    """Extract and validate the flowsheet JSON in an LLM response (text or a FlowsheetStreamParser).
+
+    Raises FlowsheetError listing every problem instead of guessing a structure.
+    """
+    return parse_flowsheet(response_text)
@@ -1,31 +1,82 @@
 import streamlit as st
 from PIL import Image
-import base64
-from io import BytesIO
 import re
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-import os
+from llm_clients import get_llm_client
+from semantic_cache import semantic_cache, pfd_key_for_image, pfd_key_for_bytes
+from token_usage import usage_callback
+from vision_preprocess import VisionPayload, vision_payload
+from image_payloads import image_payloads
+from tiled_vision import needs_tiling, tile_inventory, inventory_text
+from pfd_fingerprint import fingerprint_store
 Image.MAX_IMAGE_PIXELS = 200000000
 
-def analyze_pfd_image(image, question):
-    """Analyze PFD image and answer questions about it"""
+def analyze_pfd_image(image, question, use_cache=True, pfd_key=None, similar=True, structure_text=None):
+    """Analyze PFD image and answer questions about it.
+
+    image is a PIL image or a VisionPayload. Images are preprocessed and encoded
+    once per pfd_key (e.g. a hash of the uploaded file, which also avoids hashing
+    the pixels) and the payload is reused by later questions. Answers are reused
+    for the same or (with similar) a reworded question about the same PFD;
+    use_cache=False always asks the model. structure_text, the flowsheet
+    description when it is already known (generated or transcribed PFDs), is
+    sent with the image instead of reading an oversized drawing in tiles.
+    """
+    pfd_key = pfd_key or _image_key(image)
+    return semantic_cache.get_or_ask(
+        pfd_key, question, lambda: _ask_pfd_image(image, question, pfd_key, structure_text),
+        bypass=not use_cache, similar=similar)
+
+def stream_pfd_image(image, question, use_cache=True, pfd_key=None, similar=True, structure_text=None):
+    """Streaming analyze_pfd_image: yields the answer in chunks as the model generates it"""
+    pfd_key = pfd_key or _image_key(image)
+    return answer_chunks(semantic_cache.stream_or_ask(
+        pfd_key, question,
+        lambda: _image_question_chain(image, question, pfd_key, structure_text).stream({}),
+        bypass=not use_cache, similar=similar))
+
+def _image_key(image):
+    return pfd_key_for_bytes(image.data) if isinstance(image, VisionPayload) else pfd_key_for_image(image)
+
+def answer_chunks(chunks):
+    """Pass answer chunks through, ending the answer with the error text if the model call fails"""
     try:
-        # Convert image to base64 for API
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            raise ValueError("Please set GOOGLE_API_KEY in environment variables")
-        
-        llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.1, api_key=api_key)
+        yield from chunks
+    except Exception as e:
+        yield f"Error analyzing PFD: {str(e)}"
+
+def _ask_pfd_image(image, question, pfd_key, structure_text=None):
+    try:
+        chain = _image_question_chain(image, question, pfd_key, structure_text)
+        result = chain.invoke({})
+        return result
         
-        # Create a prompt that combines image analysis with PFD knowledge
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an expert chemical process engineer. You can analyze Process Flow Diagrams (PFDs) and answer questions about them. When analyzing PFDs, consider:
+    except Exception as e:
+        return f"Error analyzing PFD: {str(e)}"
+
+def _image_question_chain(image, question, pfd_key, structure_text=None):
+    # Oversized scans of unknown structure also get the tags read from full-resolution
+    # tiles (once per PFD); a known structure makes that unnecessary
+    inventory = None
+    if structure_text is None and needs_tiling(image):
+        inventory = tile_inventory(image, pfd_key)
+    return _pfd_image_chain(image_payloads.get_or_encode(pfd_key, image), question, inventory, structure_text)
+
+def _pfd_image_chain(image, question, inventory=None, structure_text=None):
+    # Cropped, deskewed, palette-reduced and downscaled; pass a VisionPayload to skip this
+    payload = vision_payload(image)
+    question_text = f"Analyze this PFD image and answer the following question: {question}"
+    if structure_text:
+        question_text = f"Structure of the flowsheet shown in the image:\n{structure_text}\n\n{question_text}"
+    elif inventory:
+        question_text = f"{inventory_text(inventory)}\n\n{question_text}"
+    
+    llm = get_llm_client()
+    
+    # Create a prompt that combines image analysis with PFD knowledge
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """You are an expert chemical process engineer. You can analyze Process Flow Diagrams (PFDs) and answer questions about them. When analyzing PFDs, consider:
             1. Equipment identification and function
             2. Process flow direction
             3. Stream connections and relationships
@@ -35,18 +86,13 @@ def analyze_pfd_image(image, question):
             7. Common industrial practices
             
             Provide detailed, accurate, and helpful answers to questions about PFDs."""),
-            ("human", [
-                {"type": "text", "text": f"Analyze this PFD image and answer the following question: {question}"},
-                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_str}"}}
-            ])
+        ("human", [
+            {"type": "text", "text": question_text},
+            {"type": "image_url", "image_url": {"url": payload.data_url}}
         ])
-        
-        chain = prompt | llm | StrOutputParser()
-        result = chain.invoke({})
-        return result
-        
-    except Exception as e:
-        return f"Error analyzing PFD: {str(e)}"
+    ])
+    
+    return (prompt | llm | StrOutputParser()).with_config(callbacks=[usage_callback("image question")])
 
 def suggest_equipment_improvements(equipment_type, current_specs=None):
     """Provide suggestions for equipment improvements"""
@@ -166,6 +212,8 @@ def analyze_uploaded_pfd():
     if uploaded_file is not None:
         # Display the uploaded image
         image = Image.open(uploaded_file)
+        # Confirmed copies of earlier uploads start with their answers
+        pfd_key = fingerprint_store.resolve(pfd_key_for_bytes(uploaded_file.getvalue()), image)
         st.image(image, caption="Uploaded PFD", use_container_width=True)  # Updated parameter
         
         # Question input
@@ -186,11 +234,12 @@ def analyze_uploaded_pfd():
         with col3:
             if st.button("Optimization Tips"):
                 question = "How can this process be optimized for energy efficiency?"
+        fresh_answer = st.checkbox("Fresh answer (skip answers to similar questions)", value=False)
         
         if question:
             with st.spinner("Analyzing PFD and preparing answer..."):
                 try:
-                    answer = analyze_pfd_image(image, question)
+                    answer = analyze_pfd_image(image, question, use_cache=not fresh_answer, pfd_key=pfd_key)
                     st.success("Analysis Complete!")
                     st.write("### Answer:")
                     st.write(answer)
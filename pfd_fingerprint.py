@@ -0,0 +1,263 @@
+# Recognizes a PFD uploaded before, even as a re-saved, rescaled, padded or
+# recompressed copy. Everything is keyed on the upload's exact content hash; a perceptual match
+# is only a hint, and the earlier upload's work is reused once a pixel comparison
+# confirms both files show the same drawing.
+import base64
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+import cv2
+import numpy as np
+from PIL import Image
+from cache_utils import DiskCache
+from image_payloads import image_payloads
+from semantic_cache import semantic_cache
+from vision_preprocess import VisionPayload, flatten_image, analysis_thumbnail, VISION_MAX_SIDE
+
+FINGERPRINT_DIR = os.getenv("PFD_FINGERPRINT_DIR", os.path.join(tempfile.gettempdir(), "pfd_fingerprints"))
+FINGERPRINT_MAX_BYTES = int(os.getenv("PFD_FINGERPRINT_MAX_BYTES", str(512 * 1024 * 1024)))
+# Perceptual hashes differing in at most this many of their 63 bits are candidates for the same drawing
+MAX_HAMMING_DISTANCE = int(os.getenv("PFD_FINGERPRINT_DISTANCE", "6"))
+# A candidate is the same drawing only if, on the model's view of both (their vision
+# payloads), hardly any ink lies further than SAME_DRAWING_TOLERANCE pixels from the
+# other's ink. Re-saving and rescaling only move antialiased line edges, which leaves
+# 1-pixel-wide slivers; those are ignored. A retagged unit leaves a blob of about
+# 0.01% of the ink or more, so the remaining changed ink may be at most
+# MAX_CHANGED_INK_FRACTION.
+SAME_DRAWING_TOLERANCE = 1
+MAX_CHANGED_INK_FRACTION = float(os.getenv("PFD_FINGERPRINT_CHANGED_INK", "0.00005"))
+MAX_ASPECT_DIFFERENCE = 0.01
+MAX_FINGERPRINTS = 4096
+# Upload content hashes already resolved, so Streamlit reruns skip the perceptual hash
+RESOLVED_MEMO_SIZE = 256
+# Answers kept per PFD in the persistent record
+MAX_STORED_ANSWERS = 64
+FINGERPRINT_INDEX_FILE = "fingerprints.json"
+
+def perceptual_hash(image):
+    """63-bit DCT perceptual hash of the drawing (PIL image), cropped to its content.
+
+    Robust to rescaling, recompression and different margins; returns None for a blank image.
+    Small edits (a retagged unit) usually keep the hash, so a match is only a candidate.
+    """
+    thumb, mask, _ = analysis_thumbnail(flatten_image(image))
+    if mask is None:
+        return None
+    points = cv2.findNonZero(mask)
+    if points is None:
+        return None
+    x, y, width, height = cv2.boundingRect(points)
+    gray = np.asarray(thumb.convert("L"))[y:y + height, x:x + width]
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    # Low-frequency 8x8 block of the DCT, without the DC term, against its median
+    low = cv2.dct(small)[:8, :8].flatten()[1:]
+    bits = low > np.median(low)
+    return sum(1 << index for index, bit in enumerate(bits) if bit)
+
+def _payload_gray(payload):
+    """Grayscale array of a payload cropped to its ink, or None when it is blank"""
+    gray = np.asarray(Image.open(BytesIO(payload.data)).convert("L"))
+    points = cv2.findNonZero((gray < 128).astype(np.uint8))
+    if points is None:
+        return None
+    x, y, width, height = cv2.boundingRect(points)
+    return gray[y:y + height, x:x + width]
+
+def same_drawing(first, second, tolerance=SAME_DRAWING_TOLERANCE, max_fraction=MAX_CHANGED_INK_FRACTION):
+    """True when two VisionPayloads show the same drawing.
+
+    Both are cropped to their ink and scaled alike. Ink of either that lies
+    further than tolerance pixels from the other's ink counts as changed. Changed
+    ink that is only 1 pixel wide is shifted edges and is ignored. The rest may
+    be at most max_fraction of all ink.
+    """
+    first, second = _payload_gray(first), _payload_gray(second)
+    if first is None or second is None:
+        return False
+    aspect = first.shape[1] / first.shape[0]
+    if abs(second.shape[1] / second.shape[0] - aspect) > MAX_ASPECT_DIFFERENCE * aspect:
+        return False
+    second = cv2.resize(second, (first.shape[1], first.shape[0]), interpolation=cv2.INTER_AREA)
+    first, second = (first < 128).astype(np.uint8), (second < 128).astype(np.uint8)
+    kernel = np.ones((2 * tolerance + 1, 2 * tolerance + 1), np.uint8)
+    changed = (first & (1 - cv2.dilate(second, kernel))) | (second & (1 - cv2.dilate(first, kernel)))
+    changed = cv2.morphologyEx(changed, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
+    ink = np.count_nonzero(first) + np.count_nonzero(second)
+    return bool(np.count_nonzero(changed) <= max_fraction * ink)
+
+def _stored_payload(payload):
+    return VisionPayload(base64.b64decode(payload["data"]), payload["mime_type"], tuple(payload["size"]),
+                         tuple(payload["original_size"]), tuple(payload["crop_box"]), payload["angle"], 0.0)
+
+class FingerprintStore:
+    """Perceptual hashes of uploaded PFDs and, per upload, its stored answers and payload.
+
+    The hash index is one small JSON file; each upload's record is a DiskCache
+    entry, so every worker on the host shares them and they survive restarts.
+    """
+
+    def __init__(self, directory=FINGERPRINT_DIR, max_bytes=FINGERPRINT_MAX_BYTES,
+                 max_distance=MAX_HAMMING_DISTANCE, max_fingerprints=MAX_FINGERPRINTS):
+        self.records = DiskCache(os.path.join(directory, "records"), max_bytes=max_bytes, suffix=".json")
+        self.index_path = os.path.join(directory, FINGERPRINT_INDEX_FILE)
+        self.max_distance = max_distance
+        self.max_fingerprints = max_fingerprints
+        self._fingerprints = OrderedDict()  # key -> perceptual hash
+        self._index_mtime = None
+        self._resolved = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact = 0
+        self.near = 0
+        self.changed = 0
+        self.new = 0
+
+    def _reload_index(self):
+        # Another worker may have added drawings since we last read the index
+        try:
+            mtime = os.path.getmtime(self.index_path)
+        except OSError:
+            return
+        if mtime == self._index_mtime:
+            return
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        for key, fingerprint in entries:
+            self._fingerprints.setdefault(key, int(fingerprint, 16))
+        self._index_mtime = mtime
+
+    def _save_index(self):
+        while len(self._fingerprints) > self.max_fingerprints:
+            self._fingerprints.popitem(last=False)
+        entries = [[key, format(fingerprint, "016x")] for key, fingerprint in self._fingerprints.items()]
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.index_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.index_path)
+            self._index_mtime = os.path.getmtime(self.index_path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def resolve(self, content_key, image):
+        """Register an upload by its content key (returned unchanged) and warm the caches.
+
+        Answers and payload stored for the same content are loaded. A perceptually
+        similar earlier upload only lends its answers (and, through same_drawing_key,
+        its transcription) once same_drawing confirms it shows the same drawing; a
+        corrected drawing starts cold.
+        """
+        with self._lock:
+            if content_key in self._resolved:
+                self._resolved.move_to_end(content_key)
+                return content_key
+        fingerprint = perceptual_hash(image)
+        with self._lock:
+            self._reload_index()
+            known = content_key in self._fingerprints
+            candidate = None if known else self._nearest(fingerprint)
+            if not known and fingerprint is not None:
+                self._fingerprints[content_key] = fingerprint
+                self._save_index()
+        source = candidate if candidate is not None and self._confirm(candidate, content_key, image) else None
+        if source is not None:
+            self._adopt(content_key, source)
+        with self._lock:
+            if known:
+                self.exact += 1
+            elif source is not None:
+                self.near += 1
+            elif candidate is not None:
+                self.changed += 1
+            else:
+                self.new += 1
+            self._resolved[content_key] = None
+            while len(self._resolved) > RESOLVED_MEMO_SIZE:
+                self._resolved.popitem(last=False)
+        self._warm(content_key)
+        return content_key
+
+    def _confirm(self, candidate, content_key, image):
+        stored = self._load(candidate).get("payload")
+        if not stored or stored.get("max_side") != VISION_MAX_SIDE:
+            return False  # Nothing to compare against; treat as a different drawing
+        # The new upload's payload is needed for its first question anyway
+        return same_drawing(_stored_payload(stored), image_payloads.get_or_encode(content_key, image))
+
+    def _adopt(self, content_key, source):
+        answers = self._load(source)["answers"]
+
+        def change(record):
+            record["same_as"] = source
+            record["answers"] = (answers + record["answers"])[-MAX_STORED_ANSWERS:]
+        self._update(content_key, change)
+
+    def same_drawing_key(self, key):
+        """Key of an earlier upload confirmed to show the same drawing as key, or None"""
+        return self._load(key).get("same_as")
+
+    def _nearest(self, fingerprint):
+        if fingerprint is None:
+            return None
+        best, best_distance = None, self.max_distance + 1
+        for key, known in self._fingerprints.items():
+            distance = (fingerprint ^ known).bit_count()
+            if distance < best_distance:
+                best, best_distance = key, distance
+        return best
+
+    def _load(self, key):
+        entry = self.records.get(key)
+        if entry is None:
+            return {"answers": [], "payload": None}
+        try:
+            return json.loads(entry)
+        except ValueError:
+            return {"answers": [], "payload": None}
+
+    def _warm(self, key):
+        record = self._load(key)
+        if record["answers"] and not semantic_cache.has(key):
+            semantic_cache.warm(key, record["answers"])
+        payload = record.get("payload")
+        if payload and payload.get("max_side") == VISION_MAX_SIDE and image_payloads.get(key) is None:
+            image_payloads.put(key, _stored_payload(payload))
+
+    def _update(self, key, change):
+        with self._lock:
+            if key not in self._fingerprints:
+                return  # Not an uploaded drawing (e.g. a generated PFD)
+            record = self._load(key)
+            change(record)
+            self.records.put(key, json.dumps(record, ensure_ascii=False).encode("utf-8"))
+
+    def save_answer(self, key, question, answer):
+        def change(record):
+            answers = [pair for pair in record["answers"] if pair[0] != question]
+            record["answers"] = (answers + [[question, answer]])[-MAX_STORED_ANSWERS:]
+        self._update(key, change)
+
+    def save_payload(self, key, payload):
+        def change(record):
+            record["payload"] = {"data": base64.b64encode(payload.data).decode(), "mime_type": payload.mime_type,
+                                 "size": payload.size, "original_size": payload.original_size,
+                                 "crop_box": payload.crop_box, "angle": payload.angle, "max_side": VISION_MAX_SIDE}
+        self._update(key, change)
+
+    def stats(self):
+        with self._lock:
+            return {"drawings": len(self._fingerprints), "exact": self.exact, "near": self.near,
+                    "changed": self.changed, "new": self.new}
+
+# Process-wide store; answers and payloads of uploads are persisted as they are made
+fingerprint_store = FingerprintStore()
+semantic_cache.add_listener(fingerprint_store.save_answer)
+image_payloads.add_listener(fingerprint_store.save_payload)
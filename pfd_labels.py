@@ -0,0 +1,173 @@
+import html
+import threading
+from collections import OrderedDict, namedtuple
+from process_graph import get_flow_analysis
+
+# (parameter, alias field names in priority order, label template, max label length)
+# The length limit keeps graph labels from breaking; text views show every value.
+EQUIPMENT_PARAMS = [
+    ('temperature', ('temperature', 'temp', 'operating_temp', 'design_temp'), "T: {}°C", 12),
+    ('pressure', ('pressure', 'pres', 'operating_pres', 'design_pres'), "P: {} bar", 12),
+    ('flow', ('flow', 'flow_rate', 'capacity', 'design_flow'), "Flow: {} kg/hr", 15),
+    ('duty', ('duty', 'heat_duty', 'cooling_duty', 'power'), "Duty: {} kW", 15),
+    ('efficiency', ('efficiency', 'eff', 'design_eff'), "Eff: {}%", 12),
+    ('stages', ('stages', 'trays', 'number_of_trays'), "Stages: {}", 12),
+]
+STREAM_PARAMS = [
+    ('temperature', ('temperature', 'temp', 'stream_temp'), "T: {}°C", 12),
+    ('pressure', ('pressure', 'pres', 'stream_pres'), "P: {} bar", 12),
+    ('flow', ('flow', 'flow_rate', 'stream_flow'), "Flow: {} kg/hr", 15),
+    ('composition', ('comp', 'composition', 'stream_comp'), "Comp: {}", 20),
+]
+# Graph labels show at most this many parameters
+MAX_LABEL_PARAMS = 3
+TYPE_LABEL_CHARS = 15
+SPEC_LABEL_CHARS = 20
+COMP_LABEL_CHARS = 20
+
+EquipmentRecord = namedtuple('EquipmentRecord', ['id', 'type', 'spec'] + [name for name, _, _, _ in EQUIPMENT_PARAMS])
+StreamRecord = namedtuple('StreamRecord', ['id', 'source', 'target', 'units'] + [name for name, _, _, _ in STREAM_PARAMS])
+
+# Templates compiled once into bound format methods
+_EQUIPMENT_TEMPLATES = [(name, template.format, max_len) for name, _, template, max_len in EQUIPMENT_PARAMS]
+_STREAM_TEMPLATES = [(name, template.format, max_len) for name, _, template, max_len in STREAM_PARAMS]
+
+# Record key layout -> alias fields present for each parameter. LLM output
+# reuses a handful of layouts, so alias lookup runs once per layout, not per node;
+# the most recent layouts are kept (records with free-form keys add new ones)
+SCHEMA_CACHE_SIZE = 256
+_schema_cache = OrderedDict()
+_schema_lock = threading.Lock()
+
+def _resolve_schema(table, keys):
+    # table is one of the module-level parameter tables, so its id is stable
+    cache_key = (id(table), keys)
+    with _schema_lock:
+        schema = _schema_cache.get(cache_key)
+        if schema is not None:
+            _schema_cache.move_to_end(cache_key)
+            return schema
+    key_set = set(keys)
+    schema = tuple((name, tuple(field for field in aliases if field in key_set)) for name, aliases, _, _ in table)
+    with _schema_lock:
+        _schema_cache[cache_key] = schema
+        while len(_schema_cache) > SCHEMA_CACHE_SIZE:
+            _schema_cache.popitem(last=False)
+    return schema
+
+def _resolve_values(record, table):
+    values = []
+    for _, fields in _resolve_schema(table, tuple(record)):
+        # First alias holding a non-empty value wins
+        values.append(next((record[field] for field in fields if record[field]), None))
+    return values
+
+def equipment_record(equip):
+    """Normalize an equipment dict into an EquipmentRecord"""
+    return EquipmentRecord(equip['id'], equip.get('type', ''), equip.get('spec', '') or '',
+                           *_resolve_values(equip, EQUIPMENT_PARAMS))
+
+def stream_record(stream):
+    """Normalize a stream dict into a StreamRecord"""
+    return StreamRecord(stream['id'], stream['from'], stream['to'], stream.get('flow'),
+                        *_resolve_values(stream, STREAM_PARAMS))
+
+def _truncate(text, limit):
+    return text[:limit] + "..." if len(text) > limit else text
+
+def _params(record, templates, bounded, comp_chars):
+    params = []
+    for name, render, max_len in templates:
+        value = getattr(record, name)
+        if not value:
+            continue
+        if name == 'composition':
+            value = _truncate(str(value), comp_chars)
+        text = render(value)
+        # Graph labels drop values too long to fit instead of wrapping them
+        if bounded and len(text) > max_len:
+            continue
+        params.append(text)
+    return params
+
+def equipment_params(record, bounded=False):
+    """Formatted parameter strings of an equipment record"""
+    return _params(record, _EQUIPMENT_TEMPLATES, bounded, COMP_LABEL_CHARS)
+
+def stream_params(record, bounded=False, include_flow=True, comp_chars=COMP_LABEL_CHARS):
+    """Formatted parameter strings of a stream record"""
+    templates = _STREAM_TEMPLATES if include_flow else [t for t in _STREAM_TEMPLATES if t[0] != 'flow']
+    return _params(record, templates, bounded, comp_chars)
+
+def _type_label(record):
+    return _truncate(record.type.replace('_', ' ').title(), TYPE_LABEL_CHARS)
+
+def equipment_label(record, html_label=False):
+    """Graphviz node label for an equipment record, plain or HTML-like"""
+    params = equipment_params(record, bounded=True)[:MAX_LABEL_PARAMS]
+    spec = _truncate(record.spec, SPEC_LABEL_CHARS) if record.spec else ''
+    if not html_label:
+        parts = [record.id, _type_label(record)]
+        if spec:
+            parts.append(spec)
+        if params:
+            parts.append(" | ".join(params))
+        return "\\n".join(parts)
+    parts = [f"<B>{html.escape(record.id)}</B>", f"<I>{html.escape(_type_label(record))}</I>"]
+    if spec:
+        parts.append(f"<FONT POINT-SIZE='10'>{html.escape(spec)}</FONT>")
+    if params:
+        parts.append(f"<FONT POINT-SIZE='9'>{html.escape(' | '.join(params))}</FONT>")
+    return "<" + '<BR ALIGN="LEFT"/>'.join(parts) + ">"
+
+def stream_label(record, html_label=False):
+    """Graphviz edge label for a stream record, plain or HTML-like"""
+    params = stream_params(record, bounded=True)[:MAX_LABEL_PARAMS]
+    if not html_label:
+        return "\\n".join([record.id] + params)
+    parts = [f"<B>{html.escape(record.id)}</B>"] + [html.escape(param) for param in params]
+    return "<" + '<BR ALIGN="LEFT"/>'.join(parts) + ">"
+
+def describe_equipment(record):
+    """Description lines of an equipment record for text (chat) views"""
+    lines = [f"- {record.id}: {record.type} - {record.spec}"]
+    params = equipment_params(record)
+    if params:
+        lines.append(f"  Parameters: {', '.join(params)}")
+    return lines
+
+def describe_stream(record, recycle=False):
+    """Description lines of a stream record for text (chat) views"""
+    recycle_tag = " [RECYCLE]" if recycle else ""
+    # Transcribed drawings may show no flow for a stream
+    units = f" ({record.units} units)" if record.units is not None else ""
+    lines = [f"- {record.id}: {record.source} → {record.target}{units}{recycle_tag}"]
+    # Flow is already in the line above
+    params = stream_params(record, include_flow=False, comp_chars=30)
+    if params:
+        lines.append(f"  Parameters: {', '.join(params)}")
+    return lines
+
+def generate_text_description(process_data, key=None):
+    """Generate a text description of the PFD for efficient chat"""
+    flow_analysis = get_flow_analysis(process_data, key)
+    lines = ["Process Flow Diagram Description:", ""]
+
+    # Structure from the shared flow analysis
+    lines.append("Process Structure:")
+    lines.append(f"- Feed units: {', '.join(flow_analysis.start_equips) or 'none'}")
+    lines.append(f"- Product units: {', '.join(flow_analysis.end_equips) or 'none'}")
+    for loop in flow_analysis.recycle_loops:
+        lines.append(f"- Recycle loop: {', '.join(loop)}")
+    lines.append("")
+
+    lines.append("Equipment:")
+    for equip in process_data['equipment']:
+        lines.extend(describe_equipment(equipment_record(equip)))
+
+    lines.append("")
+    lines.append("Streams:")
+    for stream_index, stream in enumerate(process_data['streams']):
+        lines.extend(describe_stream(stream_record(stream), flow_analysis.is_recycle(stream_index)))
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,97 @@
+from render_pool import render_pool, render_graph
+from render_cache import render_cache
+
+# Resolution of the quick first-phase preview
+PREVIEW_DPI = 96
+
+# Output name -> (graphviz format, DPI override, mime type, file extension)
+EXPORT_FORMATS = {
+    'png': ('png', None, 'image/png', 'png'),
+    'svg': ('svg', None, 'image/svg+xml', 'svg'),
+    'pdf': ('pdf', None, 'application/pdf', 'pdf'),
+}
+
+def compute_layout(graph, owner=None):
+    """Run the graph's layout engine once and return the positioned DOT source"""
+    # -Tdot writes the input graph back with pos/bb/lp attributes filled in
+    return render_graph(graph, format='dot', owner=owner).decode('utf-8')
+
+def _layout_args(dpi=None):
+    # neato -n2 takes node and edge positions from the input instead of laying out again
+    args = ['-n2']
+    if dpi:
+        args.append(f'-Gdpi={dpi}')
+    return args
+
+def submit_layout_render(layout, format='png', dpi=None, owner=None):
+    """Queue a render of an already positioned layout and return its Future"""
+    return render_pool.submit(layout, format, engine='neato', args=_layout_args(dpi), owner=owner)
+
+def render_layout(layout, format='png', dpi=None, owner=None):
+    """Render an already positioned layout to bytes, optionally overriding its DPI"""
+    return render_pool.render(layout, format, engine='neato', args=_layout_args(dpi), owner=owner)
+
+class ProgressiveRender:
+    """Preview bytes available immediately plus a full-quality render still running.
+
+    Both phases are drawn from the same positioned layout, so dot only runs once.
+    """
+
+    def __init__(self, preview, future=None, layout=None):
+        self.preview = preview
+        self.future = future
+        self.layout = layout
+
+    @property
+    def done(self):
+        return self.future is None or self.future.done()
+
+    def result(self):
+        """Full-quality bytes, or None while the background render is still running"""
+        if self.future is None:
+            return self.preview
+        if not self.future.done():
+            return None
+        return self.future.result()
+
+def get_layout(process_data, graph_factory, owner=None, layout_fn=None, **settings):
+    """Positioned layout for process_data, running graph_factory() and dot only on a cache miss.
+
+    layout_fn, when given, replaces the single dot run (e.g. the sectioned
+    large-flowsheet layout) and must return positioned DOT source.
+    """
+    key = render_cache.make_key(process_data, kind='layout', **settings)
+
+    def compute():
+        layout = layout_fn() if layout_fn is not None else compute_layout(graph_factory(), owner=owner)
+        return layout.encode('utf-8')
+
+    return render_cache.get_or_render(key, compute).decode('utf-8')
+
+def export_cache_key(process_data, output='png', dpi=None, **settings):
+    """Cache key of one exported output of process_data"""
+    dpi = dpi or EXPORT_FORMATS[output][1]
+    return render_cache.make_key(process_data, kind='export', output=output, dpi=dpi, **settings)
+
+def export_from_layout(process_data, graph_factory, output='png', dpi=None, owner=None, layout_fn=None, **settings):
+    """Render process_data to one of EXPORT_FORMATS from its cached layout"""
+    format, default_dpi, _, _ = EXPORT_FORMATS[output]
+    dpi = dpi or default_dpi
+    key = export_cache_key(process_data, output, dpi, **settings)
+
+    def render():
+        layout = get_layout(process_data, graph_factory, owner=owner, layout_fn=layout_fn, **settings)
+        return render_layout(layout, format, dpi=dpi, owner=owner)
+
+    return render_cache.get_or_render(key, render)
+
+def start_progressive_render(layout, owner=None, preview_dpi=PREVIEW_DPI, on_complete=None):
+    """Render a low-DPI preview of a positioned layout now and the full DPI in the background"""
+    preview = render_layout(layout, 'png', dpi=preview_dpi, owner=owner)
+    future = submit_layout_render(layout, 'png', owner=owner)
+    if on_complete is not None:
+        def callback(done_future):
+            if not done_future.cancelled() and done_future.exception() is None:
+                on_complete(done_future.result())
+        future.add_done_callback(callback)
+    return ProgressiveRender(preview, future, layout)
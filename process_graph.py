@@ -0,0 +1,207 @@
+# Graph analysis of process_data flowsheets. Everything works on an adjacency
+# index built once from the stream list, so each pass is O(units + streams).
+import threading
+from collections import OrderedDict
+from cache_utils import canonical_hash
+
+def build_adjacency(process_data):
+    """Index the flowsheet as a directed graph.
+
+    Returns (nodes, out_streams, in_streams) where nodes lists every unit id in
+    equipment order (followed by units that only appear in streams) and
+    out_streams / in_streams map a unit id to the indices of its streams.
+    """
+    nodes = []
+    seen = set()
+    for equip in process_data['equipment']:
+        if equip['id'] not in seen:
+            seen.add(equip['id'])
+            nodes.append(equip['id'])
+    out_streams = {}
+    in_streams = {}
+    for index, stream in enumerate(process_data['streams']):
+        for unit in (stream['from'], stream['to']):
+            if unit not in seen:
+                seen.add(unit)
+                nodes.append(unit)
+        out_streams.setdefault(stream['from'], []).append(index)
+        in_streams.setdefault(stream['to'], []).append(index)
+    return nodes, out_streams, in_streams
+
+def strongly_connected_components(nodes, successors):
+    """Tarjan's algorithm (iterative, so deep flowsheets cannot hit the recursion limit).
+
+    successors maps a node to an iterable of neighbour nodes. Components are
+    returned in reverse topological order of the condensed graph.
+    """
+    index = {}
+    low = {}
+    on_stack = set()
+    stack = []
+    components = []
+    counter = 0
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(successors.get(root, ())))]
+        while work:
+            node, neighbours = work[-1]
+            descended = False
+            for neighbour in neighbours:
+                if neighbour not in index:
+                    index[neighbour] = low[neighbour] = counter
+                    counter += 1
+                    stack.append(neighbour)
+                    on_stack.add(neighbour)
+                    work.append((neighbour, iter(successors.get(neighbour, ()))))
+                    descended = True
+                    break
+                if neighbour in on_stack:
+                    low[node] = min(low[node], index[neighbour])
+            if descended:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+    return components
+
+def find_feedback_streams(process_data, nodes, out_streams, start_nodes):
+    """Pick the streams to draw as recycles: the back edges of a DFS from the feed units.
+
+    Removing the returned stream indices leaves the flowsheet acyclic, so every
+    recycle loop of any length has at least one of its streams marked.
+    """
+    streams = process_data['streams']
+    # 0 = unvisited, 1 = on the current DFS path, 2 = finished
+    state = {}
+    feedback = set()
+    start_set = set(start_nodes)
+    roots = list(start_nodes) + [node for node in nodes if node not in start_set]
+    for root in roots:
+        if state.get(root):
+            continue
+        state[root] = 1
+        work = [(root, iter(out_streams.get(root, ())))]
+        while work:
+            node, stream_indices = work[-1]
+            descended = False
+            for stream_index in stream_indices:
+                target = streams[stream_index]['to']
+                target_state = state.get(target, 0)
+                if target_state == 1:
+                    feedback.add(stream_index)
+                elif target_state == 0:
+                    state[target] = 1
+                    work.append((target, iter(out_streams.get(target, ()))))
+                    descended = True
+                    break
+            if not descended:
+                state[node] = 2
+                work.pop()
+    return feedback
+
+def topological_rank(nodes, successors, out_streams, streams, feedback):
+    """Longest-path rank of every unit once the feedback (recycle) streams are removed"""
+    in_degree = {node: 0 for node in nodes}
+    forward = {}
+    for node, indices in out_streams.items():
+        targets = [streams[i]['to'] for i in indices if i not in feedback]
+        forward[node] = targets
+        for target in targets:
+            in_degree[target] += 1
+    rank = {node: 0 for node in nodes}
+    ready = [node for node in nodes if in_degree[node] == 0]
+    # Kahn's algorithm; the graph is acyclic because feedback streams are removed
+    while ready:
+        node = ready.pop()
+        for target in forward.get(node, ()):
+            rank[target] = max(rank[target], rank[node] + 1)
+            in_degree[target] -= 1
+            if in_degree[target] == 0:
+                ready.append(target)
+    return rank
+
+class FlowAnalysis:
+    """Graph facts about one process_data, computed once and shared by renderers and views"""
+
+    def __init__(self, process_data):
+        streams = process_data['streams']
+        self.nodes, self.out_streams, self.in_streams = build_adjacency(process_data)
+        self.successors = {node: [streams[i]['to'] for i in indices] for node, indices in self.out_streams.items()}
+        self.predecessors = {node: [streams[i]['from'] for i in indices] for node, indices in self.in_streams.items()}
+        self.equipment_count = len(process_data['equipment'])
+        self.stream_count = len(streams)
+
+        self.incoming_counts = {node: len(indices) for node, indices in self.in_streams.items()}
+        self.outgoing_counts = {node: len(indices) for node, indices in self.out_streams.items()}
+        # Equipment with multiple incoming (mixing) or outgoing (splitting) streams
+        self.mixing_points = {node for node, count in self.incoming_counts.items() if count > 1}
+        self.splitting_points = {node for node, count in self.outgoing_counts.items() if count > 1}
+
+        # Feed units have no incoming streams, product units no outgoing ones
+        self.start_equips = [node for node in self.nodes if node in self.out_streams and node not in self.in_streams]
+        self.end_equips = [node for node in self.nodes if node in self.in_streams and node not in self.out_streams]
+        if not self.start_equips:
+            self.start_equips = [process_data['equipment'][0]['id']] if process_data['equipment'] else []
+
+        self.sccs = strongly_connected_components(self.nodes, self.successors)
+        self_loops = {stream['from'] for stream in streams if stream['from'] == stream['to']}
+        # A recycle loop is any component with more than one unit, or a unit feeding itself
+        self.recycle_loops = [component for component in self.sccs
+                              if len(component) > 1 or component[0] in self_loops]
+        self.recycle_streams = find_feedback_streams(process_data, self.nodes, self.out_streams, self.start_equips)
+        self.topo_rank = topological_rank(self.nodes, self.successors, self.out_streams, streams, self.recycle_streams)
+
+    def in_degree(self, node):
+        return self.incoming_counts.get(node, 0)
+
+    def out_degree(self, node):
+        return self.outgoing_counts.get(node, 0)
+
+    def is_recycle(self, stream_index):
+        return stream_index in self.recycle_streams
+
+# Analyses are small; keep the most recent ones so reruns and chat history reuse them
+FLOW_ANALYSIS_CACHE_SIZE = 64
+_flow_analysis_cache = OrderedDict()
+_flow_analysis_lock = threading.Lock()
+
+def process_hash(process_data):
+    """Canonical hash identifying a process_data dict"""
+    return canonical_hash(process_data)
+
+def get_flow_analysis(process_data, key=None):
+    """FlowAnalysis for process_data, computed once per process hash.
+
+    Pass key (a precomputed process_hash) to skip re-hashing on every rerun.
+    """
+    key = key or process_hash(process_data)
+    with _flow_analysis_lock:
+        analysis = _flow_analysis_cache.get(key)
+        if analysis is not None:
+            _flow_analysis_cache.move_to_end(key)
+            return analysis
+    analysis = FlowAnalysis(process_data)
+    with _flow_analysis_lock:
+        _flow_analysis_cache[key] = analysis
+        while len(_flow_analysis_cache) > FLOW_ANALYSIS_CACHE_SIZE:
+            _flow_analysis_cache.popitem(last=False)
+    return analysis
+
+def analyze_process_flow(process_data):
+    """Analyze process flow to identify recycling and optimize layout"""
+    return get_flow_analysis(process_data)
@@ -0,0 +1,143 @@
+import json
+import os
+from langchain_core.messages import SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
+from token_usage import count_tokens
+
+# Which system prompt parse_process_description sends: "compact" (default) or "full"
+PROMPT_VARIANT = os.getenv("PFD_PROMPT_VARIANT", "compact")
+
+# Sections of the flowsheet system prompt. Each instruction appears once; the
+# variants below pick the full or the condensed wording of every section.
+
+ROLE = ("You convert process descriptions into the JSON structure of an industrial "
+        "Process Flow Diagram (PFD). Return only the JSON structure to the user.")
+
+ANALYSIS_FULL = """Process Analysis Guidelines:
+- If the user provides a detailed process description, use the provided information directly to create the JSON structure
+- If the user provides minimal information or only requests to generate a specific process type (e.g., "generate a distillation process"), infer a complete industrial process based on typical configurations for that process type, internally developing:
+  1. Complete process steps and sequence
+  2. All major equipment required
+  3. Process conditions (temperature, pressure, flow rates)
+  4. Utility requirements
+  5. Safety and control systems
+  6. Environmental considerations
+  7. Process optimization opportunities
+  8. The source the feed initially comes from (e.g. a source drum or an upstream unit's product)
+The internal process development should only inform the JSON creation and not be shown to the user."""
+
+ANALYSIS_COMPACT = """Use the details given in the description. If it only names a process type, infer a typical complete industrial process (steps, major equipment, conditions, utilities, safety and control, feed source) without explaining it."""
+
+INDUSTRY_FULL = """For industry-level PFDs, include realistic equipment specifications, operating conditions and safety features found in actual industrial plants:
+1. Multiple process units with proper interconnections
+2. Utility streams (steam, cooling water, etc.)
+3. Control and safety systems (PSV, control valves)
+4. Proper equipment sizing indicators
+5. All major process streams with compositions
+6. Heat and material balances where relevant
+7. Proper recycling and purge streams
+8. Energy integration opportunities
+9. Safety and environmental considerations
+10. Standard industrial equipment configurations"""
+
+INDUSTRY_COMPACT = """Be industry-realistic: interconnected units, utility streams, PSVs and control valves, sizing indicators, stream compositions, recycle and purge streams."""
+
+EXAMPLE = {
+    "equipment": [
+        {"type": "tank", "id": "T-101", "spec": "Feed Tank"},
+        {"type": "pump", "id": "P-101", "spec": "Feed Pump"},
+        {"type": "heat_exchanger", "id": "E-201", "spec": "Feed Heater"},
+        {"type": "distillation_column", "id": "C-301", "spec": "Main Column"},
+    ],
+    "streams": [
+        {"id": "S1", "from": "T-101", "to": "P-101", "flow": 100, "comp": "Water"},
+        {"id": "S2", "from": "P-101", "to": "E-201", "flow": 100, "comp": "Water"},
+        {"id": "S3", "from": "E-201", "to": "C-301", "flow": 100, "comp": "Water"},
+        {"id": "S4", "from": "C-301", "to": "P-101", "flow": 15, "comp": "Recycle Stream"},
+    ],
+}
+
+def _example_json(indent):
+    if indent is None:
+        return json.dumps(EXAMPLE, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(EXAMPLE, ensure_ascii=False, indent=indent)
+
+STRUCTURE_FULL = """Guidelines for structured output:
+1. Organize equipment in logical process order (feed → pre-treatment → main process → separation → product)
+2. Keep recycling streams to minimum necessary (5-25% of main flow typically)
+3. Use clear, sequential naming (T-101, P-101, E-201, C-301, etc.)
+4. Limit to maximum 8-10 main equipment pieces for clean visualization
+5. Group related equipment together when possible
+6. Clearly identify recycling/recirculation loops
+7. Use standard chemical engineering equipment types:
+   - Pumps: P-xxx
+   - Heat Exchangers: E-xxx
+   - Columns: C-xxx
+   - Tanks: T-xxx
+   - Reactors: R-xxx
+   - Compressors: K-xxx
+   - Separators: S-xxx"""
+
+STRUCTURE_COMPACT = """Order equipment feed → pre-treatment → main process → separation → product; at most 8-10 main units. Tags: P-xxx pumps, E-xxx heat exchangers, C-xxx columns, T-xxx tanks, R-xxx reactors, K-xxx compressors, S-xxx separators. Keep recycles minimal (typically 5-25% of main flow)."""
+
+CONDITIONS_FULL = """Include temperature and pressure values for each equipment and stream based on typical operating conditions for that equipment type:
+- Tanks: Ambient temperature (20-30°C), atmospheric pressure (1 bar)
+- Pumps: Slight temperature rise (25-35°C), increased pressure (1-10 bar)
+- Heat Exchangers: Inlet temperature to outlet temperature range, pressure drop of 0.1-0.5 bar
+- Distillation Columns: Reboiler temperature (100-300°C), operating pressure (0.5-5 bar)
+- Reactors: Reaction temperature and pressure based on reaction type
+- Compressors: Temperature rise due to compression, high pressure (3-30 bar)
+If specific values are mentioned in the process description, use those values. Otherwise, infer reasonable values based on the process and equipment type."""
+
+CONDITIONS_COMPACT = """Give every equipment item and stream a temperature (°C) and pressure (bar): the values in the description, else typical ones (tanks ~25°C/1 bar, pumps 1-10 bar, columns 100-300°C/0.5-5 bar, compressors 3-30 bar)."""
+
+LAYOUT_FULL = """Pay special attention to identifying:
+- Main process flow (primary direction)
+- Recycle streams (feedback to earlier equipment)
+- Product streams (final outputs)
+- Utility connections (if mentioned)
+
+Ensure the structure will create a clean, readable flow diagram without excessive crossing lines."""
+
+LAYOUT_COMPACT = """Make the main flow, recycle, product and utility streams clear, for a readable diagram with few crossing lines."""
+
+# variant -> (version, sections). Bump a variant's version whenever its text
+# changes; the version is part of the LLM cache key.
+PROMPT_VARIANTS = {
+    "full": (1, (ANALYSIS_FULL, INDUSTRY_FULL, "JSON structure example:\n" + _example_json(2),
+                 STRUCTURE_FULL, CONDITIONS_FULL, LAYOUT_FULL)),
+    "compact": (1, (ROLE, ANALYSIS_COMPACT, INDUSTRY_COMPACT, "Format: " + _example_json(None),
+                    STRUCTURE_COMPACT, CONDITIONS_COMPACT, LAYOUT_COMPACT)),
+}
+
+HUMAN_TEMPLATE = "Process Description: {process_desc}"
+
+_prompts = {}
+
+def _variant(variant):
+    variant = variant or PROMPT_VARIANT
+    if variant not in PROMPT_VARIANTS:
+        raise ValueError(f"Unknown prompt variant '{variant}' (available: {', '.join(PROMPT_VARIANTS)})")
+    return variant
+
+def system_prompt(variant=None):
+    """System prompt text of a variant, assembled once per process"""
+    variant = _variant(variant)
+    if variant not in _prompts:
+        _prompts[variant] = "\n\n".join(PROMPT_VARIANTS[variant][1])
+    return _prompts[variant]
+
+def prompt_version(variant=None):
+    """Cache-key version of a variant, e.g. "compact-1" """
+    variant = _variant(variant)
+    return f"{variant}-{PROMPT_VARIANTS[variant][0]}"
+
+def prompt_tokens(variant=None):
+    """Estimated tokens of a variant's system prompt"""
+    return count_tokens(system_prompt(variant))
+
+def process_description_prompt(variant=None):
+    """Chat prompt for flowsheet generation with the variant's system prompt"""
+    # A SystemMessage is not a template, so the JSON braces need no escaping
+    return ChatPromptTemplate.from_messages([SystemMessage(content=system_prompt(variant)),
+                                             ("human", HUMAN_TEMPLATE)])
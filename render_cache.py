@@ -0,0 +1,71 @@
+import os
+import tempfile
+import threading
+from cache_utils import canonical_hash, LRUCache, DiskCache
+
+# Shared on-disk location so every Streamlit worker on the host reuses renders
+RENDER_CACHE_DIR = os.getenv("PFD_RENDER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pfd_render_cache"))
+RENDER_CACHE_MAX_BYTES = int(os.getenv("PFD_RENDER_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+MEMORY_CACHE_MAX_ITEMS = 32
+MEMORY_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+class RenderCache:
+    """Two-tier (memory LRU + shared disk) cache for rendered PFD bytes"""
+
+    def __init__(self, directory=RENDER_CACHE_DIR, max_disk_bytes=RENDER_CACHE_MAX_BYTES,
+                 max_memory_items=MEMORY_CACHE_MAX_ITEMS, max_memory_bytes=MEMORY_CACHE_MAX_BYTES):
+        self.memory = LRUCache(max_items=max_memory_items, max_bytes=max_memory_bytes)
+        self.disk = DiskCache(directory, max_bytes=max_disk_bytes)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(process_data, **render_settings):
+        """Build the cache key from the process data and every setting that affects the output"""
+        return canonical_hash(process_data, **render_settings)
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None:
+            value = self.disk.get(key)
+            if value is not None:
+                # Promote disk hits so the next lookup stays in memory
+                self.memory.put(key, value)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+        self.disk.put(key, value)
+
+    def get_or_render(self, key, render_fn):
+        """Return cached bytes for key, calling render_fn() and storing its result on a miss"""
+        value = self.get(key)
+        if value is None:
+            value = render_fn()
+            if value:
+                self.put(key, value)
+        return value
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory": self.memory.stats(),
+                "disk": self.disk.stats(),
+            }
+
+# Process-wide cache used by the generators
+render_cache = RenderCache()
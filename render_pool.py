@@ -0,0 +1,156 @@
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+# Concurrent dot processes allowed per server process
+RENDER_WORKERS = int(os.getenv("PFD_RENDER_WORKERS", "2"))
+# Jobs allowed to wait for a worker before new submissions are rejected
+RENDER_QUEUE_DEPTH = int(os.getenv("PFD_RENDER_QUEUE_DEPTH", "8"))
+# Seconds a single dot invocation may run before it is killed
+RENDER_TIMEOUT = float(os.getenv("PFD_RENDER_TIMEOUT", "60"))
+
+# Cheaper layout used when the full layout times out: ortho splines and edge
+# concentration are what make dot super-linear on large flowsheets
+FALLBACK_LAYOUT_ATTRS = {
+    'splines': 'polyline',
+    'concentrate': 'false',
+    'pack': 'false',
+}
+
+class RenderError(Exception):
+    """Graphviz failed to render a diagram"""
+
+class RenderTimeout(RenderError):
+    """A render job exceeded its time limit and was killed"""
+
+class RenderQueueFull(RenderError):
+    """Too many render jobs are already waiting"""
+
+class RenderCancelled(RenderError):
+    """A render job was cancelled by its owner"""
+
+class _RenderJob:
+    def __init__(self, source, format, engine, args, timeout, owner):
+        self.source = source
+        self.format = format
+        self.engine = engine
+        self.args = list(args)
+        self.timeout = timeout
+        self.owner = owner
+        self.cancelled = False
+        self.proc = None
+        self.future = None
+
+class RenderPool:
+    """Bounded pool that runs Graphviz in child processes off the Streamlit script thread.
+
+    Each job is a separate dot process, so a hung layout can be killed on
+    timeout or when its owner (a user session) cancels, without affecting
+    other sessions sharing the server.
+    """
+
+    def __init__(self, max_workers=RENDER_WORKERS, max_queue=RENDER_QUEUE_DEPTH, timeout=RENDER_TIMEOUT):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pfd-render")
+        self._jobs = set()
+        self._lock = threading.Lock()
+
+    def submit(self, source, format='png', engine='dot', args=(), timeout=None, owner=None):
+        """Queue a render of DOT source and return a Future resolving to the output bytes"""
+        job = _RenderJob(source, format, engine, args, timeout or self.timeout, owner)
+        with self._lock:
+            if len(self._jobs) >= self.max_workers + self.max_queue:
+                raise RenderQueueFull("The render server is busy, please try again in a moment")
+            self._jobs.add(job)
+        job.future = self._executor.submit(self._run, job)
+        job.future.add_done_callback(lambda _: self._discard(job))
+        return job.future
+
+    def render(self, source, format='png', engine='dot', args=(), timeout=None, owner=None):
+        """Submit a render and wait for its bytes"""
+        try:
+            return self.submit(source, format, engine, args, timeout, owner).result()
+        except CancelledError:
+            raise RenderCancelled("Render cancelled")
+
+    def _discard(self, job):
+        with self._lock:
+            self._jobs.discard(job)
+
+    def _run(self, job):
+        if job.cancelled:
+            raise RenderCancelled("Render cancelled")
+        data = job.source.encode('utf-8') if isinstance(job.source, str) else job.source
+        try:
+            job.proc = subprocess.Popen(
+                [job.engine, f'-T{job.format}', *job.args],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+        except FileNotFoundError:
+            raise RenderError(f"Graphviz executable '{job.engine}' not found, is Graphviz installed?")
+        # A cancel may have arrived while the process was starting
+        if job.cancelled:
+            job.proc.kill()
+        try:
+            out, err = job.proc.communicate(input=data, timeout=job.timeout)
+        except subprocess.TimeoutExpired:
+            job.proc.kill()
+            job.proc.communicate()
+            raise RenderTimeout(f"Graphviz render timed out after {job.timeout:.0f}s")
+        if job.cancelled:
+            raise RenderCancelled("Render cancelled")
+        if job.proc.returncode != 0:
+            raise RenderError(f"Graphviz failed: {err.decode('utf-8', 'replace').strip()}")
+        return out
+
+    def cancel(self, owner):
+        """Cancel every queued or running job submitted by owner.
+
+        Reaches background jobs (submit). A script thread blocked in render()
+        makes no Streamlit calls, so a Reset click is only handled after that
+        render returns or times out; by then only its background jobs remain.
+        """
+        with self._lock:
+            jobs = [job for job in self._jobs if job.owner == owner]
+        return self._cancel_jobs(jobs)
+
+    def cancel_futures(self, futures):
+        """Cancel the queued or running jobs behind futures returned by submit"""
+        futures = set(futures)
+        with self._lock:
+            jobs = [job for job in self._jobs if job.future in futures]
+        return self._cancel_jobs(jobs)
+
+    def _cancel_jobs(self, jobs):
+        for job in jobs:
+            job.cancelled = True
+            if job.future is not None:
+                job.future.cancel()
+            if job.proc is not None and job.proc.poll() is None:
+                job.proc.kill()
+        return len(jobs)
+
+    def pending(self):
+        """Number of jobs queued or running"""
+        with self._lock:
+            return len(self._jobs)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+# Process-wide pool shared by all sessions
+render_pool = RenderPool()
+
+def render_graph(graph, format='png', owner=None, timeout=None, fallback=True):
+    """Render a graphviz graph through the pool, retrying with a cheaper layout on timeout"""
+    try:
+        return render_pool.render(graph.source, format, engine=graph.engine, timeout=timeout, owner=owner)
+    except RenderTimeout:
+        if not fallback:
+            raise
+        cheap_graph = graph.copy()
+        cheap_graph.attr(**FALLBACK_LAYOUT_ATTRS)
+        return render_pool.render(cheap_graph.source, format, engine=graph.engine, timeout=timeout, owner=owner)
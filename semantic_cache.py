@@ -0,0 +1,232 @@
+import hashlib
+import math
+import re
+import threading
+from collections import OrderedDict
+from sklearn.feature_extraction.text import TfidfVectorizer, ENGLISH_STOP_WORDS
+
+# Cosine similarity above which a reworded question reuses the stored answer
+SIMILARITY_THRESHOLD = 0.8
+# Bounds: remembered questions per PFD, and PFDs with remembered questions
+MAX_QUESTIONS_PER_PFD = 64
+MAX_PFDS = 32
+# The analyze_* helpers report failures as answer text; never reuse those
+ERROR_PREFIXES = ("Error analyzing PFD", "Error:")
+# Equipment and stream tags (P-101, S12, E-201A); questions about different units never match
+TAG_RE = re.compile(r'\b[a-z]{1,3}-?\d{1,4}[a-z]?\b')
+# scikit-learn's English stop words include words that change what is asked
+# ("why ... not work" is not "how ... work"); those are kept as terms
+KEPT_STOP_WORDS = frozenset({
+    'not', 'no', 'nor', 'never', 'none', 'nothing', 'nobody', 'neither', 'cannot', 'without',
+    'what', 'which', 'why', 'how', 'where', 'when', 'who', 'whom', 'whose', 'whether',
+    'more', 'less', 'most', 'least', 'above', 'below', 'before', 'after', 'up', 'down', 'first', 'last',
+})
+STOP_WORDS = sorted(ENGLISH_STOP_WORDS - KEPT_STOP_WORDS)
+NEGATION_RE = re.compile(r'\b(?:not|no|nor|never|none|nothing|nobody|neither|cannot|without)\b')
+QUESTION_WORD_RE = re.compile(r'\b(?:what|which|why|how|where|when|who|whom|whose|whether)\b')
+CONTRACTION_RE = re.compile(r"n['’]t\b")
+
+def pfd_key_for_text(pfd_text):
+    """Cache key of a PFD known by its text description"""
+    return hashlib.sha256(pfd_text.encode("utf-8")).hexdigest()
+
+def pfd_key_for_bytes(data):
+    """Cache key of an uploaded PFD file, from its content"""
+    return hashlib.sha256(data).hexdigest()
+
+def pfd_key_for_image(image):
+    """Cache key of a PFD known only as an image (PIL), from its pixels"""
+    digest = hashlib.sha256(f"{image.mode}{image.size}".encode("utf-8"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+def _normalize(question):
+    # "doesn't" -> "does not", so the negation survives tokenization
+    return " ".join(CONTRACTION_RE.sub(" not", question.lower()).split())
+
+def _guard(normalized):
+    """What a reworded question must share with a cached one to reuse its answer:
+    the same unit tags, negation and question words"""
+    return (frozenset(TAG_RE.findall(normalized)), bool(NEGATION_RE.search(normalized)),
+            frozenset(QUESTION_WORD_RE.findall(normalized)))
+
+class _QuestionIndex:
+    """TF-IDF vectors of the questions answered for one PFD"""
+
+    def __init__(self):
+        self.entries = OrderedDict()  # normalized question -> (guard, answer)
+        self.analyzer = None
+        self.idf = {}
+        self.vectors = []  # (question, {term: weight}) with L2-normalized weights
+
+    def refit(self):
+        # Refit with scikit-learn on store (after a multi-second LLM call). Lookups then
+        # weight one question from the fitted vocabulary in plain Python, which avoids
+        # sklearn's per-call overhead and keeps them well under a millisecond.
+        questions = list(self.entries)
+        vectorizer = TfidfVectorizer(stop_words=STOP_WORDS, ngram_range=(1, 2), sublinear_tf=True)
+        try:
+            matrix = vectorizer.fit_transform(questions)
+        except ValueError:
+            # Only stop words in every question; nothing to compare on
+            self.analyzer, self.idf, self.vectors = None, {}, []
+            return
+        terms = vectorizer.get_feature_names_out()
+        self.analyzer = vectorizer.build_analyzer()
+        self.idf = dict(zip(terms, vectorizer.idf_))
+        self.vectors = []
+        for question, row in zip(questions, matrix):
+            self.vectors.append((question, {terms[i]: weight for i, weight in zip(row.indices, row.data)}))
+
+    def _vector(self, question):
+        counts = {}
+        for term in self.analyzer(question):
+            if term in self.idf:
+                counts[term] = counts.get(term, 0) + 1
+        vector = {term: (1.0 + math.log(count)) * self.idf[term] for term, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        return {term: weight / norm for term, weight in vector.items()} if norm else {}
+
+    def best_match(self, question):
+        if self.analyzer is None:
+            return None, 0.0
+        vector = self._vector(question)
+        best, best_score = None, 0.0
+        for candidate, weights in self.vectors:
+            # Both vectors are L2-normalized, so the dot product is the cosine similarity
+            score = sum(weight * weights.get(term, 0.0) for term, weight in vector.items())
+            if score > best_score:
+                best, best_score = candidate, score
+        return best, best_score
+
+class SemanticCache:
+    """Per-PFD cache of chat answers that also matches reworded questions"""
+
+    def __init__(self, threshold=SIMILARITY_THRESHOLD, max_questions=MAX_QUESTIONS_PER_PFD, max_pfds=MAX_PFDS):
+        self.threshold = threshold
+        self.max_questions = max_questions
+        self.max_pfds = max_pfds
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+        self._listeners = []
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def lookup(self, pfd_key, question, similar=True):
+        """Cached answer for question (or, with similar, a close rewording of it), or None"""
+        normalized = _normalize(question)
+        with self._lock:
+            index = self._indexes.get(pfd_key)
+            answer = None
+            if index is not None:
+                self._indexes.move_to_end(pfd_key)
+                match = normalized if normalized in index.entries else None
+                if match is None and similar:
+                    candidate, score = index.best_match(normalized)
+                    if candidate is not None and score >= self.threshold:
+                        match = candidate
+                # Same wording but different units (P-101 vs P-102) or a negation is a different question
+                if match is not None and index.entries[match][0] == _guard(normalized):
+                    index.entries.move_to_end(match)
+                    answer = index.entries[match][1]
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return answer
+
+    def store(self, pfd_key, question, answer):
+        if not answer or answer.startswith(ERROR_PREFIXES):
+            return
+        self._insert(pfd_key, [(question, answer)])
+        for listener in self._listeners:
+            listener(pfd_key, question, answer)
+
+    def warm(self, pfd_key, answers):
+        """Load previously stored (question, answer) pairs for a PFD, e.g. from a persistent store"""
+        answers = [(question, answer) for question, answer in answers
+                   if answer and not answer.startswith(ERROR_PREFIXES)]
+        if answers:
+            self._insert(pfd_key, answers)
+
+    def has(self, pfd_key):
+        with self._lock:
+            return pfd_key in self._indexes
+
+    def add_listener(self, listener):
+        """Call listener(pfd_key, question, answer) for every answer stored from now on"""
+        self._listeners.append(listener)
+
+    def _insert(self, pfd_key, answers):
+        with self._lock:
+            index = self._indexes.get(pfd_key)
+            if index is None:
+                index = self._indexes[pfd_key] = _QuestionIndex()
+                while len(self._indexes) > self.max_pfds:
+                    self._indexes.popitem(last=False)
+            self._indexes.move_to_end(pfd_key)
+            for question, answer in answers:
+                normalized = _normalize(question)
+                index.entries[normalized] = (_guard(normalized), answer)
+                index.entries.move_to_end(normalized)
+            while len(index.entries) > self.max_questions:
+                index.entries.popitem(last=False)
+            index.refit()
+
+    def get_or_ask(self, pfd_key, question, ask_fn, bypass=False, similar=True):
+        """Answer from the cache when a close enough question was asked about this PFD, else ask_fn().
+
+        similar=False reuses only answers to the exact same question, for questions
+        that embed text whose details matter (e.g. a process description to verify).
+        """
+        if bypass:
+            with self._lock:
+                self.bypassed += 1
+        else:
+            answer = self.lookup(pfd_key, question, similar)
+            if answer is not None:
+                return answer
+        answer = ask_fn()
+        self.store(pfd_key, question, answer)
+        return answer
+
+    def stream_or_ask(self, pfd_key, question, stream_fn, bypass=False, similar=True):
+        """Like get_or_ask, for streamed answers: yields the cached answer in one piece
+        or the chunks of stream_fn(). The answer is stored only if the stream completes.
+        """
+        if not bypass:
+            answer = self.lookup(pfd_key, question, similar)
+            if answer is not None:
+                yield answer
+                return
+        else:
+            with self._lock:
+                self.bypassed += 1
+        chunks = []
+        for chunk in stream_fn():
+            chunks.append(chunk)
+            yield chunk
+        self.store(pfd_key, question, "".join(chunks))
+
+    def clear(self, pfd_key=None):
+        with self._lock:
+            if pfd_key is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(pfd_key, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "pfds": len(self._indexes),
+                "questions": sum(len(index.entries) for index in self._indexes.values()),
+            }
+
+# Process-wide cache shared by the chat pages
+semantic_cache = SemanticCache()
@@ -0,0 +1,175 @@
+# Tiled analysis of oversized PFD scans: a downscaled A0 drawing loses its tags,
+# so full-resolution tiles are read in parallel and their findings merged into
+# one inventory that accompanies the overview image in the final question.
+import asyncio
+import concurrent.futures
+import json
+import math
+import os
+import re
+import numpy as np
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from flowsheet_json import extract_flowsheet_json, FlowsheetError
+from llm_cache import llm_cache
+from llm_clients import get_llm_client, LLM_MODEL, LLM_TEMPERATURE, LLM_BACKEND
+from token_usage import usage_callback
+from vision_preprocess import flatten_image, analysis_thumbnail, preprocess_pfd_image, VISION_MAX_SIDE
+
+# Images whose longest side exceeds this are analyzed in tiles ("0" disables tiling)
+TILED_VISION = os.getenv("PFD_TILED_VISION", "1") == "1"
+TILING_MIN_SIDE = int(os.getenv("PFD_TILING_MIN_SIDE", str(2 * VISION_MAX_SIDE)))
+# Tile side in source pixels, overlap between neighbors, and the most tiles per image
+TILE_SIZE = 2048
+TILE_OVERLAP = 0.15
+MAX_TILES = 16
+# Tile requests in flight at once
+TILE_CONCURRENCY = int(os.getenv("PFD_TILE_CONCURRENCY", "4"))
+# Tiles with less drawing than this share of their thumbnail pixels are blank paper
+MIN_TILE_INK = 0.002
+# Bump when the tile prompt changes so cached inventories are not reused
+TILE_PROMPT_VERSION = 2
+TAG_SEPARATOR_RE = re.compile(r'[\s_–—-]+')
+
+def needs_tiling(image):
+    """True for PIL images too large to send as a single downscaled payload"""
+    return TILED_VISION and hasattr(image, 'size') and max(image.size) > TILING_MIN_SIDE
+
+def tile_boxes(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, max_tiles=MAX_TILES):
+    """Overlapping (left, top, right, bottom) tiles covering a width x height area.
+
+    Tiles grow beyond tile_size when needed to stay within max_tiles.
+    """
+    def grid(size):
+        step = size * (1 - overlap)
+        return (max(1, math.ceil((width - size) / step) + 1), max(1, math.ceil((height - size) / step) + 1))
+    columns, rows = grid(tile_size)
+    while columns * rows > max_tiles:
+        tile_size = int(tile_size * 1.25)
+        columns, rows = grid(tile_size)
+    tile_width, tile_height = min(tile_size, width), min(tile_size, height)
+    boxes = []
+    for row in range(rows):
+        top = round((height - tile_height) * row / (rows - 1)) if rows > 1 else 0
+        for column in range(columns):
+            left = round((width - tile_width) * column / (columns - 1)) if columns > 1 else 0
+            boxes.append((left, top, left + tile_width, top + tile_height))
+    return boxes
+
+def image_tiles(image):
+    """Overlapping full-resolution tiles (PIL images) of the drawing, blank ones left out"""
+    flat = flatten_image(image)
+    _, mask, scale = analysis_thumbnail(flat)
+    if mask is None:
+        return []
+    tiles = []
+    for left, top, right, bottom in tile_boxes(*flat.size):
+        # Ink check on the thumbnail's view of the tile; no full-resolution array is needed
+        view = mask[int(top / scale):math.ceil(bottom / scale), int(left / scale):math.ceil(right / scale)]
+        if view.size and np.count_nonzero(view) >= MIN_TILE_INK * view.size:
+            tiles.append(flat.crop((left, top, right, bottom)))
+    return tiles
+
+def _tile_chain(payload):
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """You read one section of a large Process Flow Diagram. List every equipment item and every stream or line that is labeled in this section. Return only JSON: {{"equipment": [{{"id": "P-101", "type": "pump", "spec": "Feed Pump"}}], "streams": [{{"id": "101", "from": "P-101", "to": "E-101", "label": "Feed"}}]}}. A stream's "id" is the stream number printed on the drawing, never one you make up. Use "" for anything not readable in this section; do not guess tags that are cut off at the edge."""),
+        ("human", [{"type": "image_url", "image_url": {"url": payload.data_url}}])
+    ])
+    llm = get_llm_client()
+    return (prompt | llm | StrOutputParser()).with_config(callbacks=[usage_callback("tile extraction")])
+
+def _tile_findings(text):
+    try:
+        data = extract_flowsheet_json(text)
+    except FlowsheetError:
+        return {"equipment": [], "streams": []}
+    if not isinstance(data, dict):
+        return {"equipment": [], "streams": []}
+    return {key: [item for item in data.get(key) or [] if isinstance(item, dict)] for key in ("equipment", "streams")}
+
+async def _extract_tiles(tiles, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def extract(tile):
+        async with semaphore:
+            # Preprocessing is CPU work; keep it off the event loop
+            payload = await asyncio.to_thread(preprocess_pfd_image, tile)
+            try:
+                return _tile_findings(await _tile_chain(payload).ainvoke({}))
+            except Exception:
+                return {"equipment": [], "streams": []}  # One unreadable tile must not sink the rest
+
+    return await asyncio.gather(*(extract(tile) for tile in tiles))
+
+def _run(coroutine):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    # Called from inside an event loop: run the fan-out on its own loop in a worker thread
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
+
+def _normalize_tag(tag):
+    return TAG_SEPARATOR_RE.sub('-', str(tag).strip().upper())
+
+def _normalize_label(label):
+    return " ".join(str(label).lower().split())
+
+def _merge(records, identity, tag_fields):
+    merged = {}
+    for record in records:
+        record = {field: _normalize_tag(value) if field in tag_fields else value
+                  for field, value in record.items() if value not in (None, "")}
+        key = identity(record)
+        if not any(key):
+            continue
+        known = merged.setdefault(key, {})
+        # Neighboring tiles see the same item; keep the first non-empty value of each field
+        for field, value in record.items():
+            known.setdefault(field, value)
+    return list(merged.values())
+
+def merge_tile_findings(findings):
+    """One inventory from per-tile findings.
+
+    Equipment is deduplicated by normalized tag (P 101, p-101 → P-101). Streams are
+    deduplicated by their normalized (from, to, label): stream ids are not unique
+    across tiles, and unnumbered lines have none.
+    """
+    return {
+        "equipment": _merge((item for found in findings for item in found["equipment"]),
+                            lambda record: (record.get('id', ''),), ('id',)),
+        "streams": _merge((item for found in findings for item in found["streams"]),
+                          lambda record: (record.get('from', ''), record.get('to', ''),
+                                          _normalize_label(record.get('label', ''))), ('from', 'to')),
+    }
+
+def tile_inventory(image, pfd_key, concurrency=TILE_CONCURRENCY):
+    """Merged equipment/stream inventory of an oversized image, extracted once per pfd_key"""
+    key = llm_cache.make_key(LLM_MODEL, LLM_TEMPERATURE, TILE_PROMPT_VERSION, pfd_key, backend=LLM_BACKEND,
+                             tile_size=TILE_SIZE, overlap=TILE_OVERLAP, max_side=VISION_MAX_SIDE)
+
+    def extract():
+        tiles = image_tiles(image)
+        if not tiles:
+            return None
+        inventory = merge_tile_findings(_run(_extract_tiles(tiles, concurrency)))
+        if not inventory["equipment"] and not inventory["streams"]:
+            return None  # Nothing read (e.g. every tile request failed); not cached, retried next time
+        return json.dumps(inventory, ensure_ascii=False)
+    inventory = llm_cache.get_or_call(key, extract)
+    return json.loads(inventory) if inventory else None
+
+def inventory_text(inventory):
+    """Inventory as prompt text"""
+    lines = [f"Inventory read from full-resolution tiles of the drawing "
+             f"({len(inventory['equipment'])} equipment, {len(inventory['streams'])} streams):", "Equipment:"]
+    for equip in inventory["equipment"]:
+        lines.append(f"- {equip['id']}: {equip.get('type', '')} {equip.get('spec', '')}".rstrip())
+    lines.append("Streams:")
+    for stream in inventory["streams"]:
+        route = f" {stream.get('from', '?')} → {stream.get('to', '?')}" if stream.get('from') or stream.get('to') else ""
+        number = f" {stream['id']}:" if stream.get('id') else ""
+        lines.append(f"-{number}{route} {stream.get('label', '')}".rstrip())
+    return "\n".join(lines)
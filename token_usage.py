@@ -0,0 +1,102 @@
+import threading
+import time
+from collections import OrderedDict
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Rough size of a token for English prose and JSON; used only where the
+# provider reports no usage (stub backend) and for prompt budgets before a call
+CHARS_PER_TOKEN = 4
+# Calls kept for the per-call report
+RECENT_CALLS = 20
+
+def count_tokens(text):
+    """Estimated token count of text, computed locally (no API round trip)"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN if text else 0
+
+def _message_text(message):
+    content = getattr(message, 'content', message)
+    if isinstance(content, str):
+        return content
+    # Multimodal content: count the text parts; images are billed separately by the provider
+    return " ".join(part.get('text', '') if isinstance(part, dict) else str(part) for part in content)
+
+class UsageTracker:
+    """Input/output token counts per LLM call, totals per call name (flowsheet, chat, ...)"""
+
+    def __init__(self, recent_calls=RECENT_CALLS):
+        self.totals = OrderedDict()
+        self.recent = []
+        self.recent_calls = recent_calls
+        self._lock = threading.Lock()
+
+    def record(self, name, input_tokens, output_tokens, cached_tokens=0, estimated=False, seconds=None):
+        call = {"name": name, "input_tokens": input_tokens, "output_tokens": output_tokens,
+                "cached_tokens": cached_tokens, "estimated": estimated, "seconds": seconds}
+        with self._lock:
+            totals = self.totals.setdefault(name, {"calls": 0, "input_tokens": 0, "output_tokens": 0,
+                                                   "cached_tokens": 0})
+            totals["calls"] += 1
+            totals["input_tokens"] += input_tokens
+            totals["output_tokens"] += output_tokens
+            totals["cached_tokens"] += cached_tokens
+            self.recent.append(call)
+            del self.recent[:-self.recent_calls]
+        return call
+
+    def clear(self):
+        with self._lock:
+            self.totals.clear()
+            self.recent.clear()
+
+    def stats(self):
+        with self._lock:
+            by_name = {name: dict(totals) for name, totals in self.totals.items()}
+            return {
+                "calls": sum(totals["calls"] for totals in by_name.values()),
+                "input_tokens": sum(totals["input_tokens"] for totals in by_name.values()),
+                "output_tokens": sum(totals["output_tokens"] for totals in by_name.values()),
+                "cached_tokens": sum(totals["cached_tokens"] for totals in by_name.values()),
+                "by_name": by_name,
+                "last": dict(self.recent[-1]) if self.recent else None,
+            }
+
+class UsageCallback(BaseCallbackHandler):
+    """Records the token usage of every chat model call in a chain.
+
+    Uses the provider's usage_metadata when present (also on streamed answers),
+    and falls back to local estimates of the prompt and answer otherwise.
+    """
+
+    def __init__(self, name, tracker):
+        self.name = name
+        self.tracker = tracker
+        self._started = {}  # run_id -> (start time, estimated input tokens)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        estimate = sum(count_tokens(_message_text(message)) for batch in messages for message in batch)
+        self._started[run_id] = (time.perf_counter(), estimate)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started, input_estimate = self._started.pop(run_id, (None, 0))
+        seconds = time.perf_counter() - started if started is not None else None
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, 'message', None)
+                usage = getattr(message, 'usage_metadata', None)
+                if usage:
+                    details = usage.get('input_token_details') or {}
+                    self.tracker.record(self.name, usage.get('input_tokens', 0), usage.get('output_tokens', 0),
+                                        details.get('cache_read', 0), seconds=seconds)
+                else:
+                    self.tracker.record(self.name, input_estimate, count_tokens(generation.text),
+                                        estimated=True, seconds=seconds)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+
+def usage_callback(name):
+    """Callback handler that records a chain's token usage under name in usage_tracker"""
+    return UsageCallback(name, usage_tracker)
+
+# Process-wide usage counters shown in the app sidebar
+usage_tracker = UsageTracker()
@@ -0,0 +1,74 @@
+# One-time transcription of an uploaded PFD image into process_data, so later
+# questions about it take the text path (small text request) instead of
+# resending the image every turn.
+import json
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from flowsheet_json import parse_flowsheet, FlowsheetError
+from image_payloads import image_payloads
+from llm_cache import llm_cache
+from llm_clients import get_llm_client, LLM_MODEL, LLM_TEMPERATURE, LLM_BACKEND
+from pfd_fingerprint import fingerprint_store
+from tiled_vision import needs_tiling, tile_inventory, inventory_text
+from token_usage import usage_callback
+from vision_preprocess import VISION_MAX_SIDE
+
+# Bump when the extraction prompt changes so cached transcriptions are not reused
+EXTRACTION_PROMPT_VERSION = 2
+
+def _extraction_chain(payload, inventory):
+    text = "Transcribe this PFD."
+    if inventory:
+        text = f"{inventory_text(inventory)}\n\n{text}"
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """You transcribe a Process Flow Diagram image into JSON. Return only one JSON object:
+{{"equipment": [{{"id": "P-101", "type": "pump", "spec": "Feed Pump", "temperature": 25, "pressure": 3}}],
+ "streams": [{{"id": "S1", "from": "T-101", "to": "P-101", "flow": 100, "comp": "Water"}}]}}
+- Include every equipment item and every stream drawn, using the tags shown on the drawing
+- Use snake_case equipment types (pump, heat_exchanger, distillation_column, tank, reactor, compressor, separator, valve)
+- Give a stream an id like S1, S2, ... when the drawing shows none
+- Every stream's "from" and "to" must be equipment ids; add feed or product equipment (e.g. "Feed", "Product") for streams entering or leaving the drawing
+- Copy temperature, pressure and flow values that are shown, in °C, bar and kg/hr (convert values shown in other units); leave out every value that is not shown, including "flow"
+- Do not invent equipment, streams or values that are not on the drawing"""),
+        ("human", [
+            {"type": "text", "text": text},
+            {"type": "image_url", "image_url": {"url": payload.data_url}}
+        ])
+    ])
+    return (prompt | get_llm_client() | StrOutputParser()).with_config(callbacks=[usage_callback("vision extraction")])
+
+def _extraction_key(pfd_key):
+    return llm_cache.make_key(LLM_MODEL, LLM_TEMPERATURE, EXTRACTION_PROMPT_VERSION, pfd_key,
+                              backend=LLM_BACKEND, task="vision_extraction", max_side=VISION_MAX_SIDE)
+
+def extract_process_data(image, pfd_key, use_cache=True):
+    """process_data transcribed from a PFD image (PIL), once per pfd_key; None when it cannot be read.
+
+    Only transcriptions that pass flowsheet validation are cached (on disk, shared
+    by every worker), so a failed attempt is retried on the next call.
+    """
+    key = _extraction_key(pfd_key)
+
+    def call():
+        # A file confirmed to show the same drawing as an earlier upload reuses its transcription
+        source = fingerprint_store.same_drawing_key(pfd_key)
+        if source and use_cache:
+            transcription = llm_cache.get(_extraction_key(source))
+            if transcription:
+                return transcription
+        # Oversized scans are transcribed with the tags read from their full-resolution tiles
+        inventory = tile_inventory(image, pfd_key) if needs_tiling(image) else None
+        response = _extraction_chain(image_payloads.get_or_encode(pfd_key, image), inventory).invoke({})
+        try:
+            # Drawings often show no stream flows; those streams are kept without one
+            process_data = parse_flowsheet(response, require_flow=False)
+        except FlowsheetError:
+            return None
+        if not process_data['equipment']:
+            return None
+        return json.dumps(process_data, ensure_ascii=False)
+    try:
+        result = llm_cache.get_or_call(key, call, bypass=not use_cache)
+    except Exception:
+        return None  # Callers keep answering from the image
+    return json.loads(result) if result else None
@@ -0,0 +1,174 @@
+# Turns an uploaded PFD image into the payload sent to the vision model, once per
+# upload: cropped to the drawing, deskewed, reduced to a few colors and scaled
+# to the resolution the model actually looks at.
+import base64
+import math
+import os
+import time
+from io import BytesIO
+import cv2
+import numpy as np
+from PIL import Image
+
+# Longest side sent to the model; larger drawings are downscaled to it
+VISION_MAX_SIDE = int(os.getenv("PFD_VISION_MAX_SIDE", "2048"))
+# Cropping, skew and color analysis run on a thumbnail this big
+ANALYSIS_MAX_SIDE = 1200
+# Blank border (payload pixels) kept around the drawing
+CONTENT_MARGIN = 16
+# Rows/columns with fewer dark thumbnail pixels are scanner noise, not drawing
+NOISE_PIXELS = 2
+# Only skews in this range are corrected; smaller ones are not worth resampling
+MAX_DESKEW_DEGREES = 10.0
+MIN_DESKEW_DEGREES = 0.3
+# Drawings with fewer colored pixels than this share are binarized; others keep a small palette
+COLOR_PIXEL_SHARE = 0.005
+PALETTE_COLORS = 16
+
+class VisionPayload:
+    """Preprocessed, encoded image for the vision model (see preprocess_pfd_image)"""
+
+    def __init__(self, data, mime_type, size, original_size, crop_box, angle, seconds):
+        self.data = data
+        self.mime_type = mime_type
+        self.size = size
+        self.original_size = original_size
+        self.crop_box = crop_box
+        self.angle = angle
+        self.seconds = seconds
+        self._data_url = None
+
+    def __len__(self):
+        # Memory footprint for byte-bounded caches: the PNG plus its base64 data URL
+        return len(self.data) + (len(self._data_url) if self._data_url else 0)
+
+    @property
+    def data_url(self):
+        """data: URL of the payload, base64-encoded on first use only"""
+        if self._data_url is None:
+            self._data_url = f"data:{self.mime_type};base64,{base64.b64encode(self.data).decode()}"
+        return self._data_url
+
+def flatten_image(image):
+    # Transparent areas of PNG exports become white paper, not black
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        flat = Image.new("RGB", rgba.size, "white")
+        flat.paste(rgba, mask=rgba.getchannel("A"))
+        return flat
+    return image if image.mode in ("RGB", "L") else image.convert("RGB")
+
+def _ink_mask(gray):
+    """Dark (drawing) pixels of a grayscale array as a 0/255 mask, or None for a blank image"""
+    if gray.std() < 1.0:
+        return None
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    return mask
+
+def _content_box(mask):
+    """(left, top, right, bottom) of the drawing in mask coordinates, ignoring isolated specks"""
+    columns = np.flatnonzero(np.count_nonzero(mask, axis=0) >= NOISE_PIXELS)
+    rows = np.flatnonzero(np.count_nonzero(mask, axis=1) >= NOISE_PIXELS)
+    if not len(columns) or not len(rows):
+        return None
+    return columns[0], rows[0], columns[-1] + 1, rows[-1] + 1
+
+def _skew_angle(mask):
+    """Dominant deviation of the drawing's lines from horizontal/vertical, in degrees"""
+    side = max(mask.shape)
+    lines = cv2.HoughLinesP(mask, 1, np.pi / 1800, threshold=80, minLineLength=side // 8, maxLineGap=5)
+    if lines is None:
+        return 0.0
+    angles, weights = [], []
+    for x1, y1, x2, y2 in lines.reshape(-1, 4):
+        # Fold onto the nearest axis: vertical pipes and horizontal lines vote alike
+        angle = (math.degrees(math.atan2(y2 - y1, x2 - x1)) + 45.0) % 90.0 - 45.0
+        if abs(angle) <= MAX_DESKEW_DEGREES:
+            angles.append(angle)
+            weights.append(math.hypot(x2 - x1, y2 - y1))
+    if not angles:
+        return 0.0
+    # Length-weighted median, robust against diagonal arrows and text strokes
+    order = np.argsort(angles)
+    cumulative = np.cumsum(np.asarray(weights)[order])
+    return float(np.asarray(angles)[order][np.searchsorted(cumulative, cumulative[-1] / 2)])
+
+def _rotate(array, angle):
+    # Rotate on an enlarged white canvas so corners of the drawing are not cut off
+    height, width = array.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    new_width, new_height = int(height * sin + width * cos), int(height * cos + width * sin)
+    matrix[0, 2] += new_width / 2 - width / 2
+    matrix[1, 2] += new_height / 2 - height / 2
+    white = 255 if array.ndim == 2 else (255, 255, 255)
+    return cv2.warpAffine(array, matrix, (new_width, new_height), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=white)
+
+def _is_color(thumb):
+    if thumb.mode == "L":
+        return False
+    hsv = cv2.cvtColor(np.asarray(thumb), cv2.COLOR_RGB2HSV)
+    colored = (hsv[:, :, 1] > 60) & (hsv[:, :, 2] > 50)
+    return np.count_nonzero(colored) > COLOR_PIXEL_SHARE * colored.size
+
+def analysis_thumbnail(flat):
+    """(thumbnail, ink mask or None, full/thumbnail scale) of a flattened image.
+
+    Analysis runs on the thumbnail: a 200-megapixel scan is never decoded to arrays.
+    """
+    thumb = flat.copy()
+    thumb.thumbnail((ANALYSIS_MAX_SIDE, ANALYSIS_MAX_SIDE))
+    return thumb, _ink_mask(np.asarray(thumb.convert("L"))), flat.width / thumb.width
+
+def preprocess_pfd_image(image, max_side=VISION_MAX_SIDE):
+    """Crop, deskew, reduce and downscale a PIL image of a PFD; returns a VisionPayload.
+
+    Black-and-white drawings are binarized to a 1-bit PNG, colored ones keep a
+    PALETTE_COLORS palette, which is usually a small fraction of the original PNG.
+    """
+    started = time.perf_counter()
+    original_size = image.size
+    flat = flatten_image(image)
+
+    thumb, mask, scale = analysis_thumbnail(flat)
+    color = _is_color(thumb)
+    crop_box = (0, 0) + flat.size
+    angle = 0.0
+    if mask is not None:
+        box = _content_box(mask)
+        if box is not None:
+            left, top, right, bottom = box
+            mask = mask[top:bottom, left:right]
+            crop_box = (int(left * scale), int(top * scale),
+                        min(int(math.ceil(right * scale)), flat.width), min(int(math.ceil(bottom * scale)), flat.height))
+        angle = _skew_angle(mask)
+
+    cropped = flat.crop(crop_box)
+    factor = min(1.0, max_side / max(cropped.size))
+    if factor < 1.0:
+        size = (max(1, round(cropped.width * factor)), max(1, round(cropped.height * factor)))
+        cropped = cropped.resize(size, Image.LANCZOS, reducing_gap=3.0)
+    array = np.asarray(cropped.convert("RGB") if color else cropped.convert("L"))
+    if abs(angle) >= MIN_DESKEW_DEGREES:
+        array = _rotate(array, angle)
+    else:
+        angle = 0.0
+    white = 255 if array.ndim == 2 else (255, 255, 255)
+    array = cv2.copyMakeBorder(array, CONTENT_MARGIN, CONTENT_MARGIN, CONTENT_MARGIN, CONTENT_MARGIN,
+                               cv2.BORDER_CONSTANT, value=white)
+
+    if color:
+        reduced = Image.fromarray(array).quantize(PALETTE_COLORS, method=Image.Quantize.MEDIANCUT,
+                                                  dither=Image.Dither.NONE)
+    else:
+        _, binary = cv2.threshold(array, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        reduced = Image.fromarray(binary).convert("1", dither=Image.Dither.NONE)
+    buffer = BytesIO()
+    reduced.save(buffer, format="PNG", optimize=True)
+    return VisionPayload(buffer.getvalue(), "image/png", reduced.size, original_size, crop_box, angle,
+                         time.perf_counter() - started)
+
+def vision_payload(image):
+    """VisionPayload for image, which may already be one"""
+    return image if isinstance(image, VisionPayload) else preprocess_pfd_image(image)